@@ -0,0 +1,199 @@
+# ==============================================================================
+# ملف: cache_utils.py
+# الوصف: كاش في الذاكرة آمن للخيوط مع صلاحية زمنية (TTL) وحد أقصى للحجم
+# ==============================================================================
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def estimate_size(value):
+    """
+    تقدير تقريبي لحجم قيمة في الذاكرة بالبايت (القوائم والقواميس والصفوف بشكل متداخل)
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item) for item in value)
+    elif hasattr(value, 'items') and hasattr(value, 'keys'):
+        # صفوف DictCursor وما يشبهها
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return size
+
+
+class _Flight:
+    """تحميل جارٍ لمفتاح واحد ينتظره باقي الطالبين"""
+
+    __slots__ = ('event', 'value', 'ok')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.ok = False
+
+
+class TTLCache:
+    """
+    كاش key/value مع TTL لكل عنصر، وعند امتلاء الكاش يُحذف الأقدم استخداماً (LRU)
+
+    max_bytes (اختياري) حد إضافي للحجم التقريبي للقيم، يُحسب بـ sizeof عند set().
+    """
+
+    def __init__(self, max_entries=10000, default_ttl=60, max_bytes=None, sizeof=estimate_size):
+        self.max_entries = max(1, max_entries)
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes or None
+        self._sizeof = sizeof
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        # يزيد مع كل حذف/مسح حتى لا يحفظ تحميل بدأ قبله نتيجة قديمة
+        self._generation = 0
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'loads': 0,
+            'coalesced': 0,
+            'invalidated': 0
+        }
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.stats['misses'] += 1
+                return default
+
+            value, expires_at, size = entry
+            if expires_at <= now:
+                del self._data[key]
+                self._bytes -= size
+                self.stats['misses'] += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+        size = self._sizeof(value) if self.max_bytes else 0
+        with self._lock:
+            self._store(key, value, expires_at, size)
+
+    def _store(self, key, value, expires_at, size):
+        old = self._data.pop(key, _MISSING)
+        if old is not _MISSING:
+            self._bytes -= old[2]
+        self._data[key] = (value, expires_at, size)
+        self._bytes += size
+        while len(self._data) > self.max_entries or (
+                self.max_bytes and self._bytes > self.max_bytes and len(self._data) > 1):
+            _, evicted = self._data.popitem(last=False)
+            self._bytes -= evicted[2]
+            self.stats['evictions'] += 1
+
+    def get_or_load(self, key, loader, ttl=None, wait_timeout=30):
+        """
+        جلب القيمة أو تحميلها عبر loader() مرة واحدة فقط: الطلبات المتزامنة لنفس
+        المفتاح تنتظر نتيجة التحميل الجاري بدل تكراره (single-flight).
+        إذا فشل التحميل أو طال أكثر من wait_timeout يحمّل كل منتظر بنفسه.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                generation = self._generation
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            if flight.event.wait(wait_timeout) and flight.ok:
+                return flight.value
+            return loader()
+
+        try:
+            value = loader()
+            flight.value = value
+            flight.ok = True
+            expires_at = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+            size = self._sizeof(value) if self.max_bytes else 0
+            with self._lock:
+                self.stats['loads'] += 1
+                if generation == self._generation:
+                    self._store(key, value, expires_at, size)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            self._generation += 1
+            if entry is _MISSING:
+                return False
+            self._bytes -= entry[2]
+            return True
+
+    def invalidate(self, predicate):
+        """
+        حذف كل المفاتيح التي تحقق الشرط
+
+        Returns:
+            عدد العناصر المحذوفة
+        """
+        return self.invalidate_items(lambda key, value: predicate(key))
+
+    def invalidate_items(self, predicate):
+        """
+        مثل invalidate() لكن الشرط يستقبل (key, value) فيمكن الحذف حسب محتوى القيمة
+        """
+        with self._lock:
+            keys = [key for key, entry in self._data.items() if predicate(key, entry[0])]
+            for key in keys:
+                self._bytes -= self._data.pop(key)[2]
+            self._generation += 1
+            self.stats['invalidated'] += len(keys)
+        return len(keys)
+
+    def items(self):
+        """نسخة من العناصر غير المنتهية (key, value) بدون تغيير ترتيب الـ LRU"""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, entry[0]) for key, entry in self._data.items() if entry[1] > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self._generation += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_stats(self):
+        with self._lock:
+            stats = {
+                'size': len(self._data),
+                'max_entries': self.max_entries,
+                **self.stats
+            }
+            if self.max_bytes:
+                stats['bytes'] = self._bytes
+                stats['max_bytes'] = self.max_bytes
+            return stats
@@ -0,0 +1,128 @@
+# ==============================================================================
+# ملف: category_registry.py
+# الوصف: شجرة التصنيفات في الذاكرة مع رقم إصدار مشترك بين الـ workers
+# ==============================================================================
+#
+# - رقم الإصدار محفوظ في bot_settings (categories_version) ويُزاد مع كل تعديل على
+#   التصنيفات (add_category، delete_category_by_id، ...)
+# - الـ worker الذي عدّل يعيد التحميل فوراً ويرسل الإصدار الجديد عبر NOTIFY
+# - باقي الـ workers يعيدون التحميل عند الإشعار، أو عند فحص الإصدار الدوري
+#   (CATEGORY_VERSION_CHECK_SECONDS) إذا فاتهم الإشعار أو كان NOTIFY معطلاً
+# - القيم المشتقة (مثل build_category_tree) تُحسب مرة واحدة لكل إصدار عبر derived()
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# أقل مدة بين محاولات التحميل بعد الفشل
+RETRY_INTERVAL = 10
+
+
+class CategorySnapshot:
+    """
+    نسخة ثابتة من جدول categories (لا تُعدّل بعد إنشائها)
+    """
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.categories = sorted((dict(row) for row in rows), key=lambda cat: cat['name'])
+        self.by_id = {cat['id']: cat for cat in self.categories}
+        self.children = {}
+        for cat in self.categories:
+            self.children.setdefault(cat.get('parent_id'), []).append(cat)
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+    def derived(self, name, builder):
+        """قيمة محسوبة من التصنيفات، تُحفظ حتى الإصدار التالي"""
+        try:
+            return self._derived[name]
+        except KeyError:
+            pass
+        with self._derived_lock:
+            if name not in self._derived:
+                self._derived[name] = builder(self.categories)
+            return self._derived[name]
+
+
+class CategoryTreeRegistry:
+    """
+    القراءة من الذاكرة O(1) حسب المعرف أو الأب؛ إعادة التحميل عند تغير الإصدار فقط.
+    """
+
+    def __init__(self, loader, version_loader, check_interval=60):
+        self._loader = loader
+        self._version_loader = version_loader
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._last_check = 0
+        self._last_failure = 0
+        self.stats = {
+            'loads': 0,
+            'load_errors': 0,
+            'version_checks': 0,
+            'loaded_at': None
+        }
+
+    def snapshot(self):
+        """
+        النسخة الحالية (أو None إذا تعذر التحميل)
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            if self.check_interval and time.monotonic() - self._last_check >= self.check_interval:
+                self._check_version()
+            return self._snapshot
+
+        with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            if time.monotonic() - self._last_failure < RETRY_INTERVAL:
+                return None
+        return self.reload()
+
+    def _check_version(self):
+        self._last_check = time.monotonic()
+        try:
+            version = self._version_loader()
+        except Exception as e:
+            logger.error(f"Failed to check categories version: {e}")
+            return
+        self.stats['version_checks'] += 1
+        if self._snapshot is None or version != self._snapshot.version:
+            self.reload()
+
+    def reload(self, payload=None):
+        """
+        إعادة تحميل التصنيفات. payload هو الإصدار من إشعار NOTIFY: إذا كان مطابقاً
+        للنسخة الحالية لا حاجة للتحميل. عند الفشل تبقى النسخة السابقة كما هي.
+        """
+        with self._lock:
+            if payload and self._snapshot is not None and payload == self._snapshot.version:
+                return self._snapshot
+            try:
+                version, rows = self._loader()
+            except Exception as e:
+                self._last_failure = time.monotonic()
+                self.stats['load_errors'] += 1
+                logger.error(f"Failed to load categories: {e}")
+                return self._snapshot
+
+            self._snapshot = CategorySnapshot(version, rows)
+            self._last_check = time.monotonic()
+            self.stats['loads'] += 1
+            self.stats['loaded_at'] = time.time()
+            logger.info(f"Category registry loaded (version {version}, {len(self._snapshot.categories)} categories)")
+            return self._snapshot
+
+    def get_stats(self):
+        snapshot = self._snapshot
+        return {
+            'loaded': snapshot is not None,
+            'version': snapshot.version if snapshot is not None else None,
+            'count': len(snapshot.categories) if snapshot is not None else 0,
+            **self.stats
+        }
@@ -0,0 +1,73 @@
+# ==============================================================================
+# ملف: channel_registry.py
+# الوصف: سجل القنوات المطلوبة في الذاكرة - يُحمّل مرة واحدة ويُحدّث عند التغيير
+# ==============================================================================
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# أقل مدة بين محاولات التحميل بعد الفشل
+RETRY_INTERVAL = 10
+
+
+class RequiredChannelsRegistry:
+    """
+    نسخة في الذاكرة من جدول required_channels.
+    القراءة لا تلمس قاعدة البيانات؛ إعادة التحميل تتم عند الإضافة/الحذف أو عند إشعار من worker آخر.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._channels = None
+        self._lock = threading.Lock()
+        self._last_failure = 0
+        self.stats = {
+            'loads': 0,
+            'load_errors': 0,
+            'loaded_at': None
+        }
+
+    def get(self):
+        """
+        جلب القنوات المطلوبة (قائمة dicts)
+        """
+        channels = self._channels
+        if channels is not None:
+            return channels
+
+        with self._lock:
+            if self._channels is not None:
+                return self._channels
+            if time.monotonic() - self._last_failure < RETRY_INTERVAL:
+                return []
+        return self.reload() or []
+
+    def reload(self, payload=None):
+        """
+        إعادة تحميل القنوات من قاعدة البيانات.
+        عند الفشل تبقى النسخة السابقة كما هي.
+        """
+        with self._lock:
+            try:
+                rows = self._loader()
+            except Exception as e:
+                self._last_failure = time.monotonic()
+                self.stats['load_errors'] += 1
+                logger.error(f"Failed to load required channels: {e}")
+                return self._channels
+
+            self._channels = [dict(row) for row in rows]
+            self.stats['loads'] += 1
+            self.stats['loaded_at'] = time.time()
+            logger.info(f"Required channels registry loaded ({len(self._channels)} channels)")
+            return self._channels
+
+    def get_stats(self):
+        return {
+            'loaded': self._channels is not None,
+            'count': len(self._channels) if self._channels is not None else 0,
+            **self.stats
+        }
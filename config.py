@@ -5,6 +5,7 @@
 # ==============================================================================
 
 import os
+import tempfile
 from urllib.parse import urlparse
 
 # ==============================================================================
@@ -26,6 +27,15 @@ else:
 # Connection Pool Settings
 DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
 DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '20'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))  # ثانية انتظار لاتصال حر
+DB_POOL_MAX_LIFETIME = int(os.environ.get('DB_POOL_MAX_LIFETIME', '1800'))        # إعادة تدوير الاتصال بعد 30 دقيقة
+DB_POOL_CHECK_IDLE_AFTER = int(os.environ.get('DB_POOL_CHECK_IDLE_AFTER', '30'))  # فحص الاتصال إذا بقي خاملاً أكثر من ذلك
+
+# Prepared statements على الخادم (يجب تعطيلها خلف PgBouncer بوضع transaction)
+DB_USE_PREPARED_STATEMENTS = os.environ.get('DB_USE_PREPARED_STATEMENTS', 'true').lower() == 'true'
+
+# نشر التغييرات بين الـ workers عبر LISTEN/NOTIFY
+ENABLE_DB_NOTIFY = os.environ.get('ENABLE_DB_NOTIFY', 'true').lower() == 'true'
 
 # ==============================================================================
 # Bot Configuration
@@ -42,6 +52,21 @@ WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', 'default_secret')
 APP_URL = os.environ.get('APP_URL') or os.environ.get('BASE_URL')
 PORT = int(os.environ.get('PORT', '10000'))
 
+# ==============================================================================
+# Update Processing Settings
+# ==============================================================================
+# sync: معالجة التحديث داخل طلب الـ webhook | async: الرد فوراً والمعالجة في الخلفية
+UPDATE_PROCESSING_MODE = os.environ.get('UPDATE_PROCESSING_MODE', 'sync').lower()
+# كل عامل يملك مساراً تسلسلياً: تحديثات المستخدم الواحد تبقى مرتبة
+UPDATE_WORKERS = int(os.environ.get('UPDATE_WORKERS', '8'))
+UPDATE_QUEUE_SIZE = int(os.environ.get('UPDATE_QUEUE_SIZE', '1000'))
+UPDATE_QUEUE_RETRY_AFTER = int(os.environ.get('UPDATE_QUEUE_RETRY_AFTER', '2'))  # ثانية
+
+# منع تكرار التحديثات: memory (لكل worker) | postgres (مشترك بين الـ workers) | off
+UPDATE_DEDUP_BACKEND = os.environ.get('UPDATE_DEDUP_BACKEND', 'memory').lower()
+UPDATE_DEDUP_WINDOW = int(os.environ.get('UPDATE_DEDUP_WINDOW', '600'))  # ثانية
+UPDATE_DEDUP_MAX_SIZE = int(os.environ.get('UPDATE_DEDUP_MAX_SIZE', '10000'))
+
 # ==============================================================================
 # Pagination Settings
 # ==============================================================================
@@ -53,6 +78,76 @@ COMMENTS_PER_PAGE = int(os.environ.get('COMMENTS_PER_PAGE', '10'))
 # ==============================================================================
 INLINE_CACHE_TIME = int(os.environ.get('INLINE_CACHE_TIME', '300'))  # 5 minutes
 SEARCH_CACHE_TIME = int(os.environ.get('SEARCH_CACHE_TIME', '60'))   # 1 minute
+SEARCH_CACHE_MAX_SIZE = int(os.environ.get('SEARCH_CACHE_MAX_SIZE', '1000'))  # عدد نتائج البحث المحفوظة
+SEARCH_CACHE_MAX_BYTES = int(os.environ.get('SEARCH_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))  # حد الحجم التقريبي
+# كاش نتائج الـ inline الجاهزة (بعد التحويل إلى JSON) حسب (البحث المطبّع، offset)
+INLINE_RESULT_CACHE_TTL = int(os.environ.get('INLINE_RESULT_CACHE_TTL', str(INLINE_CACHE_TIME)))
+INLINE_RESULT_CACHE_MAX_SIZE = int(os.environ.get('INLINE_RESULT_CACHE_MAX_SIZE', '2000'))
+INLINE_RESULT_CACHE_MAX_BYTES = int(os.environ.get('INLINE_RESULT_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+# البحث أثناء الكتابة: تصفية مجموعة نتائج بادئة سابقة بدل استعلام جديد، وتجاهل
+# استعلامات المستخدم التي تجاوزها استعلام أحدث قبل بدء معالجتها
+INLINE_PREFIX_REUSE = os.environ.get('INLINE_PREFIX_REUSE', 'true').lower() == 'true'
+INLINE_PREFIX_MIN_LENGTH = int(os.environ.get('INLINE_PREFIX_MIN_LENGTH', '3'))
+INLINE_PREFIX_MAX_CANDIDATES = int(os.environ.get('INLINE_PREFIX_MAX_CANDIDATES', '500'))  # أكبر مجموعة تُحفظ كاملة
+INLINE_PREFIX_CACHE_MAX_SIZE = int(os.environ.get('INLINE_PREFIX_CACHE_MAX_SIZE', '200'))
+# بعد بحث واسع (أكثر من MAX_CANDIDATES) لا تُجلب المجموعة لامتداداته حتى هذا العدد من الأحرف
+INLINE_PREFIX_BROAD_SKIP_CHARS = int(os.environ.get('INLINE_PREFIX_BROAD_SKIP_CHARS', '3'))
+INLINE_COALESCE_ENABLED = os.environ.get('INLINE_COALESCE_ENABLED', 'true').lower() == 'true'
+# اقتراحات أسماء المسلسلات للبحث القصير في الـ inline (بدل البحث في العناوين)
+SERIES_TYPEAHEAD_ENABLED = os.environ.get('SERIES_TYPEAHEAD_ENABLED', 'true').lower() == 'true'
+SERIES_TYPEAHEAD_MAX_LENGTH = int(os.environ.get('SERIES_TYPEAHEAD_MAX_LENGTH', '2'))   # أطول بادئة تُعرض لها الاقتراحات
+SERIES_TYPEAHEAD_LIMIT = int(os.environ.get('SERIES_TYPEAHEAD_LIMIT', '10'))
+SERIES_INDEX_REFRESH_SECONDS = int(os.environ.get('SERIES_INDEX_REFRESH_SECONDS', '1800'))  # إعادة بناء كاملة دورية
+
+# استراتيجية البحث: ilike (الحالي) / fts (Full-Text Search) / ab (تقسيم بينهما للمقارنة)
+SEARCH_STRATEGY = os.environ.get('SEARCH_STRATEGY', 'ilike').lower()
+SEARCH_AB_FTS_PERCENT = int(os.environ.get('SEARCH_AB_FTS_PERCENT', '50'))  # نسبة fts في وضع ab
+SEARCH_BACKFILL_BATCH_SIZE = int(os.environ.get('SEARCH_BACKFILL_BATCH_SIZE', '500'))
+
+# بحث الـ inline: sql (استعلام لكل ضغطة مفتاح) / memory (فهرس في ذاكرة كل worker)
+INLINE_SEARCH_BACKEND = os.environ.get('INLINE_SEARCH_BACKEND', 'sql').lower()
+INLINE_INDEX_REFRESH_SECONDS = int(os.environ.get('INLINE_INDEX_REFRESH_SECONDS', '900'))  # إعادة بناء كاملة (المشاهدات والتقييمات)
+
+# كاش التحقق من الاشتراك في القنوات (لكل مستخدم وقناة)
+SUBSCRIPTION_CACHE_POSITIVE_TTL = int(os.environ.get('SUBSCRIPTION_CACHE_POSITIVE_TTL', '600'))  # مشترك
+SUBSCRIPTION_CACHE_NEGATIVE_TTL = int(os.environ.get('SUBSCRIPTION_CACHE_NEGATIVE_TTL', '30'))   # غير مشترك
+SUBSCRIPTION_CACHE_MAX_SIZE = int(os.environ.get('SUBSCRIPTION_CACHE_MAX_SIZE', '50000'))
+
+# كاش الأعداد الإجمالية للقوائم المرقمة (منفصل عن صفوف الصفحات)
+COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL', '120'))  # 2 minutes
+COUNT_CACHE_MAX_SIZE = int(os.environ.get('COUNT_CACHE_MAX_SIZE', '5000'))
+# نتائج البحث التي يقدّرها الـ planner بهذا العدد أو أكثر تستخدم التقدير بدل COUNT(*) (0 = تعطيل)
+COUNT_ESTIMATE_THRESHOLD = int(os.environ.get('COUNT_ESTIMATE_THRESHOLD', '5000'))
+
+# تجميع عدادات المشاهدة وسجل المشاهدة في الذاكرة وكتابتها دفعة واحدة (write_behind.py)
+WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', 'true').lower() == 'true'
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL', '5'))  # ثانية
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', '1000'))       # كتابة فورية عند بلوغه
+# ملفات النبض لكشف نافذة الفقد بعد توقف مفاجئ
+WRITE_BEHIND_STATE_DIR = os.environ.get('WRITE_BEHIND_STATE_DIR') or os.path.join(tempfile.gettempdir(), 'video-bot')
+
+# قوائم الفيديوهات الشائعة في الذاكرة (leaderboards.py)
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', '100'))                              # فيديوهات لكل قائمة
+LEADERBOARD_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', '300'))         # تحديث كامل دوري
+LEADERBOARD_MIN_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_MIN_REFRESH_SECONDS', '30'))  # أقل فاصل للتحديث المبكر
+
+# شجرة التصنيفات في الذاكرة: فحص رقم الإصدار المشترك (احتياطاً إذا فات إشعار NOTIFY)
+CATEGORY_VERSION_CHECK_SECONDS = int(os.environ.get('CATEGORY_VERSION_CHECK_SECONDS', '60'))
+
+# لوحات المفاتيح الثابتة وقوائم التصنيفات المحوّلة مسبقاً إلى JSON
+MARKUP_CACHE_MAX_SIZE = int(os.environ.get('MARKUP_CACHE_MAX_SIZE', '512'))
+MARKUP_CACHE_TTL = int(os.environ.get('MARKUP_CACHE_TTL', '3600'))  # احتياطي؛ التغيير الفعلي عبر إصدار التصنيفات
+
+# كاش حالات المستخدمين في state_manager (الإبطال بين الـ workers عبر NOTIFY)
+STATE_CACHE_TTL = int(os.environ.get('STATE_CACHE_TTL', '300'))                    # مستخدم لديه حالة
+STATE_CACHE_NEGATIVE_TTL = int(os.environ.get('STATE_CACHE_NEGATIVE_TTL', '30'))   # مستخدم بدون حالة
+STATE_CACHE_MAX_SIZE = int(os.environ.get('STATE_CACHE_MAX_SIZE', '50000'))
+
+# جلسات المحادثة (آخر بحث، خطوات الآدمن): memory (لكل worker) | postgres | redis (مشتركة بين الـ workers)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'memory').lower()
+SESSION_TTL = int(os.environ.get('SESSION_TTL', '1800'))            # 30 دقيقة
+SESSION_MAX_SIZE = int(os.environ.get('SESSION_MAX_SIZE', '10000'))  # لـ memory فقط
+SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL')
 
 # ==============================================================================
 # UI Constants
@@ -0,0 +1,128 @@
+# ==============================================================================
+# ملف: count_service.py
+# الوصف: خدمة الأعداد الإجمالية للقوائم المرقمة بدون COUNT(*) مع كل صفحة
+# ==============================================================================
+#
+# - أعداد فيديوهات التصنيفات: جدول category_video_counts يحدّثه trigger في
+#   Postgres عند الإضافة/النقل/الحذف (انظر CATEGORY_COUNTS_DDL في db_manager)
+# - نتائج البحث النصي الكبيرة: تقدير الـ planner من EXPLAIN بدلاً من العد الدقيق
+# - كل الأعداد تُحفظ في كاش منفصل عن صفوف الصفحات، فالتنقل بين الصفحات لا يعيد العد
+#
+# الكاش محلي لكل process: الإبطال الصريح يتم في نفس الـ process، والـ TTL القصير
+# يحد من قِدم العدد في الـ workers الأخرى.
+
+import json
+import logging
+import threading
+
+import config
+from cache_utils import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def extract_plan_rows(plan):
+    """
+    استخراج عدد الصفوف المقدّر من ناتج EXPLAIN (FORMAT JSON)
+
+    Returns:
+        int أو None إذا تعذرت قراءة الخطة
+    """
+    try:
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    except (ValueError, TypeError, KeyError, IndexError):
+        return None
+
+
+class CountService:
+    """
+    كاش للأعداد الإجمالية مفاتيحه tuples تبدأ بنطاق (namespace):
+        ('search', query, category_id, quality, status)
+        ('favorites', user_id)
+    """
+
+    def __init__(self, ttl=120, estimate_threshold=5000, max_entries=5000):
+        self.estimate_threshold = estimate_threshold
+        self._totals = TTLCache(max_entries=max_entries, default_ttl=ttl)
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'exact': 0,
+            'estimated': 0,
+            'failures': 0
+        }
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get_total(self, key, exact, estimate=None):
+        """
+        العدد الإجمالي من الكاش، أو حسابه وحفظه.
+
+        Args:
+            key: مفتاح العدد (لا يتضمن رقم الصفحة أو المؤشر)
+            exact: دالة تعيد العدد الدقيق (أو None عند الفشل)
+            estimate: دالة اختيارية تعيد تقدير الـ planner؛ يُعتمد التقدير إذا
+                      بلغ estimate_threshold وإلا يُحسب العدد الدقيق
+
+        Returns:
+            int (0 عند الفشل، ولا يُحفظ الفشل في الكاش)
+        """
+        cached = self._totals.get(key)
+        if cached is not None:
+            return cached
+
+        total = None
+        if estimate is not None and self.estimate_threshold > 0:
+            estimated = estimate()
+            if estimated is not None and estimated >= self.estimate_threshold:
+                total = estimated
+                self._count('estimated')
+
+        if total is None:
+            total = exact()
+            if total is None:
+                self._count('failures')
+                return 0
+            self._count('exact')
+
+        self._totals.set(key, total)
+        return total
+
+    def invalidate(self, namespace, *prefix):
+        """
+        إبطال كل الأعداد في نطاق معين (أو جزء منه)، مثل invalidate('favorites', user_id)
+
+        Returns:
+            عدد العناصر المحذوفة
+        """
+        match = (namespace,) + prefix
+        return self._totals.invalidate(
+            lambda key: isinstance(key, tuple) and key[:len(match)] == match
+        )
+
+    def clear(self):
+        self._totals.clear()
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {
+            'estimate_threshold': self.estimate_threshold,
+            'cache': self._totals.get_stats(),
+            **stats
+        }
+
+
+# مثيل عام للخدمة
+count_service = CountService(
+    ttl=config.COUNT_CACHE_TTL,
+    estimate_threshold=config.COUNT_ESTIMATE_THRESHOLD,
+    max_entries=config.COUNT_CACHE_MAX_SIZE
+)
+
+
+def get_count_stats():
+    return count_service.get_stats()
@@ -0,0 +1,168 @@
+# ==============================================================================
+# ملف: db_listener.py
+# الوصف: نشر التغييرات بين الـ workers عبر Postgres LISTEN/NOTIFY
+# ==============================================================================
+
+import logging
+import os
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import sql
+
+import config
+import db_pool
+
+logger = logging.getLogger(__name__)
+
+# مهلة انتظار الإشعارات قبل فحص القنوات الجديدة
+POLL_TIMEOUT = 5
+MAX_RECONNECT_DELAY = 60
+
+
+class DbChangeListener:
+    """
+    يستمع لقنوات Postgres في خيط خلفي (واحد لكل process) ويستدعي الدوال المسجلة عند كل إشعار.
+    عند (إعادة) الاتصال تُستدعى الدوال بـ payload=None لأن إشعارات قد تكون فاتت.
+    """
+
+    def __init__(self):
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.enabled = config.ENABLE_DB_NOTIFY
+        self.stats = {
+            'notifications': 0,
+            'reconnects': 0,
+            'last_error': None
+        }
+
+    def subscribe(self, channel, callback):
+        """
+        تسجيل دالة تُستدعى عند وصول إشعار على القناة: callback(payload)
+        """
+        with self._lock:
+            self._callbacks.setdefault(channel, []).append(callback)
+
+    def ensure_started(self):
+        """
+        تشغيل خيط الاستماع في الـ process الحالي إن لم يكن يعمل (الخيوط لا تنتقل عبر fork)
+        """
+        if not self.enabled or (self._pid == os.getpid() and self._thread and self._thread.is_alive()):
+            return
+
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            if not getattr(db_pool, 'DB_CONFIG', None):
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="db-listener", daemon=True)
+            self._thread.start()
+
+    def notify(self, channel, payload=''):
+        """
+        إرسال إشعار لكل الـ workers (يتجاهله الـ process المرسل لأنه طبق التغيير محلياً)
+        """
+        if not self.enabled:
+            return False
+        try:
+            with db_pool.get_db_connection() as conn:
+                with conn.cursor() as c:
+                    c.execute("SELECT pg_notify(%s, %s)", (channel, f"{os.getpid()}:{payload}"))
+                conn.commit()
+            return True
+        except psycopg2.Error as e:
+            logger.error(f"Failed to send notification on '{channel}': {e}")
+            return False
+
+    def _dispatch(self, channel, payload):
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, []))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"Error in change listener for '{channel}': {e}", exc_info=True)
+
+    def _resync_all(self):
+        with self._lock:
+            channels = list(self._callbacks.keys())
+        for channel in channels:
+            self._dispatch(channel, None)
+
+    def _run(self):
+        delay = 1
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**db_pool.DB_CONFIG)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                listening = set()
+                resynced = False
+                delay = 1
+
+                while True:
+                    with self._lock:
+                        channels = set(self._callbacks.keys())
+                    with conn.cursor() as c:
+                        for channel in channels - listening:
+                            c.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                            listening.add(channel)
+
+                    # المزامنة بعد LISTEN حتى لا يفوتنا أي تغيير بينهما
+                    if not resynced:
+                        self._resync_all()
+                        resynced = True
+
+                    if select.select([conn], [], [], POLL_TIMEOUT) == ([], [], []):
+                        continue
+
+                    conn.poll()
+                    while conn.notifies:
+                        notification = conn.notifies.pop(0)
+                        sender_pid, _, payload = notification.payload.partition(':')
+                        if sender_pid == str(os.getpid()):
+                            continue
+                        self.stats['notifications'] += 1
+                        self._dispatch(notification.channel, payload)
+
+            except Exception as e:
+                self.stats['reconnects'] += 1
+                self.stats['last_error'] = str(e)
+                logger.warning(f"DB listener connection lost: {e}. Reconnecting in {delay}s")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def get_stats(self):
+        with self._lock:
+            channels = sorted(self._callbacks.keys())
+        return {
+            'enabled': self.enabled,
+            'running': bool(self._pid == os.getpid() and self._thread and self._thread.is_alive()),
+            'channels': channels,
+            **self.stats
+        }
+
+
+# إنشاء مثيل عام
+db_listener = DbChangeListener()
+
+
+def subscribe_to_changes(channel, callback):
+    """دالة مساعدة لتسجيل مستمع على قناة"""
+    db_listener.subscribe(channel, callback)
+
+
+def notify_change(channel, payload=''):
+    """دالة مساعدة لإرسال إشعار تغيير لباقي الـ workers"""
+    return db_listener.notify(channel, payload)
@@ -15,21 +15,31 @@ from functools import lru_cache
 
 # Import connection pool functions from db_pool module
 from db_pool import get_db_connection, get_connection_pool
+from db_listener import db_listener
+from channel_registry import RequiredChannelsRegistry
+from category_registry import CategoryTreeRegistry
+from cache_utils import TTLCache
+from pagination import AFTER, decode_cursor, keyset_clause
+from count_service import count_service, extract_plan_rows
+from search_engine import TS_CONFIG, normalize_arabic, parse_search_query, query_may_match, search_strategy
 
 logger = logging.getLogger(__name__)
 
-# إعدادات الـ Pool المحسنة - نُستخدم في db_pool
-DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '2'))  # زيادة الحد الأدنى
-DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '20'))
+# إعدادات الـ Pool - المصدر الوحيد هو config.py (تُستخدم في db_pool)
+from config import DB_POOL_MIN, DB_POOL_MAX, DB_USE_PREPARED_STATEMENTS, CATEGORY_VERSION_CHECK_SECONDS
+from config import SEARCH_CACHE_TIME, SEARCH_CACHE_MAX_SIZE, SEARCH_CACHE_MAX_BYTES
 
 VIDEOS_PER_PAGE = 10
 CALLBACK_DELIMITER = "::"
 admin_steps = {}
 user_last_search = {}
 
-# Cache للبحث السريع (يحفظ آخر 100 بحث لمدة 60 ثانية)
-_search_cache = {}
-_search_cache_ttl = 60  # ثانية
+# Cache للبحث السريع: LRU + TTL محدود بعدد النتائج وحجمها، مع single-flight للبحث المتكرر
+_search_cache = TTLCache(
+    max_entries=SEARCH_CACHE_MAX_SIZE,
+    default_ttl=SEARCH_CACHE_TIME,
+    max_bytes=SEARCH_CACHE_MAX_BYTES
+)
 
 
 # --- هيكل قاعدة البيانات المتوقع (مصدر الحقيقة) ---
@@ -47,7 +57,14 @@ EXPECTED_SCHEMA = {
         'upload_date': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
         'grouping_key': 'TEXT',
         'thumbnail_file_id': 'TEXT',
-        'content_type': 'TEXT DEFAULT NULL'  # VIDEO or DOCUMENT
+        'content_type': 'TEXT DEFAULT NULL',  # VIDEO or DOCUMENT
+        'search_vector': 'TSVECTOR',  # يُحدّث عبر trigger (انظر SEARCH_VECTOR_DDL)
+        # نسخ مطبّعة (normalize_arabic) من العنوان واسم الملف يستخدمها البحث
+        'normalized_caption': 'TEXT',
+        'normalized_file_name': 'TEXT',
+        # مجموع وعدد التقييمات (يُحدّثان عبر trigger على video_ratings، انظر RATING_AGGREGATES_DDL)
+        'rating_sum': 'BIGINT NOT NULL DEFAULT 0',
+        'rating_count': 'INTEGER NOT NULL DEFAULT 0'
     },
     'required_channels': {
         'channel_id': 'BIGINT PRIMARY KEY',
@@ -57,7 +74,8 @@ EXPECTED_SCHEMA = {
         'id': 'SERIAL PRIMARY KEY',
         'name': 'TEXT NOT NULL',
         'parent_id': 'INTEGER REFERENCES categories(id) ON DELETE CASCADE',
-        'full_path': 'TEXT NOT NULL'
+        'full_path': 'TEXT NOT NULL',
+        'normalized_name': 'TEXT'
     },
     'bot_users': {
         'user_id': 'BIGINT PRIMARY KEY',
@@ -105,12 +123,150 @@ EXPECTED_SCHEMA = {
         'is_read': 'BOOLEAN DEFAULT FALSE',
         'replied_at': 'TIMESTAMP',
         'created_at': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP'
+    },
+    'processed_updates': {
+        'update_id': 'BIGINT NOT NULL',
+        'received_at': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
+        '_UNIQUE_CONSTRAINT': 'UNIQUE(update_id)'
+    },
+    'category_video_counts': {
+        'category_id': 'INTEGER NOT NULL',
+        'video_count': 'BIGINT NOT NULL DEFAULT 0',
+        '_UNIQUE_CONSTRAINT': 'UNIQUE(category_id)'
     }
 }
 
+# --- عدّاد فيديوهات كل تصنيف: يُحدّث داخل نفس الـ transaction عبر trigger ---
+# يغطي كل مسارات التعديل (add_video، النقل الفردي والجماعي، الحذف، ON DELETE SET NULL)
+CATEGORY_COUNTS_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION sync_category_video_counts() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            IF OLD.category_id IS NOT NULL THEN
+                UPDATE category_video_counts SET video_count = video_count - 1
+                WHERE category_id = OLD.category_id;
+            END IF;
+            RETURN NULL;
+        END IF;
+
+        IF TG_OP = 'UPDATE' THEN
+            IF NEW.category_id IS NOT DISTINCT FROM OLD.category_id THEN
+                RETURN NULL;
+            END IF;
+            IF OLD.category_id IS NOT NULL THEN
+                UPDATE category_video_counts SET video_count = video_count - 1
+                WHERE category_id = OLD.category_id;
+            END IF;
+        END IF;
+
+        IF NEW.category_id IS NOT NULL THEN
+            INSERT INTO category_video_counts (category_id, video_count) VALUES (NEW.category_id, 1)
+            ON CONFLICT (category_id) DO UPDATE SET video_count = category_video_counts.video_count + 1;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS video_archive_category_counts ON video_archive",
+    """
+    CREATE TRIGGER video_archive_category_counts
+    AFTER INSERT OR DELETE OR UPDATE OF category_id ON video_archive
+    FOR EACH ROW EXECUTE PROCEDURE sync_category_video_counts()
+    """
+]
+
+# --- مجموع وعدد تقييمات كل فيديو على video_archive بدلاً من AVG/COUNT عند كل قراءة ---
+# يغطي إضافة التقييم وتعديله (add_video_rating) وحذفه (delete_bot_user)
+RATING_AGGREGATES_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION sync_video_rating_aggregates() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' AND NEW.video_id IS NOT DISTINCT FROM OLD.video_id THEN
+            IF NEW.rating IS DISTINCT FROM OLD.rating THEN
+                UPDATE video_archive SET
+                    rating_sum = rating_sum + COALESCE(NEW.rating, 0) - COALESCE(OLD.rating, 0),
+                    rating_count = rating_count + (NEW.rating IS NOT NULL)::int - (OLD.rating IS NOT NULL)::int
+                WHERE id = NEW.video_id;
+            END IF;
+            RETURN NULL;
+        END IF;
+
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.rating IS NOT NULL THEN
+            UPDATE video_archive SET rating_sum = rating_sum - OLD.rating, rating_count = rating_count - 1
+            WHERE id = OLD.video_id;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'INSERT') AND NEW.rating IS NOT NULL THEN
+            UPDATE video_archive SET rating_sum = rating_sum + NEW.rating, rating_count = rating_count + 1
+            WHERE id = NEW.video_id;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS video_ratings_aggregates ON video_ratings",
+    """
+    CREATE TRIGGER video_ratings_aggregates
+    AFTER INSERT OR UPDATE OR DELETE ON video_ratings
+    FOR EACH ROW EXECUTE PROCEDURE sync_video_rating_aggregates()
+    """
+]
+
+# متوسط التقييم من الأعمدة المخزنة (0 للفيديو بدون تقييمات)
+AVG_RATING_SQL = "COALESCE(v.rating_sum::float / NULLIF(v.rating_count, 0), 0)"
+
+# أعمدة قوائم الفيديوهات (البحث، التصنيفات، المفضلة، السجل) كما تعرضها الأزرار:
+# بدون search_vector والأعمدة المطبّعة التي لا يحتاجها العرض
+VIDEO_LIST_COLUMNS = "v.id, v.message_id, v.chat_id, v.caption, v.file_name, v.metadata, v.view_count"
+
+# نصوص البحث بـ ILIKE: المطبّعة، أو الأصلية للصفوف التي لم يصلها التطبيع بعد (قبل أن يمر
+# عليها start_search_backfill، أو أُضيفت من خارج add_video). نفس التعابير مفهرسة بـ trgm في db_optimizer
+SEARCH_CAPTION_SQL = "COALESCE(v.normalized_caption, v.caption)"
+SEARCH_FILE_NAME_SQL = "COALESCE(v.normalized_file_name, v.file_name)"
+SEARCH_CATEGORY_SQL = "COALESCE(c.normalized_name, c.name)"
+
+# --- متجه البحث النصي: العنوان (A) ثم اسم الملف (B) ثم اسم التصنيف (C) ---
+# يُبنى من النص المطبّع (والأصلي فقط للصفوف التي لم تُطبّع بعد)
+# النقاط والشرطات في أسماء الملفات تُحول لمسافات حتى لا يعاملها المحلل ككلمة واحدة
+SEARCH_VECTOR_DDL = [
+    f"""
+    CREATE OR REPLACE FUNCTION video_archive_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{TS_CONFIG}', COALESCE(NEW.normalized_caption, NEW.caption, '')), 'A') ||
+            setweight(to_tsvector('{TS_CONFIG}', regexp_replace(COALESCE(NEW.normalized_file_name, NEW.file_name, ''), '[._-]+', ' ', 'g')), 'B') ||
+            setweight(to_tsvector('{TS_CONFIG}', COALESCE((SELECT COALESCE(normalized_name, name) FROM categories WHERE id = NEW.category_id), '')), 'C');
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS video_archive_search_vector ON video_archive",
+    """
+    CREATE TRIGGER video_archive_search_vector
+    BEFORE INSERT OR UPDATE OF caption, file_name, category_id, normalized_caption, normalized_file_name ON video_archive
+    FOR EACH ROW EXECUTE PROCEDURE video_archive_search_vector()
+    """
+]
+
+# --- جلسات المحادثة المشتركة بين الـ workers (session_store.py مع SESSION_BACKEND=postgres) ---
+# UNLOGGED: بيانات مؤقتة لا تحتاج WAL، ولا يضر فقدانها بعد توقف مفاجئ لقاعدة البيانات
+SESSION_STORE_DDL = [
+    """
+    CREATE UNLOGGED TABLE IF NOT EXISTS ephemeral_sessions (
+        namespace TEXT NOT NULL,
+        session_key TEXT NOT NULL,
+        value JSONB,
+        expires_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (namespace, session_key)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_ephemeral_sessions_expires_at ON ephemeral_sessions(expires_at)"
+]
+
 
 def verify_and_repair_schema():
     logger.info("Verifying and repairing database schema...")
+    added_columns = set()
     
     try:
         with get_db_connection() as conn:
@@ -143,6 +299,7 @@ def verify_and_repair_schema():
                             )
                             try:
                                 c.execute(alter_query)
+                                added_columns.add((table_name, column_name))
                                 logger.info(f"Successfully added column '{column_name}' to '{table_name}'.")
                             except Exception as add_err:
                                 logger.error(f"Error adding column {column_name} to {table_name}: {add_err}")
@@ -163,6 +320,22 @@ def verify_and_repair_schema():
                                 logger.error(f"Error adding constraint to {table_name}: {const_err}")
 
                 conn.commit()
+
+                for statement in CATEGORY_COUNTS_DDL + RATING_AGGREGATES_DDL + SEARCH_VECTOR_DDL + SESSION_STORE_DDL:
+                    try:
+                        c.execute(statement)
+                        conn.commit()
+                    except psycopg2.Error as ddl_err:
+                        conn.rollback()
+                        logger.error(f"Error applying schema trigger: {ddl_err}")
+
+                c.execute("SELECT 1 FROM category_video_counts LIMIT 1")
+                if c.fetchone() is None:
+                    _rebuild_category_counts(conn, c)
+
+                if ('video_archive', 'rating_count') in added_columns:
+                    _reconcile_rating_aggregates(conn, c)
+
                 logger.info("Schema verification and repair process completed successfully.")
     except psycopg2.Error as e:
         logger.error(f"Schema verification error: {e}", exc_info=True)
@@ -172,14 +345,227 @@ def verify_and_repair_schema():
         raise
 
 
+def _rebuild_category_counts(conn, cursor):
+    # SHARE يمنع الكتابة على الأرشيف أثناء إعادة البناء حتى لا تضيع زيادات الـ trigger
+    cursor.execute("LOCK TABLE video_archive IN SHARE MODE")
+    cursor.execute("DELETE FROM category_video_counts")
+    cursor.execute("""
+        INSERT INTO category_video_counts (category_id, video_count)
+        SELECT category_id, COUNT(*) FROM video_archive
+        WHERE category_id IS NOT NULL
+        GROUP BY category_id
+    """)
+    rebuilt = cursor.rowcount
+    conn.commit()
+    logger.info(f"Category video counts rebuilt for {rebuilt} categories")
+    return rebuilt
+
+
+def rebuild_category_counts():
+    """
+    إعادة حساب جدول category_video_counts بالكامل من video_archive
+    (يُستدعى تلقائياً عند إنشاء الجدول، ويدوياً لتصحيح أي انحراف)
+
+    Returns:
+        عدد التصنيفات، أو None عند الفشل
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as c:
+                return _rebuild_category_counts(conn, c)
+    except psycopg2.Error as e:
+        logger.error(f"Failed to rebuild category video counts: {e}", exc_info=True)
+        return None
+
+
+def _reconcile_rating_aggregates(conn, cursor):
+    # SHARE يوقف كتابة التقييمات لحظياً حتى لا تتعارض القيم المحسوبة مع الـ trigger
+    cursor.execute("LOCK TABLE video_ratings IN SHARE MODE")
+    cursor.execute("""
+        UPDATE video_archive v
+        SET rating_sum = COALESCE(r.rating_sum, 0), rating_count = COALESCE(r.rating_count, 0)
+        FROM video_archive v2
+        LEFT JOIN (
+            SELECT video_id, SUM(rating) AS rating_sum, COUNT(rating) AS rating_count
+            FROM video_ratings GROUP BY video_id
+        ) r ON r.video_id = v2.id
+        WHERE v.id = v2.id
+          AND (v.rating_sum <> COALESCE(r.rating_sum, 0) OR v.rating_count <> COALESCE(r.rating_count, 0))
+    """)
+    fixed = cursor.rowcount
+    conn.commit()
+    if fixed:
+        logger.warning(f"Rating aggregates reconciled for {fixed} videos")
+    return fixed
+
+
+def reconcile_rating_aggregates():
+    """
+    إعادة حساب rating_sum و rating_count من video_ratings للفيديوهات المنحرفة فقط
+
+    Returns:
+        عدد الفيديوهات التي تم تصحيحها، أو None عند الفشل
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as c:
+                return _reconcile_rating_aggregates(conn, c)
+    except psycopg2.Error as e:
+        logger.error(f"Failed to reconcile rating aggregates: {e}", exc_info=True)
+        return None
+
+
+def backfill_normalized_text(batch_size=500, pause=0.1):
+    """
+    حساب النص المطبّع للفيديوهات والتصنيفات المضافة قبل التطبيع، على دفعات
+
+    Returns:
+        عدد الفيديوهات التي تم تطبيعها
+    """
+    categories = execute_query("SELECT id, name FROM categories WHERE normalized_name IS NULL", fetch="all")
+    if categories:
+        execute_query(
+            """
+            UPDATE categories c SET normalized_name = u.normalized_name
+            FROM unnest(%s::int[], %s::text[]) AS u(id, normalized_name)
+            WHERE c.id = u.id
+            """,
+            ([row['id'] for row in categories], [normalize_arabic(row['name']) for row in categories]),
+            commit=True
+        )
+
+    total = 0
+    while True:
+        rows = execute_query(
+            "SELECT id, caption, file_name FROM video_archive WHERE normalized_caption IS NULL ORDER BY id LIMIT %s",
+            (batch_size,), fetch="all"
+        )
+        if not rows:
+            break
+        updated = execute_query(
+            """
+            UPDATE video_archive v
+            SET normalized_caption = u.caption, normalized_file_name = u.file_name
+            FROM unnest(%s::int[], %s::text[], %s::text[]) AS u(id, caption, file_name)
+            WHERE v.id = u.id
+            """,
+            (
+                [row['id'] for row in rows],
+                [normalize_arabic(row['caption']) for row in rows],
+                [normalize_arabic(row['file_name']) for row in rows]
+            ),
+            commit=True
+        )
+        if not updated:
+            logger.error("Normalized text backfill failed; stopping")
+            break
+        total += len(rows)
+        logger.info(f"Normalized text backfilled: {total}")
+        time.sleep(pause)
+    return total
+
+
+def backfill_search_vectors(batch_size=500, pause=0.1):
+    """
+    ملء search_vector للفيديوهات التي أُضيفت قبل إنشاء الـ trigger، على دفعات قصيرة
+    (SKIP LOCKED يسمح بتشغيلها من أكثر من worker بدون انتظار متبادل)
+
+    Returns:
+        عدد الفيديوهات التي تمت فهرستها
+    """
+    total = 0
+    while True:
+        # SET caption = caption يُطلق الـ trigger فيبقى تعريف المتجه في مكان واحد
+        rows = execute_query("""
+            UPDATE video_archive SET caption = caption
+            WHERE id IN (
+                SELECT id FROM video_archive
+                WHERE search_vector IS NULL
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, search_vector IS NOT NULL AS indexed
+        """, (batch_size,), fetch="all", commit=True)
+        if not rows:
+            break
+        if not any(row['indexed'] for row in rows):
+            logger.error("Search vector trigger is missing; stopping backfill")
+            break
+        total += len(rows)
+        logger.info(f"Search vectors backfilled: {total}")
+        time.sleep(pause)
+    return total
+
+
+# --- سجل الـ Prepared Statements ---
+# الاستعلامات الأكثر تكراراً تُحضّر مرة واحدة لكل اتصال في الـ pool وتُستدعى بالاسم:
+#   execute_query('get_video_by_id', (video_id,), fetch="one")
+PREPARED_STATEMENTS = {
+    'get_video_by_id': "SELECT * FROM video_archive WHERE id = %s",
+    'get_category_by_id': "SELECT * FROM categories WHERE id = %s",
+    'get_user_video_rating': "SELECT rating FROM video_ratings WHERE video_id = %s AND user_id = %s",
+    'is_video_favorite': "SELECT 1 FROM user_favorites WHERE user_id = %s AND video_id = %s",
+    'get_video_rating_stats': "SELECT rating_sum::float / NULLIF(rating_count, 0) as avg, rating_count as count FROM video_archive WHERE id = %s",
+    'get_category_videos_page': f"SELECT {VIDEO_LIST_COLUMNS} FROM video_archive v WHERE category_id = %s ORDER BY id DESC LIMIT %s OFFSET %s",
+    'get_category_videos_after': f"SELECT {VIDEO_LIST_COLUMNS} FROM video_archive v WHERE category_id = %s AND id < %s ORDER BY id DESC LIMIT %s",
+    'get_category_videos_before': f"SELECT {VIDEO_LIST_COLUMNS} FROM video_archive v WHERE category_id = %s AND id > %s ORDER BY id ASC LIMIT %s",
+    'count_category_videos': "SELECT COALESCE((SELECT video_count FROM category_video_counts WHERE category_id = %s), 0) as count",
+    'get_user_state': "SELECT state, context FROM user_states WHERE user_id = %s",
+}
+
+# خطأ Postgres عند تغيّر أعمدة جدول بعد تحضير "SELECT *": cached plan must not change result type
+_PLAN_INVALIDATED_PGCODE = '0A000'
+
+
+def _to_positional_params(query):
+    """تحويل %s إلى $1, $2, ... لاستخدامها في PREPARE"""
+    parts = query.split('%s')
+    return ''.join(f"{part}${i}" if i < len(parts) else part for i, part in enumerate(parts, 1))
+
+
+def _execute_prepared(conn, cursor, name, params):
+    prepared = getattr(conn, 'prepared_statements', None)
+    if prepared is None:
+        prepared = set()
+        conn.prepared_statements = prepared
+
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} AS {_to_positional_params(PREPARED_STATEMENTS[name])}")
+        prepared.add(name)
+
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+
+def _run_query(conn, cursor, query, params):
+    if query not in PREPARED_STATEMENTS:
+        cursor.execute(query, params)
+    elif not DB_USE_PREPARED_STATEMENTS:
+        cursor.execute(PREPARED_STATEMENTS[query], params)
+    else:
+        try:
+            _execute_prepared(conn, cursor, query, params)
+        except psycopg2.Error as e:
+            if e.pgcode != _PLAN_INVALIDATED_PGCODE:
+                raise
+            # تغيّرت بنية الجدول: نعيد تحضير الاستعلام مرة واحدة
+            conn.rollback()
+            cursor.execute(f"DEALLOCATE {query}")
+            conn.prepared_statements.discard(query)
+            _execute_prepared(conn, cursor, query, params)
+
+
 def execute_query(query, params=None, fetch=None, commit=False):
-    """تنفيذ استعلام SQL مع استخدام connection pool"""
+    """تنفيذ استعلام SQL مع استخدام connection pool (أو prepared statement مسجل بالاسم)"""
     result = None
     try:
         with get_db_connection() as conn:
             try:
                 with conn.cursor(cursor_factory=DictCursor) as c:
-                    c.execute(query, params)
+                    _run_query(conn, c, query, params)
                     if fetch == "one": 
                         result = c.fetchone()
                     elif fetch == "all": 
@@ -204,56 +590,111 @@ def execute_query(query, params=None, fetch=None, commit=False):
         return None if fetch else False
     return result
 
+def _fetch_keyset_page(select_sql, where_clauses, params, sort_columns, page=0, cursor=None):
+    """
+    جلب صفحة من قائمة مرتبة تنازلياً على sort_columns.
+    مع المؤشر: WHERE (cols) < (key) LIMIT n - نفس التكلفة لأي صفحة.
+    بدون مؤشر (الصفحة الأولى أو الأزرار القديمة): LIMIT/OFFSET حسب رقم الصفحة.
+    """
+    condition, cursor_params, order_by, reverse = keyset_clause(sort_columns, cursor)
+    clauses = list(where_clauses)
+    all_params = list(params)
+
+    if condition:
+        clauses.append(condition)
+        all_params.extend(cursor_params)
+        limit_sql = "LIMIT %s"
+        all_params.append(VIDEOS_PER_PAGE)
+    else:
+        limit_sql = "LIMIT %s OFFSET %s"
+        all_params.extend([VIDEOS_PER_PAGE, page * VIDEOS_PER_PAGE])
+
+    where_sql = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = execute_query(f"{select_sql} {where_sql} ORDER BY {order_by} {limit_sql}", tuple(all_params), fetch="all")
+    return list(reversed(rows)) if reverse else rows
+
 # ==============================================================================
 # دالة بحث مطورة لتدعم الفلاتر المتقدمة - مع Caching
 # ==============================================================================
 
-def _get_cache_key(query, page, category_id, quality, status):
+def _get_cache_key(query, page, category_id, quality, status, cursor=None, strategy='ilike'):
     """إنشاء مفتاح فريد للـ cache"""
-    return f"{query}:{page}:{category_id}:{quality}:{status}"
-
-def _get_cached_search(cache_key):
-    """جلب نتيجة البحث من الـ cache إذا كانت صالحة"""
-    if cache_key in _search_cache:
-        cached_result, cached_time = _search_cache[cache_key]
-        if time.time() - cached_time < _search_cache_ttl:
-            logger.debug(f"Cache hit for search: {cache_key[:30]}...")
-            return cached_result
-        else:
-            # انتهت صلاحية الـ cache
-            del _search_cache[cache_key]
-    return None
+    return (strategy, query, page, category_id, quality, status, cursor)
 
-def _set_cached_search(cache_key, result):
-    """حفظ نتيجة البحث في الـ cache"""
-    # تنظيف الـ cache إذا كبر جداً
-    if len(_search_cache) > 100:
-        # حذف أقدم نصف
-        oldest_keys = sorted(_search_cache.keys(), key=lambda k: _search_cache[k][1])[:50]
-        for key in oldest_keys:
-            del _search_cache[key]
-    
-    _search_cache[cache_key] = (result, time.time())
+def _invalidate_search_results(video_ids=(), texts=(), category_ids=()):
+    """
+    حذف نتائج البحث المتأثرة فقط بتغيير فيديوهات محددة:
+    - النتائج التي تحتوي أحد الفيديوهات (تغيرت بياناتها أو حُذفت)
+    - نتائج التصنيفات التي انتقل إليها فيديو
+    - نتائج البحث التي قد يطابقها نص فيديو جديد أو معدّل
+    """
+    video_ids = {int(i) for i in video_ids}
+    texts = [normalize_arabic(text) for text in texts if text]
+    category_ids = {int(c) for c in category_ids if c is not None}
+
+    def affected(key, result):
+        _, query, _, category_id, _, _, _ = key
+        if category_id is not None and category_id in category_ids:
+            return True
+        if video_ids and any(video['id'] in video_ids for video in result[0] or []):
+            return True
+        return query_may_match(query, texts)
+
+    removed = _search_cache.invalidate_items(affected)
+    logger.debug(f"Search cache: invalidated {removed} entries")
+    return removed
+
+def _category_search_text(category_id):
+    """اسم التصنيف كما يدخل في search_vector (الوزن C)"""
+    if not category_id:
+        return None
+    category = get_category_by_id(category_id)
+    return (category.get('normalized_name') or category.get('name')) if category else None
 
 def clear_search_cache():
     """مسح كل الـ cache للبحث"""
-    global _search_cache
-    _search_cache = {}
+    _search_cache.clear()
+    count_service.invalidate('search')
     logger.info("Search cache cleared")
 
-def search_videos(query, page=0, category_id=None, quality=None, status=None):
-    # التحقق من الـ cache أولاً
-    cache_key = _get_cache_key(query, page, category_id, quality, status)
-    cached = _get_cached_search(cache_key)
-    if cached:
-        return cached
-    
-    offset = page * VIDEOS_PER_PAGE
-    search_term = f"%{query}%"
+def get_search_cache_stats():
+    return _search_cache.get_stats()
+
+def _exact_count(from_where, params):
+    row = execute_query(f"SELECT COUNT(*) as count {from_where}", params, fetch="one")
+    return row['count'] if row else None
+
+def _estimated_count(from_where, params):
+    """تقدير عدد الصفوف من إحصائيات الـ planner بدون تنفيذ الاستعلام"""
+    row = execute_query(f"EXPLAIN (FORMAT JSON) SELECT 1 {from_where}", params, fetch="one")
+    return extract_plan_rows(row[0]) if row else None
+
+def search_videos(query, page=0, category_id=None, quality=None, status=None, cursor=None):
+    # التهجئات المختلفة لنفس الكلمة تشترك في النتائج والكاش
+    query = normalize_arabic(query)
+    strategy = search_strategy.choose(query)
+    tsquery = parse_search_query(query) if strategy == 'fts' else None
+    if not tsquery:
+        strategy = 'ilike'
+
+    # من الـ cache، أو تنفيذ البحث مرة واحدة مهما تعددت الطلبات المتزامنة له
+    cache_key = _get_cache_key(query, page, category_id, quality, status, cursor, strategy)
+    return _search_cache.get_or_load(
+        cache_key,
+        lambda: _run_search(query, page, category_id, quality, status, cursor, strategy, tsquery)
+    )
+
+def _run_search(query, page, category_id, quality, status, cursor, strategy, tsquery):
+    started = time.monotonic()
 
     # بناء جملة WHERE بشكل ديناميكي
-    where_clauses = ["(caption ILIKE %s OR file_name ILIKE %s)"]
-    params = [search_term, search_term]
+    if strategy == 'fts':
+        where_clauses = [f"search_vector @@ to_tsquery('{TS_CONFIG}', %s)"]
+        params = [tsquery]
+    else:
+        search_term = f"%{query}%"
+        where_clauses = [f"({SEARCH_CAPTION_SQL} ILIKE %s OR {SEARCH_FILE_NAME_SQL} ILIKE %s)"]
+        params = [search_term, search_term]
 
     if category_id:
         where_clauses.append("category_id = %s")
@@ -269,31 +710,88 @@ def search_videos(query, page=0, category_id=None, quality=None, status=None):
 
     where_string = " AND ".join(where_clauses)
 
-    # استعلام جلب الفيديوهات
-    videos_query = f"SELECT * FROM video_archive WHERE {where_string} ORDER BY id DESC LIMIT %s OFFSET %s"
-    final_params_videos = tuple(params + [VIDEOS_PER_PAGE, offset])
-    videos = execute_query(videos_query, final_params_videos, fetch="all")
-
-    # استعلام جلب العدد الإجمالي
-    count_query = f"SELECT COUNT(*) as count FROM video_archive WHERE {where_string}"
-    final_params_count = tuple(params)
-    total = execute_query(count_query, final_params_count, fetch="one")
+    if strategy == 'fts':
+        # الترتيب بالصلة: ts_rank كعدد صحيح حتى يُستخدم مع id كمفتاح keyset دقيق
+        ranked_sql = f"""
+            SELECT * FROM (
+                SELECT {VIDEO_LIST_COLUMNS},
+                       ROUND(ts_rank(search_vector, to_tsquery('{TS_CONFIG}', %s)) * 1000000)::bigint AS sort_ts,
+                       id AS sort_id
+                FROM video_archive v
+                WHERE {where_string}
+            ) ranked
+        """
+        videos = _fetch_keyset_page(ranked_sql, [], [tsquery] + params, ['sort_ts', 'sort_id'], page, cursor)
+    else:
+        # استعلام جلب الفيديوهات (keyset على id)
+        videos = _fetch_keyset_page(f"SELECT {VIDEO_LIST_COLUMNS} FROM video_archive v", where_clauses, params, ['id'], page, cursor)
+
+    # العدد الإجمالي: مشترك بين كل صفحات نفس البحث، ومقدَّر للنتائج الكبيرة
+    from_where = f"FROM video_archive v WHERE {where_string}"
+    count_params = tuple(params)
+    total = count_service.get_total(
+        ('search', query, category_id, quality, status, strategy),
+        lambda: _exact_count(from_where, count_params),
+        lambda: _estimated_count(from_where, count_params)
+    )
+    search_strategy.record('search', strategy, started, len(videos))
+    return videos, total
+
+# --- إشعارات تغيّر الأرشيف (للفهارس والكاشات في الذاكرة) ---
+# callback(op, video_ids) حيث op: 'upsert' أو 'delete' أو 'reload' (video_ids = None)
+ARCHIVE_NOTIFY_CHANNEL = 'video_archive_changed'
+_ARCHIVE_NOTIFY_MAX_PAYLOAD = 7000  # حد pg_notify 8000 بايت
+_archive_listeners = []
+
+def register_archive_listener(callback):
+    """تسجيل دالة تُستدعى عند إضافة/نقل/حذف فيديوهات (في هذا الـ process أو غيره)"""
+    _archive_listeners.append(callback)
+    db_listener.ensure_started()
+
+def _dispatch_archive_change(op, video_ids):
+    for callback in list(_archive_listeners):
+        try:
+            callback(op, video_ids)
+        except Exception as e:
+            logger.error(f"Error in archive listener: {e}", exc_info=True)
+
+def _on_archive_changed(op, video_ids=None):
+    # الإشعار يُرسل دائماً: المستمعون يُسجَّلون عند أول استخدام، فقد يكتب worker
+    # (مثلاً يعالج منشورات القناة) لم يسجّل أي مستمع بينما فهارس غيره تنتظر التغيير
+    if _archive_listeners:
+        _dispatch_archive_change(op, video_ids)
+    payload = f"{op}:{','.join(str(i) for i in video_ids or [])}"
+    if len(payload) > _ARCHIVE_NOTIFY_MAX_PAYLOAD:
+        payload = "reload:"
+    db_listener.notify(ARCHIVE_NOTIFY_CHANNEL, payload)
+
+def _on_remote_archive_change(payload):
+    # payload=None بعد إعادة اتصال المستمع: قد تكون إشعارات فاتت
+    if payload is None:
+        _dispatch_archive_change('reload', None)
+        return
+    op, _, ids = payload.partition(':')
+    try:
+        video_ids = [int(i) for i in ids.split(',') if i]
+    except ValueError:
+        op, video_ids = 'reload', None
+    if op == 'reload':
+        video_ids = None
+    _dispatch_archive_change(op, video_ids)
 
-    # حفظ النتيجة في الـ cache
-    result = (videos, total['count'] if total else 0)
-    _set_cached_search(cache_key, result)
-    
-    return result
+db_listener.subscribe(ARCHIVE_NOTIFY_CHANNEL, _on_remote_archive_change)
 
 def add_video(message_id, caption, chat_id, file_name, file_id, metadata, grouping_key=None, category_id=None, thumbnail_file_id=None, content_type='VIDEO'):
     """إضافة فيديو جديد للأرشيف مع البيانات الكاملة"""
     metadata_json = json.dumps(metadata) if metadata else None
     query = """
-        INSERT INTO video_archive (message_id, caption, chat_id, file_name, file_id, metadata, grouping_key, category_id, thumbnail_file_id, content_type)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        INSERT INTO video_archive (message_id, caption, chat_id, file_name, file_id, metadata, grouping_key, category_id, thumbnail_file_id, content_type, normalized_caption, normalized_file_name)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         ON CONFLICT (message_id) DO UPDATE SET
             caption = EXCLUDED.caption,
             file_name = EXCLUDED.file_name,
+            normalized_caption = EXCLUDED.normalized_caption,
+            normalized_file_name = EXCLUDED.normalized_file_name,
             file_id = EXCLUDED.file_id,
             metadata = EXCLUDED.metadata,
             grouping_key = EXCLUDED.grouping_key,
@@ -302,14 +800,87 @@ def add_video(message_id, caption, chat_id, file_name, file_id, metadata, groupi
             content_type = EXCLUDED.content_type
         RETURNING id
     """
-    params = (message_id, caption, chat_id, file_name, file_id, metadata_json, grouping_key, category_id, thumbnail_file_id, content_type)
+    params = (message_id, caption, chat_id, file_name, file_id, metadata_json, grouping_key, category_id, thumbnail_file_id, content_type,
+              normalize_arabic(caption), normalize_arabic(file_name))
     result = execute_query(query, params, fetch="one", commit=True)
+    if result:
+        count_service.invalidate('search')
+        _invalidate_search_results([result['id']], [caption, file_name, _category_search_text(category_id)], [category_id])
+        _on_archive_changed('upsert', [result['id']])
     return result['id'] if result and 'id' in result else (result[0] if result else None)
 
+# --- التصنيفات (محفوظة في الذاكرة ويُعاد تحميلها عند تغير categories_version) ---
+CATEGORIES_NOTIFY_CHANNEL = 'categories_changed'
+CATEGORIES_VERSION_KEY = 'categories_version'
+
+def _load_categories_version(cursor=None):
+    query = "SELECT setting_value FROM bot_settings WHERE setting_key = %s"
+    if cursor is not None:
+        cursor.execute(query, (CATEGORIES_VERSION_KEY,))
+        row = cursor.fetchone()
+    else:
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as c:
+                c.execute(query, (CATEGORIES_VERSION_KEY,))
+                row = c.fetchone()
+    return row['setting_value'] if row else '0'
+
+def _load_categories():
+    """
+    تحميل الإصدار ثم كل التصنيفات (يرفع الاستثناء ليحتفظ السجل بالنسخة السابقة).
+    الإصدار يُقرأ أولاً: تعديل يحدث بينهما يُكتشف في الفحص التالي ولا يضيع.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as c:
+            version = _load_categories_version(c)
+            c.execute("SELECT * FROM categories")
+            return version, c.fetchall()
+
+_category_registry = CategoryTreeRegistry(_load_categories, _load_categories_version, CATEGORY_VERSION_CHECK_SECONDS)
+db_listener.subscribe(CATEGORIES_NOTIFY_CHANNEL, _category_registry.reload)
+
+def _on_categories_changed():
+    """زيادة الإصدار المشترك بعد أي تعديل على جدول categories ثم إعادة التحميل وإبلاغ الـ workers"""
+    res = execute_query("""
+        INSERT INTO bot_settings (setting_key, setting_value) VALUES (%s, '1')
+        ON CONFLICT (setting_key) DO UPDATE
+        SET setting_value = (COALESCE(NULLIF(bot_settings.setting_value, ''), '0')::bigint + 1)::text
+        RETURNING setting_value
+    """, (CATEGORIES_VERSION_KEY,), fetch="one", commit=True)
+    _category_registry.reload()
+    if res:
+        db_listener.notify(CATEGORIES_NOTIFY_CHANNEL, res['setting_value'])
+
+def _categories_snapshot():
+    db_listener.ensure_started()
+    return _category_registry.snapshot()
+
+def get_categories_version():
+    """إصدار التصنيفات الحالي في الذاكرة (None إذا لم تُحمّل)"""
+    snapshot = _categories_snapshot()
+    return snapshot.version if snapshot is not None else None
+
+def get_categories_derived(name, builder):
+    """
+    قيمة مشتقة من كل التصنيفات تُحسب مرة واحدة لكل إصدار، مثل:
+        get_categories_derived('tree', build_category_tree)
+    """
+    snapshot = _categories_snapshot()
+    if snapshot is None:
+        return builder(get_categories_tree())
+    return snapshot.derived(name, builder)
+
+def get_category_registry_stats():
+    return _category_registry.get_stats()
+
 # [إصلاح] إضافة دالة get_category_by_id قبل دالة add_category
 def get_category_by_id(category_id):
     """جلب تصنيف بواسطة معرفه (ID)."""
-    return execute_query("SELECT * FROM categories WHERE id = %s", (category_id,), fetch="one")
+    snapshot = _categories_snapshot()
+    if snapshot is not None and category_id in snapshot.by_id:
+        return snapshot.by_id[category_id]
+    # غير موجود في الذاكرة: قد يكون أُضيف للتو في worker آخر قبل وصول الإشعار
+    return execute_query('get_category_by_id', (category_id,), fetch="one")
 
 def add_category(name, parent_id=None):
     """
@@ -324,19 +895,28 @@ def add_category(name, parent_id=None):
             # معالجة بيانات قديمة لا تحتوي على full_path
             full_path = f"{parent_category['name']}/{name}" 
 
-    query = "INSERT INTO categories (name, parent_id, full_path) VALUES (%s, %s, %s) RETURNING id"
-    params = (name, parent_id, full_path)
+    query = "INSERT INTO categories (name, parent_id, full_path, normalized_name) VALUES (%s, %s, %s, %s) RETURNING id"
+    params = (name, parent_id, full_path, normalize_arabic(name))
     
     res = execute_query(query, params, fetch="one", commit=True)
+    if res:
+        _on_categories_changed()
     return (True, res) if res else (False, "Failed to add category")
 
 def get_categories_tree():
-    """جلب جميع التصنيفات الرئيسية (parent_id IS NULL)."""
+    """جلب جميع التصنيفات (رئيسية وفرعية) مرتبة بالاسم."""
+    snapshot = _categories_snapshot()
+    if snapshot is not None:
+        return list(snapshot.categories)
     # [إصلاح] تغيير الاستعلام لكي يجلب جميع التصنيفات الرئيسية
     return execute_query("SELECT * FROM categories WHERE parent_id IS NULL OR parent_id IS NOT NULL ORDER BY name", fetch="all")
 
 def get_child_categories(parent_id):
     """جلب التصنيفات الفرعية لتصنيف معين."""
+    snapshot = _categories_snapshot()
+    if snapshot is not None:
+        return list(snapshot.children.get(parent_id, []))
+
     if parent_id is None:
          # [إصلاح] التأكد من جلب التصنيفات الرئيسية (parent_id IS NULL)
          return execute_query("SELECT * FROM categories WHERE parent_id IS NULL ORDER BY name", fetch="all")
@@ -344,16 +924,99 @@ def get_child_categories(parent_id):
     return execute_query("SELECT * FROM categories WHERE parent_id = %s ORDER BY name", (parent_id,), fetch="all")
 
 
-def get_videos(category_id, page=0):
-    offset = page * VIDEOS_PER_PAGE
-    videos = execute_query("SELECT * FROM video_archive WHERE category_id = %s ORDER BY id DESC LIMIT %s OFFSET %s", (category_id, VIDEOS_PER_PAGE, offset), fetch="all")
-    total = execute_query("SELECT COUNT(*) as count FROM video_archive WHERE category_id = %s", (category_id,), fetch="one")
+def get_videos(category_id, page=0, cursor=None):
+    decoded = decode_cursor(cursor)
+    if decoded and len(decoded[1]) == 1:
+        direction, (key,) = decoded
+        if direction == AFTER:
+            videos = execute_query('get_category_videos_after', (category_id, key, VIDEOS_PER_PAGE), fetch="all")
+        else:
+            videos = list(reversed(execute_query('get_category_videos_before', (category_id, key, VIDEOS_PER_PAGE), fetch="all")))
+    else:
+        offset = page * VIDEOS_PER_PAGE
+        videos = execute_query('get_category_videos_page', (category_id, VIDEOS_PER_PAGE, offset), fetch="all")
+    total = execute_query('count_category_videos', (category_id,), fetch="one")
     return videos, total['count'] if total else 0
 
+def category_page_query(category_id, page=0, cursor=None):
+    """
+    استعلام get_category_page ومعاملاته (يتغير نصه حسب وجود المؤشر فلا يُحضّر مسبقاً)
+
+    Returns:
+        (query, params)
+    """
+    condition, cursor_params, order_by, _ = keyset_clause(['id'], cursor)
+    page_params = [category_id] + cursor_params + [VIDEOS_PER_PAGE]
+    if condition:
+        page_filter = f"AND {condition}"
+        limit_sql = "LIMIT %s"
+    else:
+        page_filter = ""
+        limit_sql = "LIMIT %s OFFSET %s"
+        page_params.append(page * VIDEOS_PER_PAGE)
+
+    # json_agg يرتب الفيديوهات تنازلياً دائماً، حتى عند الجلب تصاعدياً للصفحة السابقة
+    query = f"""
+        WITH cat AS (
+            SELECT * FROM categories WHERE id = %s
+        ),
+        children AS (
+            SELECT * FROM categories WHERE parent_id = %s
+        ),
+        page_videos AS (
+            SELECT {VIDEO_LIST_COLUMNS}, {AVG_RATING_SQL} AS avg_rating
+            FROM video_archive v
+            WHERE category_id = %s {page_filter}
+            ORDER BY {order_by}
+            {limit_sql}
+        )
+        SELECT
+            (SELECT row_to_json(cat) FROM cat) AS category,
+            COALESCE((SELECT json_agg(children ORDER BY name) FROM children), '[]'::json) AS children,
+            COALESCE((SELECT json_agg(page_videos ORDER BY id DESC) FROM page_videos), '[]'::json) AS videos,
+            COALESCE((SELECT video_count FROM category_video_counts WHERE category_id = %s), 0) AS total
+    """
+    params = [category_id, category_id] + page_params + [category_id]
+    return query, tuple(params)
+
+def get_category_page(category_id, page=0, cursor=None):
+    """
+    جلب كل ما تحتاجه صفحة التصنيف في استعلام واحد (بدلاً من ~6 رحلات لقاعدة البيانات)
+
+    Args:
+        cursor: مؤشر keyset من أزرار التنقل؛ بدونه يُستخدم رقم الصفحة (OFFSET)
+
+    Returns:
+        dict: {'category', 'children', 'videos' (مع avg_rating), 'total'}
+        أو None إذا لم يوجد التصنيف أو فشل الاستعلام
+    """
+    query, params = category_page_query(category_id, page, cursor)
+    row = execute_query(query, params, fetch="one")
+    if not row or not row['category']:
+        return None
+    return {
+        'category': row['category'],
+        'children': row['children'],
+        'videos': row['videos'],
+        'total': row['total']
+    }
+
 def increment_video_view_count(video_id):
     """دالة زيادة عداد المشاهدات."""
     return execute_query("UPDATE video_archive SET view_count = view_count + 1 WHERE id = %s", (video_id,), commit=True)
 
+def increment_video_view_counts_bulk(video_ids, increments):
+    """
+    زيادة عدادات مشاهدات عدة فيديوهات بعبارة واحدة (تُستخدم من write_behind).
+    الأرقام مرتبة من المستدعي حتى تُقفل الصفوف بنفس الترتيب بين الـ workers.
+    """
+    query = """
+        UPDATE video_archive v SET view_count = v.view_count + u.n
+        FROM unnest(%s::int[], %s::int[]) AS u(id, n)
+        WHERE v.id = u.id
+    """
+    return execute_query(query, (list(video_ids), list(increments)), commit=True)
+
 def get_video_by_message_id(message_id):
     """دالة جلب فيديو بمعرف الرسالة."""
     return execute_query("SELECT * FROM video_archive WHERE message_id = %s", (message_id,), fetch="one")
@@ -366,13 +1029,17 @@ def set_active_category_id(category_id):
     return execute_query("INSERT INTO bot_settings (setting_key, setting_value) VALUES ('active_category_id', %s) ON CONFLICT (setting_key) DO UPDATE SET setting_value = EXCLUDED.setting_value", (str(category_id),), commit=True)
 
 def add_video_rating(video_id, user_id, rating):
-    return execute_query("INSERT INTO video_ratings (video_id, user_id, rating) VALUES (%s, %s, %s) ON CONFLICT (video_id, user_id) DO UPDATE SET rating = EXCLUDED.rating", (video_id, user_id, rating), commit=True)
+    # rating_sum/rating_count على video_archive يُحدّثان في نفس الـ transaction عبر trigger
+    result = execute_query("INSERT INTO video_ratings (video_id, user_id, rating) VALUES (%s, %s, %s) ON CONFLICT (video_id, user_id) DO UPDATE SET rating = EXCLUDED.rating", (video_id, user_id, rating), commit=True)
+    if result:
+        _on_archive_changed('upsert', [int(video_id)])
+    return result
 
 def get_video_rating_stats(video_id):
-    return execute_query("SELECT AVG(rating) as avg, COUNT(id) as count FROM video_ratings WHERE video_id = %s", (video_id,), fetch="one")
+    return execute_query('get_video_rating_stats', (video_id,), fetch="one")
 
 def get_user_video_rating(video_id, user_id):
-    res = execute_query("SELECT rating FROM video_ratings WHERE video_id = %s AND user_id = %s", (video_id, user_id), fetch="one")
+    res = execute_query('get_user_video_rating', (video_id, user_id), fetch="one")
     return res['rating'] if res else None
 
 def get_videos_ratings_bulk(video_ids):
@@ -389,10 +1056,9 @@ def get_videos_ratings_bulk(video_ids):
         return {}
     
     query = """
-        SELECT video_id, AVG(rating) as avg_rating, COUNT(*) as count
-        FROM video_ratings
-        WHERE video_id = ANY(%s)
-        GROUP BY video_id
+        SELECT id AS video_id, rating_sum::float / rating_count AS avg_rating, rating_count AS count
+        FROM video_archive
+        WHERE id = ANY(%s) AND rating_count > 0
     """
     
     results = execute_query(query, (video_ids,), fetch="all")
@@ -410,31 +1076,62 @@ def get_videos_ratings_bulk(video_ids):
 
 
 # ============================================
-# [إصلاح] دالة get_popular_videos - إزالة القوس والـ r المكرر
+# قوائم الفيديوهات الشائعة (leaderboards.py يحملها في الذاكرة)
 # ============================================
-def get_popular_videos():
-    most_viewed = execute_query(
-        "SELECT * FROM video_archive ORDER BY view_count DESC, id DESC LIMIT 10", 
-        fetch="all"
-    )
-    
-    # [إصلاح] إزالة القوس الإضافي والـ r المكرر
-    highest_rated = execute_query(
+LEADERBOARD_COLUMNS = f"""
+    v.id, v.message_id, v.chat_id, v.caption, v.file_name, v.metadata,
+    v.category_id, v.view_count, v.rating_count,
+    {AVG_RATING_SQL} AS avg_rating
+"""
+
+# النوافذ الزمنية تُحسب من سجل المشاهدة: عدد المستخدمين الذين كانت آخر مشاهدة لهم خلال النافذة
+LEADERBOARD_WINDOWS = {
+    'trending_24h': '24 hours',
+    'trending_7d': '7 days'
+}
+
+def load_leaderboard(board, limit):
+    """
+    ترتيب قائمة شائعة كاملة حتى limit فيديو.
+    يرفع الاستثناء عند الفشل حتى تبقى النسخة السابقة في الذاكرة.
+    """
+    if board == 'most_viewed':
+        query = f"""
+            SELECT {LEADERBOARD_COLUMNS} FROM video_archive v
+            ORDER BY v.view_count DESC, v.id DESC
+            LIMIT %s
         """
-        SELECT v.*, r.avg_rating 
-        FROM video_archive v 
-        JOIN (
-            SELECT video_id, AVG(rating) as avg_rating 
-            FROM video_ratings 
-            GROUP BY video_id
-        ) r ON v.id = r.video_id 
-        ORDER BY r.avg_rating DESC, v.view_count DESC 
-        LIMIT 10
-        """, 
-        fetch="all"
-    )
-    
-    return {"most_viewed": most_viewed, "highest_rated": highest_rated}
+        params = (limit,)
+    elif board == 'highest_rated':
+        query = f"""
+            SELECT {LEADERBOARD_COLUMNS} FROM video_archive v
+            WHERE v.rating_count > 0
+            ORDER BY avg_rating DESC, v.view_count DESC, v.id DESC
+            LIMIT %s
+        """
+        params = (limit,)
+    elif board in LEADERBOARD_WINDOWS:
+        query = f"""
+            SELECT {LEADERBOARD_COLUMNS}, h.recent_viewers
+            FROM (
+                SELECT video_id, COUNT(*) AS recent_viewers
+                FROM user_history
+                WHERE last_watched >= CURRENT_TIMESTAMP - INTERVAL %s
+                GROUP BY video_id
+                ORDER BY recent_viewers DESC, video_id DESC
+                LIMIT %s
+            ) h
+            JOIN video_archive v ON v.id = h.video_id
+            ORDER BY h.recent_viewers DESC, v.id DESC
+        """
+        params = (LEADERBOARD_WINDOWS[board], limit)
+    else:
+        raise ValueError(f"unknown leaderboard: {board}")
+
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as c:
+            c.execute(query, params)
+            return c.fetchall()
 
 def add_bot_user(user_id, username, first_name):
     execute_query("INSERT INTO bot_users (user_id, username, first_name) VALUES (%s, %s, %s) ON CONFLICT (user_id) DO NOTHING", (user_id, username, first_name), commit=True)
@@ -455,36 +1152,85 @@ def get_bot_stats():
     stats['total_ratings'] = (execute_query("SELECT COUNT(*) as count FROM video_ratings", fetch="one") or {'count': 0})['count']
     return stats
 
+# --- القنوات المطلوبة (محفوظة في الذاكرة وتُحدّث عبر LISTEN/NOTIFY) ---
+REQUIRED_CHANNELS_NOTIFY_CHANNEL = 'required_channels_changed'
+
+def _load_required_channels():
+    """تحميل القنوات من قاعدة البيانات (يرفع الاستثناء ليحتفظ السجل بالنسخة السابقة)"""
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as c:
+            c.execute("SELECT * FROM required_channels")
+            return c.fetchall()
+
+_required_channels_registry = RequiredChannelsRegistry(_load_required_channels)
+db_listener.subscribe(REQUIRED_CHANNELS_NOTIFY_CHANNEL, _required_channels_registry.reload)
+
+def _on_required_channels_changed():
+    _required_channels_registry.reload()
+    db_listener.notify(REQUIRED_CHANNELS_NOTIFY_CHANNEL)
+
 def add_required_channel(channel_id, channel_name):
-    return execute_query("INSERT INTO required_channels (channel_id, channel_name) VALUES (%s, %s) ON CONFLICT(channel_id) DO NOTHING", (int(channel_id), channel_name), commit=True)
+    result = execute_query("INSERT INTO required_channels (channel_id, channel_name) VALUES (%s, %s) ON CONFLICT(channel_id) DO NOTHING", (int(channel_id), channel_name), commit=True)
+    if result:
+        _on_required_channels_changed()
+    return result
 
 def remove_required_channel(channel_id):
-    return execute_query("DELETE FROM required_channels WHERE channel_id = %s", (int(channel_id),), commit=True)
+    result = execute_query("DELETE FROM required_channels WHERE channel_id = %s", (int(channel_id),), commit=True)
+    if result:
+        _on_required_channels_changed()
+    return result
 
 def get_required_channels():
-    return execute_query("SELECT * FROM required_channels", fetch="all")
+    db_listener.ensure_started()
+    return _required_channels_registry.get()
+
+def get_required_channels_stats():
+    return _required_channels_registry.get_stats()
 
 def get_video_by_id(video_id):
-    return execute_query("SELECT * FROM video_archive WHERE id = %s", (video_id,), fetch="one")
+    return execute_query('get_video_by_id', (video_id,), fetch="one")
 
 def move_video_to_category(video_id, new_category_id):
-    return execute_query("UPDATE video_archive SET category_id = %s WHERE id = %s", (new_category_id, video_id), commit=True)
+    result = execute_query("UPDATE video_archive SET category_id = %s WHERE id = %s", (new_category_id, video_id), commit=True)
+    count_service.invalidate('search')
+    if result:
+        _invalidate_search_results([video_id], [_category_search_text(new_category_id)], [new_category_id])
+        _on_archive_changed('upsert', [int(video_id)])
+    return result
 
 def delete_videos_by_ids(video_ids):
     if not video_ids: return 0
     res = execute_query("DELETE FROM video_archive WHERE id = ANY(%s) RETURNING id", (video_ids,), fetch="all", commit=True)
+    if res:
+        count_service.invalidate('search')
+        _invalidate_search_results([row['id'] for row in res])
+        _on_archive_changed('delete', [row['id'] for row in res])
     return len(res) if isinstance(res, list) else 0
 
 def delete_category_and_contents(category_id):
     execute_query("DELETE FROM video_archive WHERE category_id = %s", (category_id,), commit=True)
     execute_query("DELETE FROM categories WHERE id = %s", (category_id,), commit=True)
+    _on_categories_changed()
+    clear_search_cache()
+    _on_archive_changed('reload')
     return True
 
 def move_videos_from_category(old_category_id, new_category_id):
-    return execute_query("UPDATE video_archive SET category_id = %s WHERE category_id = %s", (new_category_id, old_category_id), commit=True)
+    result = execute_query("UPDATE video_archive SET category_id = %s WHERE category_id = %s", (new_category_id, old_category_id), commit=True)
+    clear_search_cache()
+    if result:
+        _on_archive_changed('reload')
+    return result
 
 def delete_category_by_id(category_id):
-    return execute_query("DELETE FROM categories WHERE id = %s", (category_id,), commit=True)
+    result = execute_query("DELETE FROM categories WHERE id = %s", (category_id,), commit=True)
+    if result:
+        _on_categories_changed()
+        # الفيديوهات تصبح بدون تصنيف (ON DELETE SET NULL)
+        clear_search_cache()
+        _on_archive_changed('reload')
+    return result
 
 def get_random_video():
     """Fetches a single random video from the database."""
@@ -498,34 +1244,49 @@ def set_user_state(user_id: int, state: str, context: dict = None):
     return execute_query(query, (user_id, state, context_json), commit=True)
 
 def get_user_state(user_id: int):
-    return execute_query("SELECT state, context FROM user_states WHERE user_id = %s", (user_id,), fetch="one")
+    return execute_query('get_user_state', (user_id,), fetch="one")
+
+def load_user_state(user_id: int):
+    """
+    مثل get_user_state لكن يرفع الاستثناء عند فشل قاعدة البيانات، حتى يفرّق
+    state_manager بين "لا توجد حالة" والخطأ (فلا يحفظ الخطأ كنتيجة سلبية)
+    """
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as c:
+            _run_query(conn, c, 'get_user_state', (user_id,))
+            return c.fetchone()
 
 def clear_user_state(user_id: int):
     return execute_query("DELETE FROM user_states WHERE user_id = %s", (user_id,), commit=True)
 
 # --- دوال المفضلة وسجل المشاهدة ---
 def is_video_favorite(user_id, video_id):
-    res = execute_query("SELECT 1 FROM user_favorites WHERE user_id = %s AND video_id = %s", (user_id, video_id), fetch="one")
+    res = execute_query('is_video_favorite', (user_id, video_id), fetch="one")
     return bool(res)
 
 def add_to_favorites(user_id, video_id):
-    return execute_query("INSERT INTO user_favorites (user_id, video_id) VALUES (%s, %s) ON CONFLICT (user_id, video_id) DO NOTHING", (user_id, video_id), commit=True)
+    result = execute_query("INSERT INTO user_favorites (user_id, video_id) VALUES (%s, %s) ON CONFLICT (user_id, video_id) DO NOTHING", (user_id, video_id), commit=True)
+    count_service.invalidate('favorites', user_id)
+    return result
 
 def remove_from_favorites(user_id, video_id):
-    return execute_query("DELETE FROM user_favorites WHERE user_id = %s AND video_id = %s", (user_id, video_id), commit=True)
+    result = execute_query("DELETE FROM user_favorites WHERE user_id = %s AND video_id = %s", (user_id, video_id), commit=True)
+    count_service.invalidate('favorites', user_id)
+    return result
+
+def _cached_count(key, query, params):
+    return count_service.get_total(key, lambda: _exact_count(query, params))
 
-def get_user_favorites(user_id, page=0):
-    offset = page * VIDEOS_PER_PAGE
-    videos_query = """
-        SELECT v.* FROM video_archive v
+def get_user_favorites(user_id, page=0, cursor=None):
+    videos = _fetch_keyset_page(
+        f"""
+        SELECT {VIDEO_LIST_COLUMNS}, f.date_added AS sort_ts, f.id AS sort_id FROM video_archive v
         JOIN user_favorites f ON v.id = f.video_id
-        WHERE f.user_id = %s
-        ORDER BY f.date_added DESC
-        LIMIT %s OFFSET %s
-    """
-    videos = execute_query(videos_query, (user_id, VIDEOS_PER_PAGE, offset), fetch="all")
-    total = execute_query("SELECT COUNT(*) as count FROM user_favorites WHERE user_id = %s", (user_id,), fetch="one")
-    return videos, total['count'] if total else 0
+        """,
+        ["f.user_id = %s"], [user_id], ['f.date_added', 'f.id'], page, cursor
+    )
+    total = _cached_count(('favorites', user_id), "FROM user_favorites WHERE user_id = %s", (user_id,))
+    return videos, total
 
 def add_to_history(user_id, video_id):
     query = """
@@ -533,20 +1294,35 @@ def add_to_history(user_id, video_id):
         VALUES (%s, %s, CURRENT_TIMESTAMP)
         ON CONFLICT (user_id, video_id) DO UPDATE SET last_watched = CURRENT_TIMESTAMP
     """
-    return execute_query(query, (user_id, video_id), commit=True)
+    result = execute_query(query, (user_id, video_id), commit=True)
+    count_service.invalidate('history', user_id)
+    return result
 
-def get_user_history(user_id, page=0):
-    offset = page * VIDEOS_PER_PAGE
-    videos_query = """
-        SELECT v.* FROM video_archive v
-        JOIN user_history h ON v.id = h.video_id
-        WHERE h.user_id = %s
-        ORDER BY h.last_watched DESC
-        LIMIT %s OFFSET %s
+def add_to_history_bulk(user_ids, video_ids, watched_at):
     """
-    videos = execute_query(videos_query, (user_id, VIDEOS_PER_PAGE, offset), fetch="all")
-    total = execute_query("SELECT COUNT(*) as count FROM user_history WHERE user_id = %s", (user_id,), fetch="one")
-    return videos, total['count'] if total else 0
+    إضافة/تحديث عدة عناصر في سجل المشاهدة بعبارة واحدة (تُستخدم من write_behind).
+    watched_at أوقات epoch؛ الفيديوهات المحذوفة منذ التسجيل تُتجاهل.
+    """
+    query = """
+        INSERT INTO user_history (user_id, video_id, last_watched)
+        SELECT u.user_id, u.video_id, to_timestamp(u.ts)
+        FROM unnest(%s::bigint[], %s::int[], %s::float8[]) AS u(user_id, video_id, ts)
+        JOIN video_archive v ON v.id = u.video_id
+        ON CONFLICT (user_id, video_id) DO UPDATE
+        SET last_watched = GREATEST(user_history.last_watched, EXCLUDED.last_watched)
+    """
+    return execute_query(query, (list(user_ids), list(video_ids), list(watched_at)), commit=True)
+
+def get_user_history(user_id, page=0, cursor=None):
+    videos = _fetch_keyset_page(
+        f"""
+        SELECT {VIDEO_LIST_COLUMNS}, h.last_watched AS sort_ts, h.id AS sort_id FROM video_archive v
+        JOIN user_history h ON v.id = h.video_id
+        """,
+        ["h.user_id = %s"], [user_id], ['h.last_watched', 'h.id'], page, cursor
+    )
+    total = _cached_count(('history', user_id), "FROM user_history WHERE user_id = %s", (user_id,))
+    return videos, total
 
 # --- دالة حذف المشترك (لحل خطأ البث 403) ---
 def delete_bot_user(user_id):
@@ -555,6 +1331,8 @@ def delete_bot_user(user_id):
     execute_query("DELETE FROM user_favorites WHERE user_id = %s", (user_id,), commit=True)
     execute_query("DELETE FROM user_history WHERE user_id = %s", (user_id,), commit=True)
     execute_query("DELETE FROM video_ratings WHERE user_id = %s", (user_id,), commit=True)
+    count_service.invalidate('favorites', user_id)
+    count_service.invalidate('history', user_id)
     return execute_query("DELETE FROM bot_users WHERE user_id = %s", (user_id,), commit=True)
 
 def move_videos_bulk(video_ids, new_category_id):
@@ -573,6 +1351,10 @@ def move_videos_bulk(video_ids, new_category_id):
 
     query = "UPDATE video_archive SET category_id = %s WHERE id = ANY(%s) RETURNING id"
     result = execute_query(query, (new_category_id, video_ids), fetch='all', commit=True)
+    count_service.invalidate('search')
+    if result:
+        _invalidate_search_results([row['id'] for row in result], [_category_search_text(new_category_id)], [new_category_id])
+        _on_archive_changed('upsert', [row['id'] for row in result])
     return len(result) if isinstance(result, list) else 0
 
 # ==============================================================================
@@ -598,64 +1380,67 @@ def add_comment(video_id, user_id, username, comment_text):
         RETURNING id
     """
     result = execute_query(query, (video_id, user_id, username, comment_text), fetch="one", commit=True)
+    _invalidate_comment_counts()
     return result['id'] if result else None
 
-def get_all_comments(page=0, unread_only=False):
+def _invalidate_comment_counts():
+    count_service.invalidate('comments')
+    count_service.invalidate('user_comments')
+
+def get_all_comments(page=0, unread_only=False, cursor=None):
     """
     جلب جميع التعليقات للأدمن (مع pagination).
     
     Args:
         page: رقم الصفحة
         unread_only: إذا كان True، يجلب التعليقات غير المقروءة فقط
+        cursor: مؤشر keyset من أزرار التنقل (اختياري)
     
     Returns:
         tuple: (قائمة التعليقات، العدد الإجمالي)
     """
-    offset = page * VIDEOS_PER_PAGE
+    where_clauses = ["c.is_read = FALSE"] if unread_only else []
     
-    where_clause = "WHERE is_read = FALSE" if unread_only else ""
-    
-    comments_query = f"""
-        SELECT c.*, v.caption as video_caption, v.file_name as video_name
+    comments = _fetch_keyset_page(
+        """
+        SELECT c.*, v.caption as video_caption, v.file_name as video_name,
+               c.created_at AS sort_ts, c.id AS sort_id
         FROM video_comments c
         JOIN video_archive v ON c.video_id = v.id
-        {where_clause}
-        ORDER BY c.created_at DESC
-        LIMIT %s OFFSET %s
-    """
-    comments = execute_query(comments_query, (VIDEOS_PER_PAGE, offset), fetch="all")
+        """,
+        where_clauses, [], ['c.created_at', 'c.id'], page, cursor
+    )
     
-    count_query = f"SELECT COUNT(*) as count FROM video_comments {where_clause}"
-    total = execute_query(count_query, fetch="one")
+    where_clause = "WHERE is_read = FALSE" if unread_only else ""
+    total = _cached_count(('comments', bool(unread_only)), f"FROM video_comments {where_clause}", None)
     
-    return comments, total['count'] if total else 0
+    return comments, total
 
-def get_user_comments(user_id, page=0):
+def get_user_comments(user_id, page=0, cursor=None):
     """
     جلب تعليقات مستخدم معين (للمستخدم لرؤية تعليقاته والردود عليها).
     
     Args:
         user_id: رقم المستخدم
         page: رقم الصفحة
+        cursor: مؤشر keyset من أزرار التنقل (اختياري)
     
     Returns:
         tuple: (قائمة التعليقات، العدد الإجمالي)
     """
-    offset = page * VIDEOS_PER_PAGE
-    
-    comments_query = """
-        SELECT c.*, v.caption as video_caption, v.file_name as video_name
+    comments = _fetch_keyset_page(
+        """
+        SELECT c.*, v.caption as video_caption, v.file_name as video_name,
+               c.created_at AS sort_ts, c.id AS sort_id
         FROM video_comments c
         JOIN video_archive v ON c.video_id = v.id
-        WHERE c.user_id = %s
-        ORDER BY c.created_at DESC
-        LIMIT %s OFFSET %s
-    """
-    comments = execute_query(comments_query, (user_id, VIDEOS_PER_PAGE, offset), fetch="all")
+        """,
+        ["c.user_id = %s"], [user_id], ['c.created_at', 'c.id'], page, cursor
+    )
     
-    total = execute_query("SELECT COUNT(*) as count FROM video_comments WHERE user_id = %s", (user_id,), fetch="one")
+    total = _cached_count(('user_comments', user_id), "FROM video_comments WHERE user_id = %s", (user_id,))
     
-    return comments, total['count'] if total else 0
+    return comments, total
 
 def get_comment_by_id(comment_id):
     """
@@ -691,7 +1476,9 @@ def reply_to_comment(comment_id, admin_reply):
         SET admin_reply = %s, replied_at = CURRENT_TIMESTAMP, is_read = TRUE
         WHERE id = %s
     """
-    return execute_query(query, (admin_reply, comment_id), commit=True)
+    result = execute_query(query, (admin_reply, comment_id), commit=True)
+    count_service.invalidate('comments', True)
+    return result
 
 def mark_comment_read(comment_id):
     """
@@ -703,7 +1490,9 @@ def mark_comment_read(comment_id):
     Returns:
         True إذا نجح، False إذا فشل
     """
-    return execute_query("UPDATE video_comments SET is_read = TRUE WHERE id = %s", (comment_id,), commit=True)
+    result = execute_query("UPDATE video_comments SET is_read = TRUE WHERE id = %s", (comment_id,), commit=True)
+    count_service.invalidate('comments', True)
+    return result
 
 def delete_comment(comment_id):
     """
@@ -715,7 +1504,9 @@ def delete_comment(comment_id):
     Returns:
         True إذا نجح، False إذا فشل
     """
-    return execute_query("DELETE FROM video_comments WHERE id = %s", (comment_id,), commit=True)
+    result = execute_query("DELETE FROM video_comments WHERE id = %s", (comment_id,), commit=True)
+    _invalidate_comment_counts()
+    return result
 
 def get_unread_comments_count():
     """
@@ -724,8 +1515,7 @@ def get_unread_comments_count():
     Returns:
         عدد التعليقات غير المقروءة
     """
-    result = execute_query("SELECT COUNT(*) as count FROM video_comments WHERE is_read = FALSE", fetch="one")
-    return result['count'] if result else 0
+    return _cached_count(('comments', True), "FROM video_comments WHERE is_read = FALSE", None)
 
 def get_video_comments_count(video_id):
     """
@@ -752,6 +1542,7 @@ def delete_all_comments():
         عدد التعليقات المحذوفة
     """
     result = execute_query("DELETE FROM video_comments RETURNING id", fetch="all", commit=True)
+    _invalidate_comment_counts()
     return len(result) if result else 0
 
 def delete_user_comments(user_id):
@@ -765,6 +1556,7 @@ def delete_user_comments(user_id):
         عدد التعليقات المحذوفة
     """
     result = execute_query("DELETE FROM video_comments WHERE user_id = %s RETURNING id", (user_id,), fetch="all", commit=True)
+    _invalidate_comment_counts()
     return len(result) if result else 0
 
 def delete_old_comments(days=30):
@@ -783,6 +1575,7 @@ def delete_old_comments(days=30):
         RETURNING id
     """
     result = execute_query(query, (days,), fetch="all", commit=True)
+    _invalidate_comment_counts()
     return len(result) if result else 0
 
 def get_comments_stats():
@@ -820,60 +1613,92 @@ def search_videos_for_inline(query, offset=0, limit=50):
     """
     if not query or query.strip() == "":
         # إذا كان البحث فارغاً، نعرض الفيديوهات الأكثر مشاهدة
-        sql = """
+        sql = f"""
             SELECT 
                 v.id, v.file_id, v.caption, v.file_name, v.view_count,
                 v.thumbnail_file_id, v.chat_id, v.message_id, v.content_type,
                 c.name as category_name,
-                COALESCE(AVG(r.rating), 0) as avg_rating,
-                COUNT(r.rating) as rating_count
+                {AVG_RATING_SQL} as avg_rating,
+                v.rating_count
             FROM video_archive v
             LEFT JOIN categories c ON v.category_id = c.id
-            LEFT JOIN video_ratings r ON v.id = r.video_id
             WHERE v.file_id IS NOT NULL 
               AND LENGTH(v.file_id) >= 20
-            GROUP BY v.id, v.file_id, v.caption, v.file_name, v.view_count, 
-                     v.thumbnail_file_id, v.chat_id, v.message_id, v.content_type, c.name
             ORDER BY v.view_count DESC, avg_rating DESC
             LIMIT %s OFFSET %s
         """
         return execute_query(sql, (limit, offset), fetch="all")
     
+    query = normalize_arabic(query)
+    strategy = search_strategy.choose(query)
+    tsquery = parse_search_query(query) if strategy == 'fts' else None
+    started = time.monotonic()
+    if tsquery:
+        results = _search_inline_fts(tsquery, offset, limit)
+    else:
+        strategy = 'ilike'
+        results = _search_inline_smart(query, offset, limit)
+    search_strategy.record('inline', strategy, started, len(results or []))
+    return results
+
+def _search_inline_fts(tsquery, offset, limit):
+    """بحث inline بالـ tsvector مرتب بالصلة (ts_rank) ثم المشاهدات"""
+    sql = f"""
+        WITH matches AS (
+            SELECT v.id, ts_rank(v.search_vector, q) AS rank
+            FROM video_archive v, to_tsquery('{TS_CONFIG}', %s) q
+            WHERE v.search_vector @@ q
+              AND v.file_id IS NOT NULL
+              AND LENGTH(v.file_id) >= 20
+        )
+        SELECT 
+            v.id, v.file_id, v.caption, v.file_name, v.view_count,
+            v.thumbnail_file_id, v.chat_id, v.message_id, v.content_type,
+            c.name as category_name,
+            {AVG_RATING_SQL} as avg_rating,
+            v.rating_count
+        FROM matches m
+        JOIN video_archive v ON v.id = m.id
+        LEFT JOIN categories c ON v.category_id = c.id
+        ORDER BY m.rank DESC, v.view_count DESC, avg_rating DESC
+        LIMIT %s OFFSET %s
+    """
+    return execute_query(sql, (tsquery, limit, offset), fetch="all")
+
+def _search_inline_smart(query, offset, limit):
+    """بحث inline بـ ILIKE مع الترتيب الذكي (الاستراتيجية الأصلية)"""
     # بحث ذكي (Smart Search) مع 4 مستويات للأهمية:
     # 1. تطابق تام (Exact Match)
     # 2. يبدأ بـ (Starts With)
     # 3. كلمة كاملة (Full Word)
     # 4. يحتوي على (Contains)
-    sql = """
+    sql = f"""
         SELECT 
             v.id, v.file_id, v.caption, v.file_name, v.view_count,
             v.thumbnail_file_id, v.chat_id, v.message_id, v.content_type,
             c.name as category_name,
-            COALESCE(AVG(r.rating), 0) as avg_rating,
-            COUNT(r.rating) as rating_count
+            {AVG_RATING_SQL} as avg_rating,
+            v.rating_count
         FROM video_archive v
         LEFT JOIN categories c ON v.category_id = c.id
-        LEFT JOIN video_ratings r ON v.id = r.video_id
         WHERE 
             v.file_id IS NOT NULL 
             AND LENGTH(v.file_id) >= 20
             AND (
-                v.caption ILIKE %s OR 
-                v.file_name ILIKE %s OR 
-                c.name ILIKE %s
+                {SEARCH_CAPTION_SQL} ILIKE %s OR
+                {SEARCH_FILE_NAME_SQL} ILIKE %s OR
+                {SEARCH_CATEGORY_SQL} ILIKE %s
             )
-        GROUP BY v.id, v.file_id, v.caption, v.file_name, v.view_count,
-                 v.thumbnail_file_id, v.chat_id, v.message_id, v.content_type, c.name
         ORDER BY 
             CASE 
-                WHEN v.caption ILIKE %s THEN 0       -- تطابق تام (الأهم)
-                WHEN v.file_name ILIKE %s THEN 0
+                WHEN {SEARCH_CAPTION_SQL} ILIKE %s THEN 0       -- تطابق تام (الأهم)
+                WHEN {SEARCH_FILE_NAME_SQL} ILIKE %s THEN 0
                 
-                WHEN v.caption ILIKE %s THEN 1       -- يبدأ بـ
-                WHEN v.file_name ILIKE %s THEN 1
+                WHEN {SEARCH_CAPTION_SQL} ILIKE %s THEN 1       -- يبدأ بـ
+                WHEN {SEARCH_FILE_NAME_SQL} ILIKE %s THEN 1
                 
-                WHEN v.caption ILIKE %s THEN 2       -- كلمة كاملة (محاطة بمسافات)
-                WHEN v.file_name ILIKE %s THEN 2
+                WHEN {SEARCH_CAPTION_SQL} ILIKE %s THEN 2       -- كلمة كاملة (محاطة بمسافات)
+                WHEN {SEARCH_FILE_NAME_SQL} ILIKE %s THEN 2
                 
                 ELSE 3                               -- مجرد احتواء (الأقل أهمية)
             END,
@@ -898,6 +1723,90 @@ def search_videos_for_inline(query, offset=0, limit=50):
         limit, offset                           # Limit & Offset
     ), fetch="all")
 
+INLINE_INDEX_COLUMNS = f"""
+    v.id, v.file_id, v.caption, v.file_name, v.view_count,
+    v.thumbnail_file_id, v.chat_id, v.message_id, v.content_type,
+    v.normalized_caption, v.normalized_file_name,
+    c.name AS category_name, c.normalized_name AS normalized_category_name,
+    {AVG_RATING_SQL} AS avg_rating,
+    v.rating_count
+"""
+
+def load_inline_index_rows(video_ids=None):
+    """
+    صفوف فهرس البحث في الذاكرة (search_index): كل الفيديوهات القابلة للإرسال، أو المحددة فقط.
+    يرفع الاستثناء عند الفشل حتى لا يُستبدل الفهرس بنسخة فارغة.
+    """
+    if video_ids is None:
+        query = f"""
+            SELECT {INLINE_INDEX_COLUMNS}
+            FROM video_archive v
+            LEFT JOIN categories c ON v.category_id = c.id
+            WHERE v.file_id IS NOT NULL AND LENGTH(v.file_id) >= 20
+            ORDER BY v.id
+        """
+        params = None
+    else:
+        query = f"""
+            SELECT {INLINE_INDEX_COLUMNS}
+            FROM video_archive v
+            LEFT JOIN categories c ON v.category_id = c.id
+            WHERE v.id = ANY(%s) AND v.file_id IS NOT NULL AND LENGTH(v.file_id) >= 20
+            ORDER BY v.id
+        """
+        params = (list(video_ids),)
+
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as c:
+            c.execute(query, params)
+            return c.fetchall()
+
+def load_inline_candidates(query, limit):
+    """
+    كل الفيديوهات التي تطابق البحث (نفس شرط _search_inline_smart) بصيغة load_inline_index_rows،
+    حتى limit + 1 صف: إذا زاد العدد عن limit فالمجموعة غير كاملة.
+    يرفع الاستثناء عند الفشل.
+    """
+    sql = f"""
+        SELECT {INLINE_INDEX_COLUMNS}
+        FROM video_archive v
+        LEFT JOIN categories c ON v.category_id = c.id
+        WHERE v.file_id IS NOT NULL
+          AND LENGTH(v.file_id) >= 20
+          AND (
+              {SEARCH_CAPTION_SQL} ILIKE %s OR
+              {SEARCH_FILE_NAME_SQL} ILIKE %s OR
+              {SEARCH_CATEGORY_SQL} ILIKE %s
+          )
+        LIMIT %s
+    """
+    pattern = f"%{normalize_arabic(query)}%"
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as c:
+            c.execute(sql, (pattern, pattern, pattern, limit + 1))
+            return c.fetchall()
+
+def load_series_rows(video_ids=None):
+    """
+    اسم المسلسل (metadata.series_name) والمشاهدات لكل فيديو، لكل الأرشيف أو لفيديوهات محددة.
+    يرفع الاستثناء عند الفشل (series_index).
+    """
+    query = """
+        SELECT id, metadata->>'series_name' AS series_name, view_count
+        FROM video_archive
+        WHERE COALESCE(metadata->>'series_name', '') <> ''
+    """
+    params = None
+    if video_ids is not None:
+        query += " AND id = ANY(%s)"
+        params = (list(video_ids),)
+    query += " ORDER BY id"
+
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as c:
+            c.execute(query, params)
+            return c.fetchall()
+
 def update_video_thumbnail(video_id, thumbnail_file_id):
     """
     تحديث thumbnail_file_id للفيديو.
@@ -957,6 +1866,65 @@ def get_default_thumbnail():
     """جلب الصورة المصغرة الافتراضية للبوت"""
     return get_bot_setting('default_thumbnail_file_id')
 
+# --- سجل التحديثات المعالجة (منع التكرار بين الـ workers) ---
+
+def mark_update_processed(update_id):
+    """
+    تسجيل update_id كمُعالج.
+
+    Returns:
+        True إذا كان التحديث جديداً، False إذا كان مكرراً، None عند فشل الاتصال
+    """
+    sql_query = """
+        WITH inserted AS (
+            INSERT INTO processed_updates (update_id) VALUES (%s)
+            ON CONFLICT (update_id) DO NOTHING
+            RETURNING 1
+        )
+        SELECT EXISTS (SELECT 1 FROM inserted)
+    """
+    result = execute_query(sql_query, (update_id,), fetch="one", commit=True)
+    return bool(result[0]) if result else None
+
+def cleanup_processed_updates(older_than_seconds):
+    """حذف سجلات التحديثات الأقدم من نافذة منع التكرار"""
+    sql_query = "DELETE FROM processed_updates WHERE received_at < NOW() - make_interval(secs => %s)"
+    return execute_query(sql_query, (older_than_seconds,), commit=True)
+
+# --- جلسات المحادثة (ephemeral_sessions) ---
+def session_get(namespace, session_key):
+    """القيمة المحفوظة أو None إذا لم توجد أو انتهت صلاحيتها"""
+    row = execute_query(
+        "SELECT value FROM ephemeral_sessions WHERE namespace = %s AND session_key = %s AND expires_at > NOW()",
+        (namespace, session_key), fetch="one"
+    )
+    return row['value'] if row else None
+
+def session_set(namespace, session_key, value_json, ttl_seconds):
+    sql_query = """
+        INSERT INTO ephemeral_sessions (namespace, session_key, value, expires_at)
+        VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+        ON CONFLICT (namespace, session_key) DO UPDATE
+        SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+    """
+    return execute_query(sql_query, (namespace, session_key, value_json, ttl_seconds), commit=True)
+
+def session_delete(namespace, session_key):
+    return execute_query("DELETE FROM ephemeral_sessions WHERE namespace = %s AND session_key = %s", (namespace, session_key), commit=True)
+
+def session_pop(namespace, session_key):
+    """حذف الجلسة وإرجاع قيمتها (None إذا لم توجد أو انتهت صلاحيتها)"""
+    row = execute_query(
+        "DELETE FROM ephemeral_sessions WHERE namespace = %s AND session_key = %s RETURNING value, expires_at > NOW() AS valid",
+        (namespace, session_key), fetch="one", commit=True
+    )
+    return row['value'] if row and row['valid'] else None
+
+def cleanup_expired_sessions():
+    """حذف الجلسات المنتهية؛ يعيد عدد الصفوف المحذوفة"""
+    res = execute_query("DELETE FROM ephemeral_sessions WHERE expires_at <= NOW() RETURNING 1", fetch="all", commit=True)
+    return len(res) if isinstance(res, list) else 0
+
 # Alias للتوافق مع السكريبات الخارجية
 def ensure_schema():
     """Alias لـ verify_and_repair_schema - للتوافق مع السكريبات الخارجية"""
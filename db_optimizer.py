@@ -135,6 +135,14 @@ def optimize_database_performance():
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_archive_caption_trgm ON video_archive USING gin (caption gin_trgm_ops)", "idx_video_archive_caption_trgm"),
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_archive_filename_trgm ON video_archive USING gin (file_name gin_trgm_ops)", "idx_video_archive_filename_trgm"),
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_archive_grouping_key ON video_archive(grouping_key)", "idx_video_archive_grouping_key"),
+        # البحث بـ ILIKE على النص المطبّع (normalize_arabic) أو الأصلي قبل تطبيعه (SEARCH_CAPTION_SQL)
+        ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_archive_search_caption_trgm ON video_archive USING gin ((COALESCE(normalized_caption, caption)) gin_trgm_ops)", "idx_video_archive_search_caption_trgm"),
+        ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_archive_search_file_name_trgm ON video_archive USING gin ((COALESCE(normalized_file_name, file_name)) gin_trgm_ops)", "idx_video_archive_search_file_name_trgm"),
+        ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_archive_normalized_null ON video_archive(id) WHERE normalized_caption IS NULL", "idx_video_archive_normalized_null"),
+        # البحث النصي الكامل (SEARCH_STRATEGY=fts)
+        ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_archive_search_vector ON video_archive USING gin (search_vector)", "idx_video_archive_search_vector"),
+        # keyset pagination: (category_id, id) يجعل أي صفحة بنفس تكلفة الأولى
+        ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_archive_category_id_id ON video_archive(category_id, id DESC)", "idx_video_archive_category_id_id"),
         # categories
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_categories_parent_id ON categories(parent_id)", "idx_categories_parent_id"),
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_categories_name ON categories(name)", "idx_categories_name"),
@@ -144,16 +152,20 @@ def optimize_database_performance():
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_favorites_video_id ON user_favorites(video_id)", "idx_user_favorites_video_id"),
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_favorites_date_added_desc ON user_favorites(date_added DESC)", "idx_user_favorites_date_added_desc"),
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_favorites_user_date_desc ON user_favorites(user_id, date_added DESC)", "idx_user_favorites_user_date_desc"),
+        ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_favorites_user_date_id ON user_favorites(user_id, date_added DESC, id DESC)", "idx_user_favorites_user_date_id"),
         # user_history
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_history_user_id ON user_history(user_id)", "idx_user_history_user_id"),
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_history_last_watched_desc ON user_history(last_watched DESC)", "idx_user_history_last_watched_desc"),
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_history_user_watched_desc ON user_history(user_id, last_watched DESC)", "idx_user_history_user_watched_desc"),
+        ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_history_user_watched_id ON user_history(user_id, last_watched DESC, id DESC)", "idx_user_history_user_watched_id"),
         # video_ratings
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_ratings_video_id ON video_ratings(video_id)", "idx_video_ratings_video_id"),
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_ratings_user_id ON video_ratings(user_id)", "idx_video_ratings_user_id"),
         # video_comments
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_comments_user_created_desc ON video_comments(user_id, created_at DESC)", "idx_video_comments_user_created_desc"),
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_comments_unread_created_desc ON video_comments(created_at DESC) WHERE is_read = FALSE", "idx_video_comments_unread_created_desc"),
+        ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_comments_created_id ON video_comments(created_at DESC, id DESC)", "idx_video_comments_created_id"),
+        ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_video_comments_user_created_id ON video_comments(user_id, created_at DESC, id DESC)", "idx_video_comments_user_created_id"),
         # bot_users
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bot_users_join_date_desc ON bot_users(join_date DESC)", "idx_bot_users_join_date_desc"),
         ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bot_users_username ON bot_users(username)", "idx_bot_users_username"),
@@ -6,17 +6,26 @@
 import logging
 import os
 import threading
+import time
 from contextlib import contextmanager
 from urllib.parse import urlparse
 
 import psycopg2
+import psycopg2.extensions
 import psycopg2.pool
 
+import config
+
 logger = logging.getLogger(__name__)
 
 _connection_pool = None
 _pool_lock = threading.Lock()
 
+# اتصالات موروثة من الـ process الأب بعد fork - نحتفظ بمراجعها ولا نغلقها أبداً،
+# لأن إغلاقها يرسل رسالة Terminate عبر socket يستخدمه الأب
+_orphaned_connections = []
+_inherited_backend_pids = set()
+
 # Parse DATABASE_URL once
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
@@ -32,16 +41,331 @@ else:
     }
 
 
-def get_connection_pool(minconn: int = 1, maxconn: int = 10) -> psycopg2.pool.SimpleConnectionPool:
+class PoolTimeoutError(psycopg2.pool.PoolError):
+    """لم يتوفر اتصال خلال مهلة الانتظار"""
+    pass
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """اتصال psycopg2 مع معلومات العمر وآخر استخدام"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+        self.pid = os.getpid()
+        # أسماء الـ prepared statements المُعدّة على جلسة الخادم لهذا الاتصال
+        self.prepared_statements = set()
+
+
+class BoundedConnectionPool:
+    """
+    Connection pool آمن للخيوط:
+    - انتظار محدود بمهلة عند امتلاء الـ pool بدلاً من PoolError فوري
+    - فحص صلاحية الاتصال عند السحب إذا بقي خاملاً لفترة
+    - إعادة تدوير الاتصالات بعد تجاوز العمر الأقصى
+    - مقاييس زمن الانتظار ونسبة الاستخدام
+    """
+
+    def __init__(self, minconn, maxconn, acquire_timeout=10, max_lifetime=1800,
+                 check_idle_after=30, **connect_kwargs):
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle_after = check_idle_after
+        self._connect_kwargs = connect_kwargs
+        self._idle = []
+        self._in_use = set()
+        self._total = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.pid = os.getpid()
+        self.stats = {
+            'acquired': 0,
+            'created': 0,
+            'recycled': 0,
+            'health_check_failures': 0,
+            'timeouts': 0,
+            'waits': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+            'peak_in_use': 0
+        }
+
+        for _ in range(self.minconn):
+            with self._cond:
+                self._total += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                raise
+            with self._cond:
+                self._idle.append(conn)
+
+    def _connect(self):
+        conn = psycopg2.connect(connection_factory=PooledConnection, **self._connect_kwargs)
+        self.stats['created'] += 1
+        return conn
+
+    def _is_expired(self, conn):
+        return self.max_lifetime and time.monotonic() - conn.created_at > self.max_lifetime
+
+    def _discard(self, conn):
+        """إغلاق اتصال وإخراجه من العدّ (يُستدعى مع امتلاك القفل)"""
+        self._total -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._cond.notify()
+
+    def _is_alive(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used_at < self.check_idle_after:
+            return True
+        try:
+            with conn.cursor() as c:
+                c.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            self.stats['health_check_failures'] += 1
+            return False
+
+    def getconn(self, timeout=None):
+        """
+        سحب اتصال من الـ pool مع الانتظار حتى timeout ثانية إذا كان ممتلئاً.
+
+        Raises:
+            PoolTimeoutError: إذا لم يتوفر اتصال خلال المهلة
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise psycopg2.pool.PoolError("connection pool is closed")
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._total < self.maxconn:
+                        self._total += 1
+                        create = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"no connection available within {timeout}s "
+                            f"({self.maxconn} in use)"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+
+                if conn is not None and self._is_expired(conn):
+                    self.stats['recycled'] += 1
+                    self._discard(conn)
+                    continue
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_alive(conn):
+                with self._cond:
+                    self._discard(conn)
+                continue
+
+            wait_ms = (time.monotonic() - started) * 1000
+            with self._cond:
+                self._in_use.add(conn)
+                self.stats['acquired'] += 1
+                if waited:
+                    self.stats['waits'] += 1
+                self.stats['total_wait_ms'] += wait_ms
+                self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+                self.stats['peak_in_use'] = max(self.stats['peak_in_use'], len(self._in_use))
+            return conn
+
+    def putconn(self, conn, close=False):
+        """
+        إرجاع اتصال للـ pool (يُغلق إذا كان تالفاً أو تجاوز العمر الأقصى)
+        """
+        if not close and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+
+        with self._cond:
+            if conn not in self._in_use:
+                logger.warning("Returning a connection that is not checked out from this pool")
+                return
+            self._in_use.discard(conn)
+
+            if close or conn.closed or self._closed:
+                self._discard(conn)
+            elif self._is_expired(conn):
+                self.stats['recycled'] += 1
+                self._discard(conn)
+            else:
+                conn.last_used_at = time.monotonic()
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def closeall(self):
+        """إغلاق كل الاتصالات الخاملة؛ الاتصالات المستخدمة تُغلق عند إرجاعها"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+            self._cond.notify_all()
+
+    def detach_all(self):
+        """
+        فصل كل الاتصالات بدون إغلاقها (يُستدعى في الـ process الابن بعد fork)
+
+        Returns:
+            قائمة الاتصالات المفصولة
+        """
+        connections = list(self._idle) + list(self._in_use)
+        self._idle = []
+        self._in_use = set()
+        self._total = 0
+        self._closed = True
+        return connections
+
+    def get_stats(self):
+        with self._cond:
+            in_use = len(self._in_use)
+            acquired = self.stats['acquired']
+            return {
+                'min': self.minconn,
+                'max': self.maxconn,
+                'open': self._total,
+                'in_use': in_use,
+                'idle': len(self._idle),
+                'utilization_percent': round(in_use / self.maxconn * 100, 2),
+                'avg_wait_ms': round(self.stats['total_wait_ms'] / acquired, 3) if acquired else 0,
+                **{k: round(v, 3) if isinstance(v, float) else v for k, v in self.stats.items()}
+            }
+
+
+def reset_after_fork():
+    """
+    تجاهل الـ pool الموروث من الأب في الـ process الابن؛ يُعاد بناؤه عند أول استخدام.
+    يُستدعى تلقائياً عبر os.register_at_fork ومن post_fork في gunicorn (آمن للتكرار).
+    """
+    global _connection_pool, _pool_lock
+    # القفل قد يكون مأخوذاً من خيط آخر لحظة الـ fork ولن يُحرر أبداً في الابن
+    _pool_lock = threading.Lock()
+
+    pool = _connection_pool
+    _connection_pool = None
+    if pool is None or pool.pid == os.getpid():
+        return 0
+
+    # Condition الخاص بالـ pool قد يكون مأخوذاً أيضاً، لذلك لا نستخدمه هنا
+    connections = pool.detach_all()
+    for conn in connections:
+        try:
+            _inherited_backend_pids.add(conn.get_backend_pid())
+        except Exception:
+            pass
+    _orphaned_connections.extend(connections)
+    logger.info(f"Discarded {len(connections)} connections inherited from parent process {pool.pid}")
+    return len(connections)
+
+
+def close_pool():
+    """إغلاق الـ pool في الـ process الحالي (مثلاً في gunicorn master قبل إنشاء الـ workers)"""
+    global _connection_pool
+    with _pool_lock:
+        pool = _connection_pool
+        _connection_pool = None
+    if pool is not None and pool.pid == os.getpid():
+        pool.closeall()
+        logger.info("Postgres connection pool closed")
+
+
+def verify_fork_safety():
+    """
+    فحص ذاتي: يتأكد أن كل اتصالات الـ pool أُنشئت في هذا الـ process،
+    وأن اتصالاً جديداً لا يستخدم نفس جلسة الخادم لأي اتصال موروث من الأب.
+
+    Returns:
+        dict بالنتيجة؛ 'ok' = False يعني أن اتصالاً عبر الـ fork
+    """
+    pid = os.getpid()
+    pool = get_connection_pool()
+    with pool._cond:
+        foreign = [c for c in list(pool._idle) + list(pool._in_use) if c.pid != pid]
+
+    backend_pid = None
+    with get_db_connection() as conn:
+        if conn.pid != pid:
+            foreign.append(conn)
+        backend_pid = conn.get_backend_pid()
+
+    shared_session = backend_pid in _inherited_backend_pids
+    return {
+        'ok': pool.pid == pid and not foreign and not shared_session,
+        'pid': pid,
+        'pool_pid': pool.pid,
+        'foreign_connections': len(foreign),
+        'backend_pid': backend_pid,
+        'inherited_connections_discarded': len(_orphaned_connections),
+        'shared_session': shared_session
+    }
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def get_connection_pool(minconn=None, maxconn=None) -> BoundedConnectionPool:
     global _connection_pool
+    if _connection_pool is not None and _connection_pool.pid != os.getpid():
+        reset_after_fork()
     if _connection_pool is None:
         with _pool_lock:
             if _connection_pool is None:
-                _connection_pool = psycopg2.pool.SimpleConnectionPool(minconn, maxconn, **DB_CONFIG)
-                logger.info("Postgres connection pool created")
+                _connection_pool = BoundedConnectionPool(
+                    config.DB_POOL_MIN if minconn is None else minconn,
+                    config.DB_POOL_MAX if maxconn is None else maxconn,
+                    acquire_timeout=config.DB_POOL_ACQUIRE_TIMEOUT,
+                    max_lifetime=config.DB_POOL_MAX_LIFETIME,
+                    check_idle_after=config.DB_POOL_CHECK_IDLE_AFTER,
+                    **DB_CONFIG
+                )
+                logger.info(
+                    f"Postgres connection pool created "
+                    f"(min={_connection_pool.minconn}, max={_connection_pool.maxconn})"
+                )
     return _connection_pool
 
 
+def get_pool_stats():
+    """مقاييس الـ pool الحالي (None إذا لم يُنشأ بعد)"""
+    pool = _connection_pool
+    return pool.get_stats() if pool is not None else None
+
+
 @contextmanager
 def get_db_connection():
     """Context manager: يحصل على اتصال من الpool ويعيده بأمان."""
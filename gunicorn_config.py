@@ -43,12 +43,33 @@ def worker_int(worker):
 
 def pre_fork(server, worker):
     server.log.info(f"Worker {worker.pid} spawned")
+    # الـ master لا يحتاج اتصالات بعد preload؛ إغلاقها قبل الـ fork يمنع توريثها
+    import db_pool
+    db_pool.close_pool()
 
 def post_fork(server, worker):
     server.log.info(f"Worker {worker.pid} spawned")
+    import db_pool
+    db_pool.reset_after_fork()
+
+    # فحص ذاتي: لا يوجد اتصال عبر الـ fork
+    try:
+        check = db_pool.verify_fork_safety()
+    except Exception as e:
+        worker.log.warning(f"Worker {worker.pid}: fork-safety self-check skipped ({e})")
+        return
+    if not check['ok']:
+        worker.log.critical(f"Worker {worker.pid}: database connection crossed fork: {check}")
+        raise RuntimeError("Database connection shared across fork")
+    worker.log.info(
+        f"Worker {worker.pid}: fork-safety self-check passed "
+        f"(backend pid {check['backend_pid']}, {check['inherited_connections_discarded']} inherited discarded)"
+    )
 
 def when_ready(server):
     server.log.info("Gunicorn server is ready. Spawning workers")
+    import db_pool
+    db_pool.close_pool()
 
 def worker_abort(worker):
     worker.log.info(f"Worker {worker.pid} received SIGABRT signal")
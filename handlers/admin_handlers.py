@@ -10,7 +10,7 @@ from .button_styles import STYLE_DANGER, STYLE_PRIMARY, STYLE_SUCCESS, inline_bu
 
 from db_manager import (
     add_category, get_all_user_ids, add_required_channel, remove_required_channel,
-    get_required_channels, get_subscriber_count, get_bot_stats, get_popular_videos,
+    get_required_channels, get_subscriber_count, get_bot_stats,
     delete_videos_by_ids, get_video_by_id, delete_bot_user,
     delete_category_and_contents, move_videos_from_category, delete_category_by_id,
     get_categories_tree, set_active_category_id, get_child_categories,
@@ -20,6 +20,7 @@ from db_manager import (
 from state_manager import state_handler, clear_user_waiting_state, set_user_waiting_for_input, States
 
 from .helpers import admin_steps, create_categories_keyboard, CALLBACK_DELIMITER, create_hierarchical_category_keyboard
+from .markup_cache import cached_markup
 
 logger = logging.getLogger(__name__)
 
@@ -148,8 +149,7 @@ def handle_move_by_id_input(message, bot):
         admin_steps[message.chat.id] = {"video_ids": valid_videos}
 
         # 🌟 استخدام الكيبورد الهرمي الجديد بدلاً من البناء اليدوي
-        move_keyboard = create_hierarchical_category_keyboard("admin::move_confirm", add_back_button=False)
-        move_keyboard.add(inline_button("🔙 إلغاء", STYLE_DANGER, callback_data="back_to_main"))
+        move_keyboard = create_hierarchical_category_keyboard("admin::move_confirm", add_back_button=False, cancel_button=("🔙 إلغاء", "back_to_main"))
 
         # رسالة مختلفة للنقل الفردي أو الجماعي
         if len(valid_videos) == 1:
@@ -251,6 +251,9 @@ def register(bot, admin_ids):
         return wrapper
 
     def generate_admin_panel():
+        return cached_markup(('admin_panel',), _build_admin_panel)
+
+    def _build_admin_panel():
         keyboard = InlineKeyboardMarkup(row_width=2)
 
         # ─── قسم: إدارة التصنيفات ───
@@ -9,18 +9,20 @@ from .button_styles import STYLE_DANGER, STYLE_PRIMARY, STYLE_SUCCESS, inline_bu
 from db_manager import (
     search_videos, get_videos, get_videos_ratings_bulk, VIDEOS_PER_PAGE,
     get_user_favorites, get_user_history, get_categories_tree,
-    get_child_categories, get_category_by_id,
+    get_child_categories, get_category_by_id, get_category_page,
     is_video_favorite, add_to_favorites, remove_from_favorites,
     get_user_video_rating, get_video_rating_stats,
-    add_video_rating, add_to_history, get_popular_videos,
+    add_video_rating,
     set_active_category_id, get_required_channels,
     move_videos_bulk, delete_category_and_contents,
     delete_category_by_id, move_videos_from_category,
     delete_videos_by_ids, get_video_by_id, get_all_user_ids,
     get_subscriber_count, get_bot_stats, add_required_channel,
-    remove_required_channel, increment_video_view_count,
+    remove_required_channel,
     get_unread_comments_count
 )
+from write_behind import record_video_view
+from leaderboards import leaderboards, get_leaderboard_page
 from . import helpers
 from . import admin_handlers
 from . import comment_handlers  # إضافة معالجات التعليقات
@@ -30,6 +32,13 @@ from state_manager import States
 
 logger = logging.getLogger(__name__)
 
+POPULAR_TITLES = {
+    "most_viewed": "📈 <b>الفيديوهات الأكثر مشاهدة</b>",
+    "highest_rated": "⭐ <b>الفيديوهات الأعلى تقييماً</b>",
+    "trending_24h": "🔥 <b>الأكثر مشاهدة خلال 24 ساعة</b>",
+    "trending_7d": "📅 <b>الأكثر مشاهدة خلال 7 أيام</b>"
+}
+
 def register(bot, admin_ids):
     @bot.callback_query_handler(func=lambda call: True)
     def callback_query(call):
@@ -40,6 +49,10 @@ def register(bot, admin_ids):
 
 # ملاحظة: سنجيب على callback_query في كل معالج حسب الحاجة بدلاً من الرد الفوري هنا
 
+            # المستخدم يطلب إعادة التحقق صراحةً: تجاهل حالة الاشتراك المخزنة
+            if action == "check_subscription":
+                helpers.invalidate_subscription_cache(user_id)
+
             is_subscribed, unsub_channels = helpers.check_subscription(bot, user_id)
 
             # 2. فرض التحقق قبل تنفيذ أي إجراء
@@ -65,9 +78,7 @@ def register(bot, admin_ids):
 
             # --- إذا كان مشتركاً، أكمل تنفيذ الأمر ---
             if action == "check_subscription":
-                # إعادة فحص الاشتراك
-                is_subscribed, unsub_channels = helpers.check_subscription(bot, user_id)
-                
+                # نتيجة الفحص أعلاه حديثة (تم تجاوز الكاش لهذا الإجراء)
                 if is_subscribed:
                     try:
                         bot.delete_message(call.message.chat.id, call.message.message_id)
@@ -138,15 +149,16 @@ def register(bot, admin_ids):
                 return
 
             elif action in ["fav_page", "history_page"]:
-                _, _, page_str = data
-                page = int(page_str)
+                page = int(data[2])
+                # الأزرار القديمة لا تحمل مؤشراً وتعمل برقم الصفحة
+                cursor = data[3] if len(data) > 3 else None
 
                 if action == "fav_page":
-                    videos, total_count = get_user_favorites(user_id, page)
+                    videos, total_count = get_user_favorites(user_id, page, cursor=cursor)
                     prefix = "fav_page"
                     title = "💖 <b>قائمة مفضلاتك</b>"
                 else:
-                    videos, total_count = get_user_history(user_id, page)
+                    videos, total_count = get_user_history(user_id, page, cursor=cursor)
                     prefix = "history_page"
                     title = "📺 <b>سجل مشاهداتك</b>"
 
@@ -154,7 +166,7 @@ def register(bot, admin_ids):
                     bot.edit_message_text("لا توجد المزيد من النتائج.", call.message.chat.id, call.message.message_id)
                     return
 
-                keyboard = helpers.create_paginated_keyboard(videos, total_count, page, prefix, "user_data")
+                keyboard = helpers.create_paginated_keyboard(videos, total_count, page, prefix, "user_data", keyset=True)
                 bot.edit_message_text(title, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
                 return
 
@@ -175,8 +187,7 @@ def register(bot, admin_ids):
                     keyboard = InlineKeyboardMarkup(row_width=1)
                     
                     # استخدام الدالة الهرمية لعرض التصنيفات أولاً
-                    categories = get_categories_tree()
-                    tree = helpers.build_category_tree(categories)
+                    tree = helpers.category_tree()
                     
                     for cat in tree:
                         keyboard.add(inline_button(
@@ -226,8 +237,9 @@ def register(bot, admin_ids):
                     bot.edit_message_text("🗣️ <b>اختر الحالة:</b>", call.message.chat.id, call.message.message_id, reply_markup=keyboard)
 
             elif action == "adv_search":
-                _, filter_type, filter_value, page_str = data
+                _, filter_type, filter_value, page_str = data[:4]
                 page = int(page_str)
+                cursor = data[4] if len(data) > 4 else None
                 query_data = helpers.user_last_search.get(call.message.chat.id)
 
                 if not query_data or 'query' not in query_data:
@@ -236,7 +248,7 @@ def register(bot, admin_ids):
                     return
 
                 query = query_data['query']
-                kwargs = {'query': query, 'page': page}
+                kwargs = {'query': query, 'page': page, 'cursor': cursor}
 
                 if filter_type == 'quality':
                     kwargs['quality'] = filter_value
@@ -251,12 +263,13 @@ def register(bot, admin_ids):
 
                 action_prefix = f"adv_search::{filter_type}"
                 context_id = filter_value
-                keyboard = helpers.create_paginated_keyboard(videos, total_count, page, action_prefix, context_id)
+                keyboard = helpers.create_paginated_keyboard(videos, total_count, page, action_prefix, context_id, keyset=True)
                 bot.edit_message_text(f"🔍 <b>نتائج البحث المتقدم عن</b> \"<code>{query}</code>\":", call.message.chat.id, call.message.message_id, reply_markup=keyboard)
 
             elif action == "search_scope":
-                _, scope, page_str = data
+                _, scope, page_str = data[:3]
                 page = int(page_str)
+                cursor = data[3] if len(data) > 3 else None
                 query_data = helpers.user_last_search.get(call.message.chat.id)
 
                 if not query_data or 'query' not in query_data:
@@ -266,14 +279,14 @@ def register(bot, admin_ids):
 
                 query = query_data['query']
                 category_id = int(scope) if scope != "all" else None
-                videos, total_count = search_videos(query=query, page=page, category_id=category_id)
+                videos, total_count = search_videos(query=query, page=page, category_id=category_id, cursor=cursor)
 
                 if not videos:
                     bot.edit_message_text(f"❌ لا توجد نتائج لـ \"{query}\".", call.message.chat.id, call.message.message_id)
                     return
 
                 prefix = "search_scope"
-                keyboard = helpers.create_paginated_keyboard(videos, total_count, page, prefix, scope)
+                keyboard = helpers.create_paginated_keyboard(videos, total_count, page, prefix, scope, keyset=True)
                 bot.edit_message_text(f"🔍 <b>نتائج البحث عن</b> \"<code>{query}</code>\":", call.message.chat.id, call.message.message_id, reply_markup=keyboard)
 
             # --- معالجات الأدمن ---
@@ -330,13 +343,12 @@ def register(bot, admin_ids):
 
                 elif sub_action == "add_cat_sub_select_parent":
                     # 🌟 استخدام الكيبورد الهرمي الجديد
-                    move_keyboard = create_hierarchical_category_keyboard("admin::add_cat_sub_set_parent", add_back_button=False)
+                    move_keyboard = create_hierarchical_category_keyboard("admin::add_cat_sub_set_parent", add_back_button=False, cancel_button=("↩️ إلغاء 🟡", "back_to_main"))
                     
                     if not move_keyboard.keyboard or len(move_keyboard.keyboard) == 0:
                         bot.answer_callback_query(call.id, "أنشئ تصنيفاً رئيسياً أولاً.", show_alert=True)
                         return
 
-                    move_keyboard.add(inline_button("↩️ إلغاء 🟡", STYLE_DANGER, callback_data="back_to_main"))
                     bot.edit_message_text("🎯 <b>اختر التصنيف الأب:</b>", call.message.chat.id, call.message.message_id, reply_markup=move_keyboard)
 
                 elif sub_action == "add_cat_sub_set_parent":
@@ -348,13 +360,12 @@ def register(bot, admin_ids):
 
                 elif sub_action == "delete_category_select":
                     # 🌟 استخدام الكيبورد الهرمي الجديد
-                    delete_keyboard = create_hierarchical_category_keyboard("admin::delete_category_confirm", add_back_button=False)
+                    delete_keyboard = create_hierarchical_category_keyboard("admin::delete_category_confirm", add_back_button=False, cancel_button=("↩️ إلغاء 🟡", "back_to_main"))
                     
                     if not delete_keyboard.keyboard or len(delete_keyboard.keyboard) == 0:
                         bot.answer_callback_query(call.id, "لا توجد تصنيفات لحذفها.", show_alert=True)
                         return
 
-                    delete_keyboard.add(inline_button("↩️ إلغاء 🟡", STYLE_DANGER, callback_data="back_to_main"))
                     bot.edit_message_text("🗑️ <b>اختر التصنيف الذي تريد حذفه:</b>", call.message.chat.id, call.message.message_id, reply_markup=delete_keyboard)
 
                 elif sub_action == "delete_category_confirm":
@@ -501,13 +512,12 @@ def register(bot, admin_ids):
 
                 elif sub_action == "set_active":
                     # 🌟 استخدام الكيبورد الهرمي الجديد
-                    keyboard = create_hierarchical_category_keyboard("admin::setcat", add_back_button=False)
+                    keyboard = create_hierarchical_category_keyboard("admin::setcat", add_back_button=False, cancel_button=("↩️ إلغاء 🟡", "back_to_main"))
                     
                     if not keyboard.keyboard or len(keyboard.keyboard) == 0:
                         bot.answer_callback_query(call.id, "لا توجد تصنيفات حالياً.", show_alert=True)
                         return
 
-                    keyboard.add(inline_button("↩️ إلغاء 🟡", STYLE_DANGER, callback_data="back_to_main"))
                     bot.edit_message_text("🔘 <b>اختر التصنيف الذي تريد تفعيله:</b>", call.message.chat.id, call.message.message_id, reply_markup=keyboard)
 
                 elif sub_action == "setcat":
@@ -537,55 +547,39 @@ def register(bot, admin_ids):
 
                 elif sub_action == "stats":
                     stats = get_bot_stats()
-                    popular = get_popular_videos()
                     stats_text = (f"📊 *إحصائيات المحتوى*\n\n"
                                 f"- إجمالي الفيديوهات: *{stats['video_count']}*\n"
                                 f"- إجمالي التصنيفات: *{stats['category_count']}*\n"
                                 f"- إجمالي المشاهدات: *{stats['total_views']}*\n"
                                 f"- إجمالي التقييمات: *{stats['total_ratings']}*")
 
-                    if popular["most_viewed"]:
-                        most_viewed = popular["most_viewed"][0]
+                    most_viewed = leaderboards.get_top("most_viewed")
+                    if most_viewed:
                         title = (most_viewed['caption'] or "").split('\n')[0] or "فيديو"
                         stats_text += f"\n\n🔥 الأكثر مشاهدة: {title} ({most_viewed['view_count']} مشاهدة)"
 
-                    if popular["highest_rated"] and popular["highest_rated"][0].get('avg_rating') is not None:
-                        highest_rated = popular["highest_rated"][0]
+                    highest_rated = leaderboards.get_top("highest_rated")
+                    if highest_rated and highest_rated.get('avg_rating') is not None:
                         title = (highest_rated['caption'] or "").split('\n')[0] or "فيديو"
                         stats_text += f"\n⭐ الأعلى تقييماً: {title} ({highest_rated['avg_rating']:.1f}/5)"
 
                     bot.send_message(call.message.chat.id, stats_text, parse_mode="Markdown")
 
-            elif action == "popular":
+            elif action in ("popular", "popular_page"):
+                # القوائم محسوبة مسبقاً في الذاكرة (leaderboards)، والصفحة مجرد تقسيم لها
                 sub_action = data[1]
-                popular_data = get_popular_videos()
-                videos = popular_data.get(sub_action, [])
-                title = "📈 <b>الفيديوهات الأكثر مشاهدة</b>" if sub_action == "most_viewed" else "⭐ <b>الفيديوهات الأعلى تقييماً</b>"
+                page = int(data[2]) if action == "popular_page" and len(data) > 2 else 0
+                videos, total_count = get_leaderboard_page(sub_action, page)
+                title = POPULAR_TITLES.get(sub_action, POPULAR_TITLES["most_viewed"])
 
                 if videos:
-                    keyboard = helpers.create_paginated_keyboard(videos, len(videos), 0, "popular_page", sub_action)
-                    bot.edit_message_text(title, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
-                else:
-                    bot.edit_message_text("لا توجد فيديوهات كافية لعرضها حالياً.", call.message.chat.id, call.message.message_id)
-            
-            elif action == "popular_page":
-                sub_action = data[1]
-                page = int(data[2])
-                popular_data = get_popular_videos()
-                videos = popular_data.get(sub_action, [])
-                title = "📈 <b>الفيديوهات الأكثر مشاهدة</b>" if sub_action == "most_viewed" else "⭐ <b>الفيديوهات الأعلى تقييماً</b>"
-                
-                if videos:
-                    # حساب الفيديوهات للصفحة المحددة
-                    start_idx = page * VIDEOS_PER_PAGE
-                    end_idx = start_idx + VIDEOS_PER_PAGE
-                    page_videos = videos[start_idx:end_idx]
-                    
-                    keyboard = helpers.create_paginated_keyboard(page_videos, len(videos), page, "popular_page", sub_action)
-                    bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+                    keyboard = helpers.create_paginated_keyboard(videos, total_count, page, "popular_page", sub_action)
+                    if action == "popular":
+                        bot.edit_message_text(title, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+                    else:
+                        bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=keyboard)
                 else:
                     bot.edit_message_text("لا توجد فيديوهات كافية لعرضها حالياً.", call.message.chat.id, call.message.message_id)
-                
 
             elif action == "back_to_cats":
                 helpers.list_videos(bot, call.message, edit_message=call.message)
@@ -617,9 +611,8 @@ def register(bot, admin_ids):
                     message_id_int = int(message_id)
                     chat_id_int = int(chat_id)
                     
-                    # زيادة عداد المشاهدات وإضافة للسجل
-                    increment_video_view_count(video_id_int)
-                    add_to_history(user_id, video_id_int)
+                    # زيادة عداد المشاهدات وإضافة للسجل (تُكتب دفعة واحدة عبر write_behind)
+                    record_video_view(user_id, video_id_int)
                     
                     # محاولة إرسال الفيديو
                     bot.copy_message(call.message.chat.id, chat_id_int, message_id_int)
@@ -671,7 +664,8 @@ def register(bot, admin_ids):
 
             elif action == "cat":
                 try:
-                    _, category_id_str, page_str = data
+                    _, category_id_str, page_str = data[:3]
+                    cursor = data[3] if len(data) > 3 else None
                     
                     # التحقق من صحة البيانات
                     if not category_id_str.isdigit() or not page_str.isdigit():
@@ -680,18 +674,18 @@ def register(bot, admin_ids):
                     
                     category_id, page = int(category_id_str), int(page_str)
                     
-                    # الحصول على معلومات التصنيف
-                    category = get_category_by_id(category_id)
-                    if not category:
+                    # التصنيف والتصنيفات الفرعية وصفحة الفيديوهات مع تقييماتها والعدد الكلي في استعلام واحد
+                    category_page = get_category_page(category_id, page, cursor=cursor)
+                    if not category_page:
                         bot.edit_message_text("❌ التصنيف غير موجود.", call.message.chat.id, call.message.message_id)
                         return
                     
-                    # الحصول على التصنيفات الفرعية والفيديوهات
-                    child_categories = get_child_categories(category_id)
-                    videos, total_count = get_videos(category_id, page)
+                    category = category_page['category']
+                    child_categories = category_page['children']
+                    videos, total_count = category_page['videos'], category_page['total']
                     
                     if not child_categories and not videos:
-                        empty_keyboard = helpers.create_combined_keyboard([], [], 0, 0, category_id)
+                        empty_keyboard = helpers.create_combined_keyboard([], [], 0, 0, category_id, parent_category=category)
                         bot.edit_message_text(
                             f"📂 التصنيف \"{category['name']}\"\n\n"
                             "هذا التصنيف فارغ حالياً. لا توجد أقسام فرعية أو فيديوهات.",
@@ -700,7 +694,7 @@ def register(bot, admin_ids):
                             reply_markup=empty_keyboard
                         )
                     else:
-                        keyboard = helpers.create_combined_keyboard(child_categories, videos, total_count, page, category_id)
+                        keyboard = helpers.create_combined_keyboard(child_categories, videos, total_count, page, category_id, parent_category=category)
                         content_info = []
                         if child_categories:
                             content_info.append(f"{len(child_categories)} قسم فرعي")
@@ -727,7 +721,8 @@ def register(bot, admin_ids):
             
             elif action == "my_comments":
                 page = int(data[1]) if len(data) > 1 else 0
-                comment_handlers.show_user_comments(bot, call.message, page)
+                cursor = data[2] if len(data) > 2 else None
+                comment_handlers.show_user_comments(bot, call.message, page, cursor=cursor)
                 bot.answer_callback_query(call.id)
             
             elif action == "admin_comments":
@@ -735,7 +730,8 @@ def register(bot, admin_ids):
                     bot.answer_callback_query(call.id, "⛔ هذا الأمر للإدارة فقط", show_alert=True)
                     return
                 page = int(data[1]) if len(data) > 1 else 0
-                comment_handlers.show_all_comments(bot, user_id, admin_ids, page, unread_only=False)
+                cursor = data[2] if len(data) > 2 else None
+                comment_handlers.show_all_comments(bot, user_id, admin_ids, page, unread_only=False, cursor=cursor)
                 bot.answer_callback_query(call.id)
             
             elif action == "admin_comments_unread":
@@ -743,7 +739,8 @@ def register(bot, admin_ids):
                     bot.answer_callback_query(call.id, "⛔ هذا الأمر للإدارة فقط", show_alert=True)
                     return
                 page = int(data[1]) if len(data) > 1 else 0
-                comment_handlers.show_all_comments(bot, user_id, admin_ids, page, unread_only=True)
+                cursor = data[2] if len(data) > 2 else None
+                comment_handlers.show_all_comments(bot, user_id, admin_ids, page, unread_only=True, cursor=cursor)
                 bot.answer_callback_query(call.id)
             
             elif action == "reply_comment":
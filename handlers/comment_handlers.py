@@ -7,6 +7,8 @@
 import logging
 from telebot import types
 import db_manager as db
+from state_manager import state_manager
+from pagination import page_cursors
 from .button_styles import STYLE_DANGER, STYLE_PRIMARY, STYLE_SUCCESS, inline_button
 
 logger = logging.getLogger(__name__)
@@ -34,7 +36,7 @@ def handle_add_comment(bot, call):
         video_id = int(call.data.split("::")[1])
         
         # حفظ حالة المستخدم
-        db.set_user_state(user_id, "waiting_comment", {"video_id": video_id})
+        state_manager.set_state(user_id, "waiting_comment", {"video_id": video_id})
         
         bot.answer_callback_query(call.id)
         bot.send_message(
@@ -53,7 +55,7 @@ def process_comment_text(bot, message):
     """معالج لاستقبال نص التعليق من المستخدم"""
     try:
         user_id = message.from_user.id
-        state = db.get_user_state(user_id)
+        state = state_manager.get_state(user_id)
         
         if not state or state['state'] != 'waiting_comment':
             return
@@ -63,7 +65,7 @@ def process_comment_text(bot, message):
         
         if not video_id:
             bot.send_message(user_id, "❌ حدث خطأ، الرجاء المحاولة مرة أخرى")
-            db.clear_user_state(user_id)
+            state_manager.clear_state(user_id)
             return
         
         # إضافة التعليق
@@ -74,7 +76,7 @@ def process_comment_text(bot, message):
         
         if comment_id:
             # مسح الحالة
-            db.clear_user_state(user_id)
+            state_manager.clear_state(user_id)
             
             # إرسال تأكيد للمستخدم
             bot.send_message(
@@ -91,11 +93,11 @@ def process_comment_text(bot, message):
         logger.error(f"Error in process_comment_text: {e}", exc_info=True)
         bot.send_message(message.from_user.id, "❌ حدث خطأ، حاول مرة أخرى")
 
-def show_user_comments(bot, message, page=0):
+def show_user_comments(bot, message, page=0, cursor=None):
     """عرض تعليقات المستخدم"""
     try:
         user_id = message.from_user.id
-        comments, total = db.get_user_comments(user_id, page)
+        comments, total = db.get_user_comments(user_id, page, cursor=cursor)
         
         if not comments:
             bot.send_message(
@@ -134,14 +136,15 @@ def show_user_comments(bot, message, page=0):
         if total > db.VIDEOS_PER_PAGE:
             markup = types.InlineKeyboardMarkup()
             buttons = []
+            prev_cursor, next_cursor = page_cursors(comments)
             
             if page > 0:
-                buttons.append(inline_button("◀️ السابق", STYLE_PRIMARY, callback_data=f"my_comments::{page-1}"))
+                buttons.append(inline_button("◀️ السابق", STYLE_PRIMARY, callback_data=f"my_comments::{page-1}::{prev_cursor}"))
             
             buttons.append(inline_button(f"📄 {page+1}/{(total-1)//db.VIDEOS_PER_PAGE + 1}", STYLE_PRIMARY, callback_data="noop"))
             
             if (page + 1) * db.VIDEOS_PER_PAGE < total:
-                buttons.append(inline_button("التالي ▶️", STYLE_PRIMARY, callback_data=f"my_comments::{page+1}"))
+                buttons.append(inline_button("التالي ▶️", STYLE_PRIMARY, callback_data=f"my_comments::{page+1}::{next_cursor}"))
             
             markup.row(*buttons)
             bot.send_message(user_id, "🔽 التنقل:", reply_markup=markup)
@@ -154,14 +157,14 @@ def show_user_comments(bot, message, page=0):
 # معالجات الأدمن
 # ==============================================================================
 
-def show_all_comments(bot, user_id, admin_ids, page=0, unread_only=False):
+def show_all_comments(bot, user_id, admin_ids, page=0, unread_only=False, cursor=None):
     """عرض جميع التعليقات للأدمن"""
     try:
         if user_id not in admin_ids:
             bot.send_message(user_id, "⛔ هذا الأمر للإدارة فقط")
             return
         
-        comments, total = db.get_all_comments(page, unread_only)
+        comments, total = db.get_all_comments(page, unread_only, cursor=cursor)
         
         filter_text = "غير المقروءة" if unread_only else "جميع"
         
@@ -222,14 +225,15 @@ def show_all_comments(bot, user_id, admin_ids, page=0, unread_only=False):
             
             # أزرار التنقل
             nav_buttons = []
+            prev_cursor, next_cursor = page_cursors(comments)
             if page > 0:
-                callback = f"admin_comments_unread::{page-1}" if unread_only else f"admin_comments::{page-1}"
+                callback = f"admin_comments_unread::{page-1}::{prev_cursor}" if unread_only else f"admin_comments::{page-1}::{prev_cursor}"
                 nav_buttons.append(inline_button("◀️ السابق", STYLE_PRIMARY, callback_data=callback))
             
             nav_buttons.append(inline_button(f"📄 {page+1}/{(total-1)//db.VIDEOS_PER_PAGE + 1}", STYLE_PRIMARY, callback_data="noop"))
             
             if (page + 1) * db.VIDEOS_PER_PAGE < total:
-                callback = f"admin_comments_unread::{page+1}" if unread_only else f"admin_comments::{page+1}"
+                callback = f"admin_comments_unread::{page+1}::{next_cursor}" if unread_only else f"admin_comments::{page+1}::{next_cursor}"
                 nav_buttons.append(inline_button("التالي ▶️", STYLE_PRIMARY, callback_data=callback))
             
             if nav_buttons:
@@ -261,7 +265,7 @@ def handle_reply_comment(bot, call, admin_ids):
         comment_id = int(call.data.split("::")[1])
         
         # حفظ حالة الأدمن
-        db.set_user_state(user_id, "replying_comment", {"comment_id": comment_id})
+        state_manager.set_state(user_id, "replying_comment", {"comment_id": comment_id})
         
         bot.answer_callback_query(call.id)
         bot.send_message(
@@ -284,7 +288,7 @@ def process_reply_text(bot, message, admin_ids):
         if user_id not in admin_ids:
             return
         
-        state = db.get_user_state(user_id)
+        state = state_manager.get_state(user_id)
         
         if not state or state['state'] != 'replying_comment':
             return
@@ -294,7 +298,7 @@ def process_reply_text(bot, message, admin_ids):
         
         if not comment_id:
             bot.send_message(user_id, "❌ حدث خطأ، الرجاء المحاولة مرة أخرى")
-            db.clear_user_state(user_id)
+            state_manager.clear_state(user_id)
             return
         
         # جلب بيانات التعليق
@@ -302,7 +306,7 @@ def process_reply_text(bot, message, admin_ids):
         
         if not comment:
             bot.send_message(user_id, "❌ التعليق غير موجود")
-            db.clear_user_state(user_id)
+            state_manager.clear_state(user_id)
             return
         
         # حفظ الرد
@@ -310,7 +314,7 @@ def process_reply_text(bot, message, admin_ids):
         
         if db.reply_to_comment(comment_id, reply_text):
             # مسح الحالة
-            db.clear_user_state(user_id)
+            state_manager.clear_state(user_id)
             
             # إرسال تأكيد للأدمن
             bot.send_message(
@@ -5,6 +5,10 @@ from telebot.types import InlineKeyboardMarkup, ReplyKeyboardMarkup
 import math
 import re
 import logging
+import config
+from cache_utils import TTLCache
+from pagination import page_cursors
+from session_store import session_namespace
 from .button_styles import (
     STYLE_DANGER,
     STYLE_PRIMARY,
@@ -16,14 +20,22 @@ from db_manager import (
     get_child_categories, get_category_by_id, get_user_video_rating,
     get_video_rating_stats, VIDEOS_PER_PAGE, CALLBACK_DELIMITER,
     get_required_channels, is_video_favorite, get_categories_tree,
-    get_videos_ratings_bulk  # إضافة الدالة الجديدة
+    get_videos_ratings_bulk,  # إضافة الدالة الجديدة
+    get_categories_derived, get_categories_version
 )
+from .markup_cache import cached_markup
 
 logger = logging.getLogger(__name__)
 
-# القواميس المشتركة لتخزين حالة المستخدمين
-admin_steps = {}
-user_last_search = {}
+# جلسات المستخدمين (مشتركة بين الـ workers حسب SESSION_BACKEND، مع TTL وحجم محدود)
+admin_steps = session_namespace('admin_steps')
+user_last_search = session_namespace('last_search')
+
+# كاش حالة الاشتراك لكل (مستخدم، قناة) - يوفر استدعاء get_chat_member مع كل callback
+_subscription_cache = TTLCache(
+    max_entries=config.SUBSCRIPTION_CACHE_MAX_SIZE,
+    default_ttl=config.SUBSCRIPTION_CACHE_POSITIVE_TTL
+)
 
 
 # ============================================
@@ -86,10 +98,49 @@ def build_category_tree(categories):
     return tree
 
 
+def category_tree():
+    """ناتج build_category_tree لكل التصنيفات (يُحسب مرة واحدة لكل إصدار)"""
+    return get_categories_derived('tree', build_category_tree)
+
+
+def _fetch_channel_subscription(bot, user_id, channel):
+    """
+    فحص اشتراك المستخدم في قناة واحدة عبر Telegram.
+
+    Returns:
+        (is_member, cacheable): cacheable=False للأخطاء المؤقتة التي لا يجب تخزينها
+    """
+    try:
+        member = bot.get_chat_member(channel['channel_id'], user_id)
+        return member.status in ['member', 'administrator', 'creator'], True
+    except telebot.apihelper.ApiTelegramException as e:
+        error_msg = str(e.description).lower() if hasattr(e, 'description') else str(e).lower()
+        if 'user not found' in error_msg or 'chat not found' in error_msg or 'bad request' in error_msg:
+            logger.warning(f"Could not check user {user_id} in channel {channel['channel_id']}. Assuming subscribed. Error: {e}")
+            return True, True
+        elif 'forbidden' in error_msg or 'kicked' in error_msg or 'left' in error_msg:
+            # المستخدم غير مشترك أو محظور أو غادر القناة
+            return False, True
+        else:
+            # في حالة أخطاء أخرى، نفترض عدم الاشتراك للأمان
+            logger.error(f"Error checking subscription for user {user_id} in channel {channel['channel_id']}: {e}")
+            return False, False
+    except Exception as e:
+        logger.error(f"Unexpected error checking subscription for user {user_id} in channel {channel['channel_id']}: {e}")
+        return False, False
+
+
+def invalidate_subscription_cache(user_id):
+    """حذف حالة الاشتراك المخزنة للمستخدم (عند ضغطه على زر التحقق بعد الاشتراك)"""
+    return _subscription_cache.invalidate(lambda key: key[0] == user_id)
+
+
 def check_subscription(bot, user_id):
     """
     Verifies if a user is subscribed to all required channels.
     This function is now centralized here.
+    Results are cached per (user, channel) with separate TTLs for
+    subscribed and unsubscribed users.
     """
     required_channels = get_required_channels()
     if not required_channels:
@@ -97,23 +148,14 @@ def check_subscription(bot, user_id):
     
     unsubscribed = []
     for channel in required_channels:
-        try:
-            member = bot.get_chat_member(channel['channel_id'], user_id)
-            if member.status not in ['member', 'administrator', 'creator']:
-                unsubscribed.append(channel)
-        except telebot.apihelper.ApiTelegramException as e:
-            error_msg = str(e.description).lower() if hasattr(e, 'description') else str(e).lower()
-            if 'user not found' in error_msg or 'chat not found' in error_msg or 'bad request' in error_msg:
-                logger.warning(f"Could not check user {user_id} in channel {channel['channel_id']}. Assuming subscribed. Error: {e}")
-            elif 'forbidden' in error_msg or 'kicked' in error_msg or 'left' in error_msg:
-                # المستخدم غير مشترك أو محظور أو غادر القناة
-                unsubscribed.append(channel)
-            else:
-                # في حالة أخطاء أخرى، نفترض عدم الاشتراك للأمان
-                logger.error(f"Error checking subscription for user {user_id} in channel {channel['channel_id']}: {e}")
-                unsubscribed.append(channel)
-        except Exception as e:
-            logger.error(f"Unexpected error checking subscription for user {user_id} in channel {channel['channel_id']}: {e}")
+        cache_key = (user_id, channel['channel_id'])
+        is_member = _subscription_cache.get(cache_key)
+        if is_member is None:
+            is_member, cacheable = _fetch_channel_subscription(bot, user_id, channel)
+            if cacheable:
+                ttl = config.SUBSCRIPTION_CACHE_POSITIVE_TTL if is_member else config.SUBSCRIPTION_CACHE_NEGATIVE_TTL
+                _subscription_cache.set(cache_key, is_member, ttl=ttl)
+        if not is_member:
             unsubscribed.append(channel)
     
     return not unsubscribed, unsubscribed
@@ -144,6 +186,10 @@ def main_menu(bot_username=None):
     Args:
         bot_username: اسم البوت (اختياري) لإضافة زر switch inline
     """
+    return cached_markup(('main_menu', bot_username), _build_main_menu)
+
+
+def _build_main_menu():
     markup = ReplyKeyboardMarkup(
         resize_keyboard=True,
         one_time_keyboard=False,
@@ -169,6 +215,14 @@ def main_menu(bot_username=None):
 
 
 def create_categories_keyboard(parent_id=None):
+    return cached_markup(
+        ('categories', parent_id),
+        lambda: _build_categories_keyboard(parent_id),
+        version=get_categories_version(), versioned=True
+    )
+
+
+def _build_categories_keyboard(parent_id):
     keyboard = InlineKeyboardMarkup(row_width=2)
     categories = get_child_categories(parent_id)
     # 📁 أيقونة موحدة لكل تصنيف لشكل أجمل ومنظم
@@ -187,42 +241,52 @@ def create_categories_keyboard(parent_id=None):
 # ============================================
 # 🌟 دالة جديدة: إنشاء كيبورد هرمي للتصنيفات
 # ============================================
-def create_hierarchical_category_keyboard(callback_prefix, add_back_button=True):
+def create_hierarchical_category_keyboard(callback_prefix, add_back_button=True, cancel_button=None):
     """
     تنشئ لوحة مفاتيح منظمة بشكل شجري لجميع التصنيفات
     
     Args:
         callback_prefix: البادئة المستخدمة في callback_data (مثل: "admin::move_confirm")
         add_back_button: إضافة زر رجوع أم لا
+        cancel_button: (النص، callback_data) لزر إلغاء في آخر اللوحة؛ اللوحة المحفوظة
+                       في الكاش لا تقبل add() بعد إنشائها
     
     Returns:
-        InlineKeyboardMarkup: لوحة المفاتيح المنظمة
+        لوحة المفاتيح المنظمة (SerializedMarkup من الكاش)
     """
+    return cached_markup(
+        ('hierarchical', callback_prefix, add_back_button, cancel_button),
+        lambda: _build_hierarchical_category_keyboard(callback_prefix, add_back_button, cancel_button),
+        version=get_categories_version(), versioned=True
+    )
+
+
+def _build_hierarchical_category_keyboard(callback_prefix, add_back_button, cancel_button):
     keyboard = InlineKeyboardMarkup(row_width=1)
     
-    # جلب جميع التصنيفات
-    all_categories = get_categories_tree()
+    # الشجرة محسوبة مسبقاً لكل إصدار من التصنيفات
+    tree = category_tree()
     
-    if not all_categories:
+    if not tree:
         keyboard.add(inline_button("🚫 لا توجد تصنيفات", STYLE_DANGER, callback_data="noop"))
-        return keyboard
-    
-    # بناء الشجرة
-    tree = build_category_tree(all_categories)
-    
-    # إضافة أزرار التصنيفات
-    for cat in tree:
-        keyboard.add(
-            inline_button(
-                cat['name'], 
-                STYLE_PRIMARY,
-                callback_data=f"{callback_prefix}::{cat['id']}"
+    else:
+        # إضافة أزرار التصنيفات
+        for cat in tree:
+            keyboard.add(
+                inline_button(
+                    cat['name'], 
+                    STYLE_PRIMARY,
+                    callback_data=f"{callback_prefix}::{cat['id']}"
+                )
             )
-        )
-    
-    # إضافة زر الرجوع إذا كان مطلوباً
-    if add_back_button:
-        keyboard.add(inline_button("❌ إلغاء", STYLE_DANGER, callback_data="back_to_main"))
+        
+        # إضافة زر الرجوع إذا كان مطلوباً
+        if add_back_button:
+            keyboard.add(inline_button("❌ إلغاء", STYLE_DANGER, callback_data="back_to_main"))
+
+    if cancel_button:
+        text, callback_data = cancel_button
+        keyboard.add(inline_button(text, STYLE_DANGER, callback_data=callback_data))
     
     return keyboard
 
@@ -260,20 +324,34 @@ def format_video_display_info(video):
     return f"{title}{info_line}{rating_text}{views_text}"
 
 
-def create_paginated_keyboard(videos, total_count, current_page, action_prefix, context_id):
+def _page_callback(base_callback, page, cursor=None):
+    """بيانات زر التنقل: {base}::{page} مع مؤشر keyset إذا توفر"""
+    callback = f"{base_callback}{CALLBACK_DELIMITER}{page}"
+    return f"{callback}{CALLBACK_DELIMITER}{cursor}" if cursor else callback
+
+
+def create_paginated_keyboard(videos, total_count, current_page, action_prefix, context_id, keyset=False):
+    """
+    keyset: إضافة مؤشر keyset لأزرار التنقل (للقوائم المجلوبة من قاعدة البيانات)؛
+    القوائم المقسمة في الذاكرة (مثل الشائعة) تكتفي برقم الصفحة.
+    إذا كانت الفيديوهات تحتوي avg_rating مسبقاً (مثل القوائم الشائعة) لا يتم جلب التقييمات.
+    """
     keyboard = InlineKeyboardMarkup(row_width=1)
 
     # تحويل كائن DictRow إلى قاموس عادي
     mutable_videos = [dict(v) for v in videos] 
     
     # جلب جميع التقييمات دفعة واحدة (حل N+1)
-    video_ids = [v['id'] for v in mutable_videos]
-    ratings_dict = get_videos_ratings_bulk(video_ids)
+    ratings_dict = {}
+    if not all('avg_rating' in v for v in mutable_videos):
+        video_ids = [v['id'] for v in mutable_videos]
+        ratings_dict = get_videos_ratings_bulk(video_ids)
     
     for video in mutable_videos:
         # إضافة avg_rating من القاموس
-        rating_info = ratings_dict.get(video['id'], {'avg': 0, 'count': 0})
-        video['avg_rating'] = rating_info['avg']
+        if 'avg_rating' not in video:
+            rating_info = ratings_dict.get(video['id'], {'avg': 0, 'count': 0})
+            video['avg_rating'] = rating_info['avg']
 
         # عرض معلومات الفيديو
         display_title = format_video_display_info(video)
@@ -281,17 +359,18 @@ def create_paginated_keyboard(videos, total_count, current_page, action_prefix,
 
     nav_buttons = []
     base_callback = f"{action_prefix}::{context_id}"
+    prev_cursor, next_cursor = page_cursors(mutable_videos) if keyset else (None, None)
 
     total_pages = max(math.ceil(total_count / VIDEOS_PER_PAGE), 1)
 
     if current_page > 0:
-        nav_buttons.append(inline_button("◀️ السابق", STYLE_PRIMARY, callback_data=f"{base_callback}::{current_page - 1}"))
+        nav_buttons.append(inline_button("◀️ السابق", STYLE_PRIMARY, callback_data=_page_callback(base_callback, current_page - 1, prev_cursor)))
 
     # مؤشر الصفحة في المنتصف (زر معطّل بـ noop)
     nav_buttons.append(inline_button(f"📄 {current_page + 1}/{total_pages}", STYLE_PRIMARY, callback_data="noop"))
 
     if current_page < total_pages - 1:
-        nav_buttons.append(inline_button("التالي ▶️", STYLE_PRIMARY, callback_data=f"{base_callback}::{current_page + 1}"))
+        nav_buttons.append(inline_button("التالي ▶️", STYLE_PRIMARY, callback_data=_page_callback(base_callback, current_page + 1, next_cursor)))
 
     if nav_buttons:
         keyboard.add(*nav_buttons, row_width=3)
@@ -300,7 +379,11 @@ def create_paginated_keyboard(videos, total_count, current_page, action_prefix,
     return keyboard
 
 
-def create_combined_keyboard(child_categories, videos, total_video_count, current_page, parent_category_id):
+def create_combined_keyboard(child_categories, videos, total_video_count, current_page, parent_category_id, parent_category=None):
+    """
+    parent_category: صف التصنيف إذا كان محمّلاً مسبقاً (يوفر استعلاماً).
+    إذا كانت الفيديوهات تحتوي avg_rating مسبقاً (من get_category_page) لا يتم جلب التقييمات.
+    """
     keyboard = InlineKeyboardMarkup()
     if child_categories:
         # 🗂️ عنوان قسم الأقسام الفرعية بشكل أنيق (زر noop)
@@ -316,14 +399,17 @@ def create_combined_keyboard(child_categories, videos, total_video_count, curren
         # تحويل كائنات DictRow
         mutable_videos = [dict(v) for v in videos] 
 
-        # جلب جميع التقييمات دفعة واحدة (حل N+1)
-        video_ids = [v['id'] for v in mutable_videos]
-        ratings_dict = get_videos_ratings_bulk(video_ids)
+        # جلب جميع التقييمات دفعة واحدة (حل N+1) - إلا إذا وصلت مع الفيديوهات
+        ratings_dict = {}
+        if not all('avg_rating' in v for v in mutable_videos):
+            video_ids = [v['id'] for v in mutable_videos]
+            ratings_dict = get_videos_ratings_bulk(video_ids)
 
         for video in mutable_videos:
             # إضافة avg_rating من القاموس
-            rating_info = ratings_dict.get(video['id'], {'avg': 0, 'count': 0})
-            video['avg_rating'] = rating_info['avg']
+            if 'avg_rating' not in video:
+                rating_info = ratings_dict.get(video['id'], {'avg': 0, 'count': 0})
+                video['avg_rating'] = rating_info['avg']
 
             display_title = format_video_display_info(video)
             keyboard.add(inline_button(f"▶️ {display_title}", STYLE_PRIMARY, callback_data=f"video::{video['id']}::{video['message_id']}::{video['chat_id']}") , row_width=1)
@@ -331,19 +417,22 @@ def create_combined_keyboard(child_categories, videos, total_video_count, curren
             
     nav_buttons = []
     total_pages = max(math.ceil(total_video_count / VIDEOS_PER_PAGE), 1) if total_video_count else 1
+    base_callback = f"cat::{parent_category_id}"
+    prev_cursor, next_cursor = page_cursors(videos)
 
     if current_page > 0:
-        nav_buttons.append(inline_button("◀️ السابق", STYLE_PRIMARY, callback_data=f"cat::{parent_category_id}::{current_page - 1}"))
+        nav_buttons.append(inline_button("◀️ السابق", STYLE_PRIMARY, callback_data=_page_callback(base_callback, current_page - 1, prev_cursor)))
 
     if videos and total_video_count > 0:
         # مؤشر الصفحة
         nav_buttons.append(inline_button(f"📄 {current_page + 1}/{total_pages}", STYLE_PRIMARY, callback_data="noop"))
 
     if current_page < total_pages - 1:
-        nav_buttons.append(inline_button("التالي ▶️", STYLE_PRIMARY, callback_data=f"cat::{parent_category_id}::{current_page + 1}"))
+        nav_buttons.append(inline_button("التالي ▶️", STYLE_PRIMARY, callback_data=_page_callback(base_callback, current_page + 1, next_cursor)))
     if nav_buttons:
         keyboard.add(*nav_buttons, row_width=3)
-    parent_category = get_category_by_id(parent_category_id)
+    if parent_category is None:
+        parent_category = get_category_by_id(parent_category_id)
     if parent_category and parent_category.get('parent_id') is not None:
         keyboard.add(inline_button("↩️ رجوع", STYLE_SUCCESS, callback_data=f"cat::{parent_category['parent_id']}::0"), row_width=1)
     else:
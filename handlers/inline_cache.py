@@ -0,0 +1,259 @@
+# handlers/inline_cache.py
+# ==============================================================================
+# كاش صفحات نتائج الـ inline الجاهزة للإرسال
+# ==============================================================================
+#
+# cache_time في answer_inline_query يفيد فقط نفس العميل ونفس النص بالضبط؛ هنا تُحفظ
+# الصفحة على الخادم حسب (البحث المطبّع، offset) فتشترك فيها كل الطلبات:
+# - النتائج تُحوّل إلى JSON مرة واحدة (telebot يرسل to_json() كما هو)
+# - صيغة المستندات (بعد VIDEO_CONTENT_TYPE_INVALID) تُحفظ بمفتاح مستقل وتُقدّم
+#   على صيغة الفيديو لنفس الصفحة، فلا تتكرر المحاولة الفاشلة
+# - عند تغيّر الأرشيف تُحذف الصفحات المتأثرة فقط (انظر _on_archive_change)
+# - البحث الفارغ (الأكثر مشاهدة) يُحفظ بنفس الطريقة بمفتاح ''
+#
+# إعادة استخدام البادئة (INLINE_PREFIX_REUSE، مع INLINE_SEARCH_BACKEND=sql وبحث ilike):
+# عند أول صفحة لبحث جديد تُجلب كل الفيديوهات المطابقة (حتى INLINE_PREFIX_MAX_CANDIDATES)
+# بدل صفحة واحدة. نتائج أي بحث يبدأ بنفس النص جزء من هذه المجموعة (مطابقة "يحتوي")،
+# فتُصفّى وتُرتب في الذاكرة بـ rank_docs بدون SQL، وكذلك الصفحات التالية.
+# البحث الذي تجاوز الحد يُحفظ كـ _BROAD، وامتداداته القصيرة (حتى INLINE_PREFIX_BROAD_SKIP_CHARS
+# حرفاً) تذهب مباشرة إلى search_inline: جلب مجموعة ستُرمى غالباً يضاعف الاستعلامات لكل حرف.
+
+import logging
+import threading
+
+from telebot.types import JsonSerializable
+
+import config
+import db_manager as db
+from cache_utils import TTLCache, estimate_size
+from search_engine import normalize_arabic, query_may_match, search_strategy
+from search_index import make_docs, rank_docs, search_inline
+
+logger = logging.getLogger(__name__)
+
+VIDEO = 'video'
+DOCUMENT = 'document'
+
+# البحث له نتائج أكثر من INLINE_PREFIX_MAX_CANDIDATES (لا تُحفظ مجموعته)
+_BROAD = object()
+
+
+class SerializedResult(JsonSerializable):
+    """InlineQueryResult محوّل مسبقاً إلى JSON"""
+
+    __slots__ = ('json',)
+
+    def __init__(self, json_text):
+        self.json = json_text
+
+    def to_json(self):
+        return self.json
+
+
+class InlinePage:
+    """
+    صفحة واحدة: الفيديوهات (لبناء صيغة المستندات عند الحاجة) والنتائج الجاهزة
+    """
+
+    __slots__ = ('videos', 'results', 'next_offset', 'video_ids', 'size')
+
+    def __init__(self, videos, results, next_offset):
+        self.videos = videos
+        self.results = [SerializedResult(result.to_json()) for result in results]
+        self.next_offset = next_offset
+        self.video_ids = frozenset(video['id'] for video in videos)
+        self.size = estimate_size(videos) + sum(len(result.json) for result in self.results)
+
+
+class CandidateSet:
+    """كل الفيديوهات المطابقة لبحث واحد (بصيغة make_docs)"""
+
+    __slots__ = ('docs', 'video_ids', 'size')
+
+    def __init__(self, rows):
+        self.docs = make_docs(rows)
+        self.video_ids = frozenset(doc[0][0] for doc in self.docs)
+        self.size = estimate_size(self.docs)
+
+
+def _page_size(page):
+    return page.size if page is not _BROAD else 0
+
+
+class InlineResultCache:
+    """
+    (البحث المطبّع، offset، الصيغة) -> InlinePage
+    """
+
+    def __init__(self, max_entries=2000, ttl=300, max_bytes=None, empty_ttl=30,
+                 prefix_reuse=True, prefix_min_length=3, max_candidates=500, prefix_max_entries=200,
+                 broad_skip_chars=3):
+        self._cache = TTLCache(max_entries=max_entries, default_ttl=ttl, max_bytes=max_bytes, sizeof=_page_size)
+        self._candidates = TTLCache(max_entries=prefix_max_entries, default_ttl=ttl, max_bytes=max_bytes, sizeof=_page_size)
+        self.empty_ttl = empty_ttl
+        self.prefix_reuse = prefix_reuse
+        self.prefix_min_length = max(1, prefix_min_length)
+        self.max_candidates = max_candidates
+        self.broad_skip_chars = max(0, broad_skip_chars)
+        self.stats = {
+            'prefix_hits': 0,
+            'candidate_loads': 0,
+            'broad_queries': 0,
+            'broad_skips': 0
+        }
+        self._listener_registered = False
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self):
+        """تسجيل مستمع تغيّرات الأرشيف (مرة واحدة)"""
+        if self._listener_registered:
+            return
+        with self._start_lock:
+            if not self._listener_registered:
+                db.register_archive_listener(self._on_archive_change)
+                self._listener_registered = True
+
+    def get(self, query, offset):
+        query = normalize_arabic(query)
+        page = self._cache.get((query, offset, DOCUMENT))
+        if page is None:
+            page = self._cache.get((query, offset, VIDEO))
+        return page
+
+    def put(self, query, offset, videos, results, next_offset, variant=VIDEO):
+        page = InlinePage(videos, results, next_offset)
+        ttl = None if page.results else self.empty_ttl
+        self._cache.set((normalize_arabic(query), offset, variant), page, ttl=ttl)
+        return page
+
+    # --- إعادة استخدام البادئة ---
+
+    def _prefix_enabled(self, query):
+        return (self.prefix_reuse
+                and config.INLINE_SEARCH_BACKEND != 'memory'
+                and len(query) >= self.prefix_min_length
+                and search_strategy.choose(query) == 'ilike')
+
+    def find_candidates(self, query):
+        """
+        مجموعة أطول بادئة محفوظة لهذا البحث (المطبّع)، أو None
+        """
+        for end in range(len(query), self.prefix_min_length - 1, -1):
+            entry = self._candidates.get(query[:end])
+            if entry is not None and entry is not _BROAD:
+                return entry
+        return None
+
+    def _near_broad_prefix(self, query):
+        """
+        هل هذا البحث أو بادئة له أقصر بـ broad_skip_chars حرفاً على الأكثر محفوظ كـ _BROAD
+        """
+        shortest = max(self.prefix_min_length, len(query) - self.broad_skip_chars)
+        return any(self._candidates.get(query[:end]) is _BROAD for end in range(len(query), shortest - 1, -1))
+
+    def search_in_memory(self, query_text, offset, limit):
+        """
+        نتائج الصفحة من مجموعة بادئة محفوظة بدون قاعدة البيانات، أو None
+        """
+        query = normalize_arabic(query_text)
+        if not self._prefix_enabled(query):
+            return None
+        candidates = self.find_candidates(query)
+        if candidates is None:
+            return None
+        self.stats['prefix_hits'] += 1
+        return rank_docs(query, candidates.docs, offset, limit)
+
+    def search(self, query_text, offset, limit):
+        """
+        البحث من قاعدة البيانات: للصفحة الأولى تُجلب المجموعة الكاملة إذا كانت صغيرة
+        بما يكفي وتُحفظ للبادئات، وإلا search_inline العادي
+        """
+        query = normalize_arabic(query_text)
+        if offset == 0 and self._prefix_enabled(query):
+            if self._near_broad_prefix(query):
+                self.stats['broad_skips'] += 1
+                return search_inline(query_text, offset=offset, limit=limit)
+            try:
+                rows = db.load_inline_candidates(query, self.max_candidates)
+            except Exception as e:
+                logger.error(f"Inline candidates load failed: {e}")
+                rows = None
+            if rows is not None and len(rows) <= self.max_candidates:
+                candidates = CandidateSet(rows)
+                self._candidates.set(query, candidates)
+                self.stats['candidate_loads'] += 1
+                return rank_docs(query, candidates.docs, offset, limit)
+            if rows is not None:
+                self._candidates.set(query, _BROAD)
+                self.stats['broad_queries'] += 1
+        return search_inline(query_text, offset=offset, limit=limit)
+
+    def _on_archive_change(self, op, video_ids):
+        if op == 'reload' or video_ids is None:
+            self.clear()
+            return
+        if not len(self._cache) and not len(self._candidates):
+            return
+
+        video_ids = set(video_ids)
+        texts = []
+        if op == 'upsert':
+            # نصوص الفيديوهات المضافة أو المعدلة: قد تظهر الآن في بحث لم تكن فيه
+            try:
+                rows = db.load_inline_index_rows(video_ids)
+            except Exception as e:
+                logger.error(f"Inline result cache: failed to load changed videos, clearing: {e}")
+                self.clear()
+                return
+            for row in rows:
+                texts += [row['normalized_caption'], row['normalized_file_name'], row['normalized_category_name']]
+
+        # كل صفحات البحث تُحذف معاً حتى لا تتداخل الـ offsets بين صفحات قديمة وجديدة
+        stale = {key[0] for key, page in self._cache.items() if page.video_ids & video_ids}
+        if op == 'upsert':
+            stale.update(
+                key[0] for key, page in self._cache.items()
+                # الفيديو الجديد بدون مشاهدات يظهر في آخر قائمة الأكثر مشاهدة
+                if (key[0] and query_may_match(key[0], texts)) or (not key[0] and not page.next_offset)
+            )
+        if stale:
+            removed = self._cache.invalidate(lambda key: key[0] in stale)
+            logger.debug(f"Inline result cache: invalidated {removed} pages")
+
+        # مجموعات البادئات: ما احتوى فيديو متغيراً أو قد يحتوي فيديو جديداً
+        # (مطابقة "يحتوي" على النص كما في load_inline_candidates)
+        self._candidates.invalidate_items(
+            lambda query, entry: entry is not _BROAD and (
+                bool(entry.video_ids & video_ids) or any(text and query in text for text in texts)
+            )
+        )
+
+    def clear(self):
+        self._cache.clear()
+        self._candidates.clear()
+
+    def get_stats(self):
+        return {
+            **self._cache.get_stats(),
+            'candidate_sets': self._candidates.get_stats(),
+            **self.stats
+        }
+
+
+# مثيل عام
+inline_results = InlineResultCache(
+    max_entries=config.INLINE_RESULT_CACHE_MAX_SIZE,
+    ttl=config.INLINE_RESULT_CACHE_TTL,
+    max_bytes=config.INLINE_RESULT_CACHE_MAX_BYTES,
+    empty_ttl=min(config.INLINE_CACHE_TIME, 30),
+    prefix_reuse=config.INLINE_PREFIX_REUSE,
+    prefix_min_length=config.INLINE_PREFIX_MIN_LENGTH,
+    max_candidates=config.INLINE_PREFIX_MAX_CANDIDATES,
+    prefix_max_entries=config.INLINE_PREFIX_CACHE_MAX_SIZE,
+    broad_skip_chars=config.INLINE_PREFIX_BROAD_SKIP_CHARS
+)
+
+
+def get_inline_result_cache_stats():
+    return inline_results.get_stats()
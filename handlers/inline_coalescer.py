@@ -0,0 +1,70 @@
+# handlers/inline_coalescer.py
+# ==============================================================================
+# تجميع استعلامات الـ inline أثناء الكتابة: آخر استعلام لكل مستخدم فقط يصل لقاعدة البيانات
+# ==============================================================================
+#
+# كتابة "مسلسل الحلقة" ترسل استعلاماً لكل حرف تقريباً. كل استعلام يُسجَّل عند وصوله
+# (note() في الـ webhook قبل الطابور)، وعند بدء معالجته يُهمل فوراً إذا وصل بعده
+# استعلام أحدث من نفس المستخدم (Telegram يعرض نتائج آخر استعلام فقط).
+#
+# لا انتظار في مسار المعالجة: في وضع async يتشارك عدة مستخدمين نفس المسار، وأي
+# sleep هنا يؤخرهم جميعاً. تحديثات المستخدم الواحد تُعالج بالترتيب، فالاستعلامات
+# التي تراكمت خلف استعلام بطيء تُهمل كلها ما عدا الأحدث.
+
+import logging
+import threading
+
+import config
+from cache_utils import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class InlineQueryCoalescer:
+    """
+    user_id -> معرف آخر استعلام وصل
+    """
+
+    def __init__(self, enabled=True, max_users=10000):
+        self.enabled = enabled
+        self._latest = TTLCache(max_entries=max_users, default_ttl=60)
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'superseded': 0
+        }
+
+    def note(self, inline_query):
+        """تسجيل استعلام عند وصوله"""
+        if self.enabled:
+            self._latest.set(inline_query.from_user.id, inline_query.id)
+
+    def is_superseded(self, inline_query):
+        """
+        Returns:
+            True إذا وصل استعلام أحدث من نفس المستخدم (لا داعي للبحث ولا للرد)
+        """
+        if not self.enabled:
+            return False
+        latest = self._latest.get(inline_query.from_user.id)
+        if latest is None or latest == inline_query.id:
+            return False
+        with self._stats_lock:
+            self.stats['superseded'] += 1
+        return True
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {
+            'enabled': self.enabled,
+            'tracked_users': len(self._latest),
+            **stats
+        }
+
+
+# مثيل عام
+inline_coalescer = InlineQueryCoalescer(config.INLINE_COALESCE_ENABLED)
+
+
+def get_inline_coalescer_stats():
+    return inline_coalescer.get_stats()
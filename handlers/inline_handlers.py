@@ -5,13 +5,20 @@ from telebot.types import (
     InlineQueryResultCachedVideo,
     InlineQueryResultCachedDocument,
     InlineQueryResultArticle,
-    InputTextMessageContent
+    InputTextMessageContent,
+    InlineKeyboardMarkup
 )
 import logging
 import os
+import zlib
 
 import config
 import db_manager as db
+from handlers.inline_cache import inline_results, DOCUMENT
+from handlers.inline_coalescer import inline_coalescer
+from search_engine import normalize_arabic
+from series_index import suggest_series
+from .button_styles import STYLE_PRIMARY, inline_button
 
 logger = logging.getLogger(__name__)
 INLINE_CACHE_TIME = getattr(config, "INLINE_CACHE_TIME", 300)
@@ -41,15 +48,43 @@ def register(bot):
 
             logger.info(f"📥 Inline query user={user_id} q='{query_text}' offset={offset_val}")
             
-            # البحث في قاعدة البيانات مع الـ offset
-            try:
-                # نطلب 25 نتيجة
-                videos = db.search_videos_for_inline(query_text, offset=offset_val, limit=25)
-                logger.info(f"📊 DB returned {len(videos) if videos else 0} videos")
-            except Exception as db_err:
-                logger.error(f"❌ DB search error: {db_err}", exc_info=True)
-                videos = None
+            # أثناء الكتابة: إهمال الاستعلام إذا تبعه استعلام أحدث من نفس المستخدم
+            if offset_val == 0 and inline_coalescer.is_superseded(inline_query):
+                logger.info(f"⏭️ Superseded inline query user={user_id} q='{query_text}'")
+                return
+            
+            # بادئة قصيرة: اقتراح أسماء مسلسلات من الذاكرة بدل البحث في كل العناوين
+            if offset_val == 0 and 0 < len(normalize_arabic(query_text)) <= config.SERIES_TYPEAHEAD_MAX_LENGTH:
+                suggestions = suggest_series(query_text)
+                if suggestions:
+                    results = [create_series_suggestion(series) for series in suggestions]
+                    bot.answer_inline_query(inline_query.id, results, cache_time=INLINE_EMPTY_CACHE_TIME, next_offset="")
+                    logger.info(f"✅ Sent {len(results)} series suggestions")
+                    return
             
+            # الصفحة جاهزة في الكاش؟ وإلا البحث في قاعدة البيانات مع الـ offset
+            inline_results.ensure_started()
+            page = inline_results.get(query_text, offset_val)
+            if page is not None:
+                videos = page.videos
+                logger.info(f"⚡ Cache hit: {len(videos)} videos")
+            else:
+                # بحث يكمل بادئة محفوظة: تصفية في الذاكرة
+                videos = inline_results.search_in_memory(query_text, offset_val, 25)
+                if videos is not None:
+                    logger.info(f"⚡ Prefix reuse: {len(videos)} videos")
+                else:
+                    try:
+                        # نطلب 25 نتيجة
+                        videos = inline_results.search(query_text, offset_val, 25)
+                        logger.info(f"📊 DB returned {len(videos) if videos else 0} videos")
+                    except Exception as db_err:
+                        logger.error(f"❌ DB search error: {db_err}", exc_info=True)
+                        videos = None
+                if videos is not None and not videos:
+                    # "لا توجد نتائج" أيضاً تُحفظ (لمدة أقصر)
+                    inline_results.put(query_text, offset_val, [], [], "")
+
             if not videos:
                 # إذا لم تكن هناك نتائج في الصفحة الأولى، نرسل رسالة "لا يوجد"
                 if offset_val == 0:
@@ -79,12 +114,15 @@ def register(bot):
                     next_offset = str(offset_val + 25)
 
                 # المحاولة الأولى: عرض كل النتائج حسب نوعها المخزن
-                results = []
-                for video in videos:
-                    is_document = (video.get('content_type') == 'DOCUMENT')
-                    res = create_inline_result(video, use_document=is_document)
-                    if res:
-                        results.append(res)
+                if page is None:
+                    results = []
+                    for video in videos:
+                        is_document = (video.get('content_type') == 'DOCUMENT')
+                        res = create_inline_result(video, use_document=is_document)
+                        if res:
+                            results.append(res)
+                    page = inline_results.put(query_text, offset_val, videos, results, next_offset)
+                results = page.results
 
                 if not results:
                     logger.warning("⚠️ No valid results generated")
@@ -129,6 +167,7 @@ def register(bot):
                                         next_offset=next_offset
                                     )
                                     logger.info(f"✅ Fallback OK: Sent {len(doc_results)} document results")
+                                    inline_results.put(query_text, offset_val, videos, doc_results, next_offset, variant=DOCUMENT)
                                 except Exception as e2:
                                     logger.error(f"❌ Fallback also failed: {e2}")
                         else:
@@ -153,6 +192,22 @@ def register(bot):
             except Exception as e_inner:
                 logger.error(f"Failed to send error response: {e_inner}")
 
+def create_series_suggestion(series):
+    """
+    اقتراح مسلسل: الرسالة باسم المسلسل (تبحث عنه في المحادثة الخاصة مع البوت)،
+    وزر لعرض حلقاته في الـ inline
+    """
+    name = series['name']
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(inline_button("🔎 عرض الحلقات", STYLE_PRIMARY, switch_inline_query_current_chat=name))
+    return InlineQueryResultArticle(
+        id=f"series_{zlib.crc32(name.encode('utf-8'))}",
+        title=f"📺 {name}",
+        description=f"🎬 {series['videos']:,} فيديو | 👁️ {series['views']:,}",
+        input_message_content=InputTextMessageContent(message_text=name),
+        reply_markup=keyboard
+    )
+
 def create_inline_result(video, use_document=False):
     """
     تحويل بيانات الفيديو إلى InlineQueryResult.
@@ -0,0 +1,86 @@
+# handlers/markup_cache.py
+# ==============================================================================
+# كاش لوحات المفاتيح الثابتة وشبه الثابتة بعد تحويلها إلى JSON
+# ==============================================================================
+#
+# القائمة الرئيسية، لوحة الآدمن، وقوائم التصنيفات تُبنى مرة واحدة وتُحفظ كنص
+# reply_markup جاهز. المفتاح يتضمن إصدار التصنيفات (get_categories_version) فتتغير
+# القوائم تلقائياً عند إضافة أو حذف تصنيف؛ الإصدارات القديمة تخرج من الكاش بالـ LRU.
+#
+# telebot يرسل ناتج to_json() لأي JsonSerializable كما هو، فالعرض المتكرر بحث في
+# قاموس فقط: بدون قاعدة بيانات وبدون إنشاء أزرار أو تحويل JSON.
+
+import logging
+
+from telebot.types import JsonSerializable
+
+import config
+from cache_utils import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class SerializedMarkup(JsonSerializable):
+    """
+    reply_markup محوّل مسبقاً. keyboard هي صفوف اللوحة الأصلية (للقراءة فقط)
+    حتى تبقى فحوص مثل `if not markup.keyboard` تعمل كما في InlineKeyboardMarkup.
+    """
+
+    __slots__ = ('json', 'keyboard')
+
+    def __init__(self, json_text, keyboard):
+        self.json = json_text
+        self.keyboard = keyboard
+
+    def to_json(self):
+        return self.json
+
+
+class MarkupCache:
+    """
+    key -> SerializedMarkup؛ builder() يُستدعى فقط عند عدم وجود المفتاح
+    """
+
+    def __init__(self, max_entries=512, ttl=3600):
+        self._cache = TTLCache(max_entries=max_entries, default_ttl=ttl)
+
+    def get_or_build(self, key, builder):
+        markup = self._cache.get(key)
+        if markup is not None:
+            return markup
+        built = builder()
+        markup = SerializedMarkup(built.to_json(), built.keyboard)
+        self._cache.set(key, markup)
+        return markup
+
+    def clear(self):
+        self._cache.clear()
+
+    def get_stats(self):
+        return self._cache.get_stats()
+
+
+# مثيل عام
+markup_cache = MarkupCache(
+    max_entries=config.MARKUP_CACHE_MAX_SIZE,
+    ttl=config.MARKUP_CACHE_TTL
+)
+
+
+def cached_markup(key, builder, version=None, versioned=False):
+    """
+    جلب لوحة من الكاش أو بناؤها.
+
+    Args:
+        versioned: اللوحة تعتمد على التصنيفات؛ version هو إصدارها الحالي، وإذا كان
+                   None (التصنيفات غير محمّلة) تُبنى اللوحة بدون تخزين
+    """
+    if versioned:
+        if version is None:
+            return builder()
+        key = key + (version,)
+    return markup_cache.get_or_build(key, builder)
+
+
+def get_markup_cache_stats():
+    return markup_cache.get_stats()
@@ -6,10 +6,9 @@ import logging
 from .button_styles import STYLE_DANGER, STYLE_PRIMARY, STYLE_SUCCESS, inline_button
 
 from db_manager import (
-    add_bot_user, get_popular_videos, search_videos,
-    get_random_video, increment_video_view_count, get_categories_tree, add_video,
-    get_active_category_id, get_user_favorites, get_user_history, add_to_history,
-    get_user_state, clear_user_state  # إضافة دوال الحالة
+    add_bot_user, search_videos,
+    get_random_video, get_categories_tree, add_video,
+    get_active_category_id, get_user_favorites, get_user_history
 )
 from .helpers import (
     main_menu, create_paginated_keyboard,
@@ -18,9 +17,10 @@ from .helpers import (
 )
 from . import comment_handlers  # إضافة معالجات التعليقات
 from utils import extract_video_metadata
+from write_behind import record_video_view
 from state_manager import (
     set_user_waiting_for_input, States, get_user_waiting_context, 
-    clear_user_waiting_state, state_handler 
+    clear_user_waiting_state, state_handler, state_manager
 )
 
 logger = logging.getLogger(__name__)
@@ -115,7 +115,7 @@ def register(bot, channel_id, admin_ids):
         if not videos:
             bot.reply_to(message, "💭 لا توجد فيديوهات في قائمتك المفضلة حالياً.")
             return
-        keyboard = create_paginated_keyboard(videos, total_count, 0, "fav_page", "user_fav")
+        keyboard = create_paginated_keyboard(videos, total_count, 0, "fav_page", "user_fav", keyset=True)
         bot.reply_to(message, f"💖 <b>قائمة مفضلاتك</b>\n📊 العدد: <code>{total_count}</code> فيديو", reply_markup=keyboard)
         
     @bot.message_handler(func=lambda message: message.text and "سجل المشاهدة" in message.text) 
@@ -125,7 +125,7 @@ def register(bot, channel_id, admin_ids):
         if not videos:
             bot.reply_to(message, "📭 سجل المشاهدة الخاص بك فارغ حالياً.")
             return
-        keyboard = create_paginated_keyboard(videos, total_count, 0, "history_page", "user_history")
+        keyboard = create_paginated_keyboard(videos, total_count, 0, "history_page", "user_history", keyset=True)
         bot.reply_to(message, f"📺 <b>سجل مشاهداتك</b>\n📊 العدد: <code>{total_count}</code> فيديو", reply_markup=keyboard)
 
 
@@ -147,8 +147,7 @@ def register(bot, channel_id, admin_ids):
         if video:
             try:
                 video_id = video['id']
-                increment_video_view_count(video_id)
-                add_to_history(message.from_user.id, video_id) # تتبع المشاهدة
+                record_video_view(message.from_user.id, video_id) # تتبع المشاهدة
 
                 bot.copy_message(message.chat.id, video['chat_id'], video['message_id'])
                 rating_keyboard = create_video_action_keyboard(video_id, message.from_user.id)
@@ -186,6 +185,8 @@ def register(bot, channel_id, admin_ids):
         keyboard = InlineKeyboardMarkup(row_width=1)
         keyboard.add(inline_button("📈 الأكثر مشاهدة", STYLE_DANGER, callback_data="popular::most_viewed"))
         keyboard.add(inline_button("⭐ الأعلى تقييماً", STYLE_SUCCESS, callback_data="popular::highest_rated"))
+        keyboard.add(inline_button("🔥 الأكثر مشاهدة خلال 24 ساعة", STYLE_PRIMARY, callback_data="popular::trending_24h"))
+        keyboard.add(inline_button("📅 الأكثر مشاهدة خلال 7 أيام", STYLE_PRIMARY, callback_data="popular::trending_7d"))
         bot.reply_to(message, "اختر نوع الفيديوهات الشائعة:", reply_markup=keyboard)
 
     def perform_group_search(message, query):
@@ -234,7 +235,6 @@ def register(bot, channel_id, admin_ids):
     @bot.message_handler(commands=["cancel"])
     def handle_cancel_command(message):
         """إلغاء العملية الحالية"""
-        clear_user_state(message.from_user.id)
         clear_user_waiting_state(message.from_user.id)
         bot.reply_to(message, "✅ تم إلغاء العملية")
     
@@ -242,8 +242,8 @@ def register(bot, channel_id, admin_ids):
     @bot.message_handler(func=lambda message: message.text and not message.text.startswith("/") and message.chat.type == "private", content_types=["text"])
     def handle_comment_text_states(message):
         """معالج النصوص للتعليقات والردود"""
-        # التحقق من حالة المستخدم
-        state = get_user_state(message.from_user.id)
+        # التحقق من حالة المستخدم (من كاش state_manager)
+        state = state_manager.get_state(message.from_user.id)
         
         if state:
             state_name = state.get('state')
@@ -10,7 +10,8 @@ import time
 import logging
 import json
 from datetime import datetime, timedelta
-from db_manager import execute_query, get_db_connection
+from db_manager import execute_query, get_db_connection, reconcile_rating_aggregates
+from count_service import count_service
 
 # إعداد المسجل
 logger = logging.getLogger(__name__)
@@ -27,6 +28,7 @@ class HistoryCleanupManager:
             'last_cleanup': None,
             'total_cleaned': 0,
             'cleanup_count': 0,
+            'rating_drift_fixed': 0,
             'errors': 0
         }
         
@@ -244,6 +246,12 @@ class HistoryCleanupManager:
         deleted_inactive = self.cleanup_inactive_users_history(30)  # 30 يوم للمستخدمين غير النشطين
         
         total_deleted = deleted_old + deleted_excess + deleted_inactive
+        if total_deleted:
+            count_service.invalidate('history')
+        
+        # تصحيح أي انحراف في rating_sum/rating_count المخزنة على video_archive
+        drift_fixed = reconcile_rating_aggregates() or 0
+        self.stats['rating_drift_fixed'] += drift_fixed
         
         # تحديث الإحصائيات
         self.stats['last_cleanup'] = start_time.isoformat()
@@ -264,6 +272,7 @@ class HistoryCleanupManager:
                 'inactive_users': deleted_inactive,
                 'total': total_deleted
             },
+            'rating_drift_fixed': drift_fixed,
             'before_cleanup': pre_stats['total_records'],
             'after_cleanup': post_stats['total_records'],
             'space_saved_percent': ((pre_stats['total_records'] - post_stats['total_records']) / pre_stats['total_records'] * 100) if pre_stats['total_records'] > 0 else 0
@@ -0,0 +1,197 @@
+# ==============================================================================
+# ملف: leaderboards.py
+# الوصف: قوائم الفيديوهات الشائعة محسوبة مسبقاً ومحفوظة في الذاكرة
+# ==============================================================================
+#
+# القوائم:
+#     most_viewed     الأكثر مشاهدة (view_count)
+#     highest_rated   الأعلى تقييماً (rating_sum / rating_count)
+#     trending_24h    الأكثر مشاهدة خلال 24 ساعة (من user_history)
+#     trending_7d     الأكثر مشاهدة خلال 7 أيام
+#
+# - كل قائمة تُحمّل حتى LEADERBOARD_SIZE فيديو، والتنقل بين الصفحات تقسيم في الذاكرة
+# - التحديث الكامل في الخلفية كل LEADERBOARD_REFRESH_SECONDS
+# - كتابات write_behind تُضاف مباشرة لعدادات الفيديوهات الموجودة في القوائم، وتغييرات
+#   الأرشيف (تقييم، نقل، حذف) تطلب تحديثاً مبكراً لا يتكرر أكثر من مرة كل
+#   LEADERBOARD_MIN_REFRESH_SECONDS
+
+import logging
+import os
+import threading
+import time
+
+import config
+import db_manager as db
+from write_behind import write_behind
+
+logger = logging.getLogger(__name__)
+
+BOARDS = ('most_viewed', 'highest_rated', 'trending_24h', 'trending_7d')
+
+
+class LeaderboardCache:
+    """
+    القوائم الشائعة في ذاكرة الـ process الحالي
+    """
+
+    def __init__(self, loader, size=100, refresh_interval=300, min_refresh_interval=30):
+        self._loader = loader
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._refresh_requested = threading.Event()
+        self._boards = {}
+        self._pid = None
+        self._thread = None
+        self._listeners_registered = False
+        self._last_refresh = 0.0
+        self.stats = {
+            'refreshes': 0,
+            'refresh_failures': 0,
+            'last_refresh_ms': 0.0,
+            'early_refreshes': 0,
+            'view_updates': 0,
+            'hits': 0,
+            'misses': 0
+        }
+
+    # --- التحميل ---
+
+    def ensure_started(self):
+        """بدء التحديث في الخلفية (مرة لكل process، آمن بعد fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if not self._listeners_registered:
+                db.register_archive_listener(self._on_archive_change)
+                write_behind.add_flush_listener(self._on_views_flushed)
+                self._listeners_registered = True
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="leaderboards", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            if self._refresh_requested.wait(self.refresh_interval):
+                # تجميع الطلبات المتتالية في تحديث واحد
+                delay = self._last_refresh + self.min_refresh_interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.stats['early_refreshes'] += 1
+            self._refresh_requested.clear()
+
+    def refresh(self):
+        """
+        إعادة تحميل كل القوائم؛ القائمة التي يفشل تحميلها تحتفظ بنسختها السابقة
+        """
+        started = time.monotonic()
+        boards = {}
+        failed = False
+        for board in BOARDS:
+            try:
+                boards[board] = [dict(row) for row in self._loader(board, self.size)]
+            except Exception as e:
+                failed = True
+                logger.error(f"Leaderboard {board} refresh failed: {e}", exc_info=True)
+
+        with self._lock:
+            self._boards.update(boards)
+            self._last_refresh = time.monotonic()
+            self.stats['refreshes'] += 1
+            if failed:
+                self.stats['refresh_failures'] += 1
+            self.stats['last_refresh_ms'] = round((time.monotonic() - started) * 1000, 3)
+        return not failed
+
+    def _on_archive_change(self, op, video_ids):
+        if op == 'delete' and video_ids:
+            removed = set(video_ids)
+            with self._lock:
+                for board, rows in self._boards.items():
+                    self._boards[board] = [row for row in rows if row['id'] not in removed]
+            return
+        self._refresh_requested.set()
+
+    def _on_views_flushed(self, views):
+        """إضافة زيادات المشاهدة المكتوبة للتو حتى لا تظهر أعداد قديمة حتى التحديث التالي"""
+        with self._lock:
+            changed = False
+            for rows in self._boards.values():
+                for row in rows:
+                    increment = views.get(row['id'])
+                    if increment:
+                        row['view_count'] += increment
+                        changed = True
+            rows = self._boards.get('most_viewed')
+            if changed and rows:
+                rows.sort(key=lambda row: (row['view_count'], row['id']), reverse=True)
+                self.stats['view_updates'] += 1
+            # قائمة غير ممتلئة: فيديو جديد قد يستحق الدخول فوراً، وإلا ينتظر التحديث الدوري
+            if rows is not None and len(rows) < self.size and any(
+                video_id not in {row['id'] for row in rows} for video_id in views
+            ):
+                self._refresh_requested.set()
+
+    # --- القراءة ---
+
+    def get_page(self, board, page=0, per_page=10):
+        """
+        Returns:
+            (فيديوهات الصفحة، العدد الإجمالي في القائمة)
+        """
+        if board not in BOARDS:
+            return [], 0
+        self.ensure_started()
+        with self._lock:
+            rows = self._boards.get(board)
+            if rows is not None:
+                self.stats['hits'] += 1
+                start = page * per_page
+                return [dict(row) for row in rows[start:start + per_page]], len(rows)
+
+        # أول طلب قبل اكتمال التحميل في الخلفية
+        with self._lock:
+            self.stats['misses'] += 1
+        try:
+            rows = [dict(row) for row in self._loader(board, self.size)]
+        except Exception as e:
+            logger.error(f"Leaderboard {board} load failed: {e}", exc_info=True)
+            return [], 0
+        with self._lock:
+            self._boards.setdefault(board, rows)
+        start = page * per_page
+        return [dict(row) for row in rows[start:start + per_page]], len(rows)
+
+    def get_top(self, board):
+        videos, _ = self.get_page(board, 0, 1)
+        return videos[0] if videos else None
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'boards': {board: len(rows) for board, rows in self._boards.items()},
+                **self.stats
+            }
+
+
+# مثيل عام
+leaderboards = LeaderboardCache(
+    db.load_leaderboard,
+    size=config.LEADERBOARD_SIZE,
+    refresh_interval=config.LEADERBOARD_REFRESH_SECONDS,
+    min_refresh_interval=config.LEADERBOARD_MIN_REFRESH_SECONDS
+)
+
+
+def get_leaderboard_page(board, page=0):
+    return leaderboards.get_page(board, page, db.VIDEOS_PER_PAGE)
+
+
+def get_leaderboard_stats():
+    return leaderboards.get_stats()
@@ -0,0 +1,121 @@
+# ==============================================================================
+# ملف: pagination.py
+# الوصف: ترقيم الصفحات بالمفتاح (Keyset / Seek) بدلاً من OFFSET
+# ==============================================================================
+#
+# المؤشر (cursor) يُحمل في callback_data بجانب رقم الصفحة:
+#     cat::{id}::{page}::{cursor}
+# الصيغة: حرف الاتجاه ثم قيم المفتاح بنظام base36 مفصولة بنقطة
+#     a...  الصفحة التالية: الصفوف بعد هذا المفتاح في ترتيب العرض
+#     b...  الصفحة السابقة: الصفوف قبل هذا المفتاح في ترتيب العرض
+# الأزرار القديمة (بدون مؤشر) تستمر بالعمل عبر OFFSET.
+
+from datetime import datetime, timedelta
+
+AFTER = 'a'
+BEFORE = 'b'
+
+_EPOCH = datetime(1970, 1, 1)
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def _to_base36(number):
+    if number == 0:
+        return '0'
+    sign = '-' if number < 0 else ''
+    number = abs(number)
+    out = []
+    while number:
+        number, rem = divmod(number, 36)
+        out.append(_DIGITS[rem])
+    return sign + ''.join(reversed(out))
+
+
+def _encode_value(value):
+    # التواريخ تُخزن كعدد الميكروثواني منذ 1970 (دقيق بدون تقريب)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.replace(tzinfo=None) - value.utcoffset()
+        return 't' + _to_base36((value - _EPOCH) // timedelta(microseconds=1))
+    return _to_base36(int(value))
+
+
+def _decode_value(token):
+    if token.startswith('t'):
+        return _EPOCH + timedelta(microseconds=int(token[1:], 36))
+    return int(token, 36)
+
+
+def encode_cursor(direction, values):
+    """
+    ترميز مؤشر الصفحة.
+
+    Args:
+        direction: AFTER أو BEFORE
+        values: قيم المفتاح (int أو datetime) بنفس ترتيب أعمدة الترتيب
+    """
+    return direction + '.'.join(_encode_value(v) for v in values)
+
+
+def decode_cursor(token):
+    """
+    فك ترميز المؤشر.
+
+    Returns:
+        (direction, values) أو None إذا كان المؤشر غير صالح
+    """
+    if not token or token[0] not in (AFTER, BEFORE):
+        return None
+    try:
+        return token[0], [_decode_value(part) for part in token[1:].split('.')]
+    except (ValueError, OverflowError):
+        return None
+
+
+def row_key(row):
+    """
+    قيم المفتاح لصف: (sort_ts, sort_id) للقوائم المرتبة بالتاريخ، أو id للقوائم المرتبة بالمعرف
+    """
+    if 'sort_ts' in row.keys():
+        return [row['sort_ts'], row['sort_id']]
+    return [row['id']]
+
+
+def page_cursors(rows):
+    """
+    مؤشرا الصفحة السابقة والتالية لصفوف الصفحة الحالية
+
+    Returns:
+        (prev_cursor, next_cursor)
+    """
+    if not rows:
+        return None, None
+    return encode_cursor(BEFORE, row_key(rows[0])), encode_cursor(AFTER, row_key(rows[-1]))
+
+
+def keyset_clause(columns, cursor):
+    """
+    بناء شرط WHERE والترتيب لقائمة مرتبة تنازلياً على الأعمدة المحددة.
+
+    Args:
+        columns: أعمدة الترتيب، مثل ['f.date_added', 'f.id']
+        cursor: المؤشر المُرمّز (أو None للصفحة الأولى)
+
+    Returns:
+        (condition, params, order_by, reverse):
+        condition=None عند عدم وجود مؤشر صالح؛ reverse=True يعني أن الصفوف
+        جُلبت تصاعدياً ويجب عكسها قبل العرض
+    """
+    desc_order = ", ".join(f"{col} DESC" for col in columns)
+    decoded = decode_cursor(cursor)
+    if not decoded or len(decoded[1]) != len(columns):
+        return None, [], desc_order, False
+
+    direction, values = decoded
+    column_list = ", ".join(columns)
+    placeholders = ", ".join(["%s"] * len(values))
+    if direction == AFTER:
+        return f"({column_list}) < ({placeholders})", values, desc_order, False
+
+    asc_order = ", ".join(f"{col} ASC" for col in columns)
+    return f"({column_list}) > ({placeholders})", values, asc_order, True
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# ==============================================================================
+# ملف: scripts/bench_prepared_statements.py
+# الوصف: قياس زمن التخطيط (Planning Time) الموفَّر باستخدام الـ prepared statements
+# الاستخدام: python -m scripts.bench_prepared_statements [عدد التكرارات]
+# ==============================================================================
+
+import json
+import logging
+import statistics
+import sys
+
+from psycopg2.extras import DictCursor
+
+from db_manager import PREPARED_STATEMENTS, _to_positional_params, category_page_query
+from db_pool import get_db_connection
+
+logging.basicConfig(level=logging.WARNING)
+
+# الاستعلامات التي ينفذها كل نوع callback (الأكثر تكراراً) على قاعدة البيانات؛
+# get_user_state يُخدم من كاش state_manager والتصنيف من لقطة التصنيفات في الذاكرة
+CALLBACK_PROFILES = {
+    'video': ['is_video_favorite', 'get_user_video_rating', 'get_video_rating_stats'],
+    'cat': ['get_category_page'],
+}
+
+
+def _sample_params(cursor):
+    """
+    اختيار قيم حقيقية من قاعدة البيانات حتى تكون الخطط واقعية
+
+    Returns:
+        (معاملات كل prepared statement، {الاسم: (الاستعلام، المعاملات)} للاستعلامات غير المحضّرة)
+    """
+    cursor.execute("SELECT id, category_id FROM video_archive WHERE category_id IS NOT NULL ORDER BY id DESC LIMIT 1")
+    video = cursor.fetchone() or {'id': 1, 'category_id': 1}
+    cursor.execute("SELECT user_id FROM bot_users LIMIT 1")
+    user = cursor.fetchone() or {'user_id': 1}
+    video_id, category_id, user_id = video['id'], video['category_id'], user['user_id']
+    return {
+        'get_video_by_id': (video_id,),
+        'get_category_by_id': (category_id,),
+        'get_user_video_rating': (video_id, user_id),
+        'is_video_favorite': (user_id, video_id),
+        'get_video_rating_stats': (video_id,),
+        'get_category_videos_page': (category_id, 10, 0),
+        'count_category_videos': (category_id,),
+        'get_user_state': (user_id,),
+    }, {
+        # استعلامات غير محضّرة (نصها يتغير مع المؤشر): يُقاس زمن تخطيطها فقط
+        'get_category_page': category_page_query(category_id),
+    }
+
+
+def _planning_time(cursor, query, params):
+    cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}", params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0].get('Planning Time', 0.0)
+
+
+def benchmark(iterations=200):
+    results = {}
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as c:
+            params_by_name, adhoc_queries = _sample_params(c)
+
+            for name, query in PREPARED_STATEMENTS.items():
+                params = params_by_name[name]
+
+                adhoc = [_planning_time(c, query, params) for _ in range(iterations)]
+
+                statement = f"bench_{name}"
+                c.execute(f"PREPARE {statement} AS {_to_positional_params(query)}")
+                placeholders = ', '.join(['%s'] * len(params))
+                # بعد 5 تنفيذات يعتمد Postgres الخطة العامة (generic plan) إن كانت أرخص
+                prepared = [
+                    _planning_time(c, f"EXECUTE {statement} ({placeholders})", params)
+                    for _ in range(iterations)
+                ]
+                c.execute(f"DEALLOCATE {statement}")
+
+                results[name] = {
+                    'adhoc_ms': statistics.median(adhoc),
+                    'prepared_ms': statistics.median(prepared[5:] or prepared),
+                }
+
+            for name, (query, params) in adhoc_queries.items():
+                adhoc = statistics.median(_planning_time(c, query, params) for _ in range(iterations))
+                results[name] = {'adhoc_ms': adhoc, 'prepared_ms': None}
+        conn.rollback()
+    return results
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    results = benchmark(iterations)
+
+    print(f"Planning time per statement (median of {iterations} runs, ms)")
+    print(f"{'statement':<28}{'ad-hoc':>10}{'prepared':>10}{'saved':>10}")
+    for name, r in results.items():
+        if r['prepared_ms'] is None:
+            print(f"{name:<28}{r['adhoc_ms']:>10.3f}{'-':>10}{'-':>10}")
+            continue
+        saved = r['adhoc_ms'] - r['prepared_ms']
+        print(f"{name:<28}{r['adhoc_ms']:>10.3f}{r['prepared_ms']:>10.3f}{saved:>10.3f}")
+
+    print("\nPlanning time per callback (ms)")
+    print(f"{'callback':<28}{'planning':>10}{'saved':>10}")
+    for callback, names in CALLBACK_PROFILES.items():
+        planning = saved = 0.0
+        for n in names:
+            r = results[n]
+            if r['prepared_ms'] is None:
+                planning += r['adhoc_ms']
+            else:
+                planning += r['prepared_ms']
+                saved += r['adhoc_ms'] - r['prepared_ms']
+        print(f"{callback:<28}{planning:>10.3f}{saved:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
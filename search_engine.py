@@ -0,0 +1,226 @@
+# ==============================================================================
+# ملف: search_engine.py
+# الوصف: البحث النصي الكامل (Postgres Full-Text Search) مع مفتاح اختيار الاستراتيجية
+# ==============================================================================
+#
+# الاستراتيجيات:
+#     ilike  البحث الحالي بـ ILIKE '%q%' (والترتيب الذكي في الـ inline)
+#     fts    عمود search_vector (tsvector) + فهرس GIN + ترتيب ts_rank
+#     ab     تقسيم الاستعلامات بين الاثنين لمقارنة زمن الاستجابة وعدد النتائج
+#
+# صيغة البحث:
+#     كلمات عادية         كل الكلمات مطلوبة، والكلمة الأخيرة تطابق البادئة (أثناء الكتابة)
+#     "عبارة بين علامتين"  الكلمات متتالية بنفس الترتيب
+#     كلمة*               مطابقة البادئة لأي كلمة
+#
+# التطبيع (normalize_arabic) يُطبق على النص المخزن في add_video وعلى نص البحث،
+# فتتطابق أ/إ/آ/ا و ة/ه و ى/ي مع أو بدون تشكيل أو تطويل.
+
+import logging
+import re
+import threading
+import time
+import zlib
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# إعداد 'simple' لا يحذف كلمات ولا يجذّع، وهو الأنسب للنصوص المختلطة عربي/إنجليزي
+TS_CONFIG = 'simple'
+
+STRATEGIES = ('ilike', 'fts')
+
+_TERM_RE = re.compile(r'"([^"]*)"?|(\S+)')
+_WORD_RE = re.compile(r'\w+')
+
+# التشكيل (الحركات، التنوين، الشدة، السكون، الألف الخنجرية) وعلامات المصحف
+_ARABIC_DIACRITICS_RE = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+_ARABIC_TRANSLATION = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي',
+    'ـ': None,  # التطويل
+    **{chr(0x0660 + d): str(d) for d in range(10)},  # ٠-٩
+    **{chr(0x06F0 + d): str(d) for d in range(10)},  # ۰-۹
+})
+_SPACES_RE = re.compile(r'\s+')
+
+
+def normalize_arabic(text):
+    """
+    تطبيع النص للفهرسة والبحث: حذف التشكيل والتطويل، توحيد أشكال الألف والتاء
+    المربوطة والألف المقصورة، تحويل الأرقام العربية، وتوحيد المسافات والأحرف الصغيرة.
+
+    Returns:
+        str (فارغ إذا كان النص None)
+    """
+    if not text:
+        return ''
+    text = _ARABIC_DIACRITICS_RE.sub('', text)
+    text = text.translate(_ARABIC_TRANSLATION)
+    return _SPACES_RE.sub(' ', text).strip().lower()
+
+
+_SEPARATORS_RE = re.compile(r'[._-]+')
+
+
+def query_may_match(query, texts):
+    """
+    هل يمكن أن يطابق البحث (المطبّع) أحد النصوص المطبّعة؟ تقريب واسع يكفي لـ ILIKE
+    و FTS معاً: كل كلمات البحث موجودة في النص، أو في النص بعد استبدال الفواصل
+    بمسافات كما يُفهرس اسم الملف (انظر SEARCH_VECTOR_DDL).
+    تستخدمه الكاشات لتحديد النتائج التي قد يغيرها فيديو جديد أو معدّل.
+    """
+    words = query.split()
+    for text in texts:
+        if not text:
+            continue
+        for variant in (text, _SEPARATORS_RE.sub(' ', text)):
+            if all(word in variant for word in words):
+                return True
+    return False
+
+
+def _phrase(words, prefix=False):
+    lexemes = [f"'{word}'" for word in words]
+    if prefix:
+        lexemes[-1] += ':*'
+    return ' <-> '.join(lexemes)
+
+
+def parse_search_query(text):
+    """
+    تحويل نص البحث إلى tsquery آمن لـ to_tsquery
+
+    Returns:
+        str مثل "'abc' & 'x' <-> 'y' & 'de':*" أو None إذا لم يحتوِ النص على كلمات
+    """
+    text = normalize_arabic(text)
+    if not text:
+        return None
+
+    clauses = []
+    last_bare = None
+    for match in _TERM_RE.finditer(text):
+        quoted, bare = match.groups()
+        if quoted is not None:
+            words = _WORD_RE.findall(quoted)
+            if words:
+                clauses.append(_phrase(words))
+                last_bare = None
+            continue
+
+        words = _WORD_RE.findall(bare)
+        if words:
+            clauses.append(_phrase(words, prefix=bare.endswith('*')))
+            last_bare = (len(clauses) - 1, words)
+
+    if not clauses:
+        return None
+
+    # آخر كلمة غير مقتبسة تُطابق كبادئة لأن المستخدم غالباً لم يكمل كتابتها
+    if last_bare is not None:
+        index, words = last_bare
+        clauses[index] = _phrase(words, prefix=True)
+
+    return ' & '.join(clauses)
+
+
+class SearchStrategyManager:
+    """
+    اختيار استراتيجية البحث وقياس أدائها لكل مسار (search / inline)
+    """
+
+    def __init__(self, mode='ilike', fts_percent=50):
+        self.mode = mode
+        self.fts_percent = fts_percent
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def set_mode(self, mode):
+        if mode not in STRATEGIES + ('ab',):
+            raise ValueError(f"unknown search strategy: {mode}")
+        self.mode = mode
+        logger.info(f"Search strategy set to {mode}")
+
+    def choose(self, query):
+        """
+        الاستراتيجية لهذا الاستعلام؛ في وضع ab يُقسم حسب hash النص حتى يحصل
+        نفس البحث دائماً على نفس الاستراتيجية (ونفس الترتيب بين الصفحات)
+        """
+        if self.mode == 'ab':
+            bucket = zlib.crc32(normalize_arabic(query).encode('utf-8')) % 100
+            return 'fts' if bucket < self.fts_percent else 'ilike'
+        return self.mode if self.mode in STRATEGIES else 'ilike'
+
+    def record(self, path, strategy, started, result_count):
+        """
+        تسجيل استعلام منفذ
+
+        Args:
+            path: 'search' أو 'inline'
+            started: قيمة time.monotonic() قبل التنفيذ
+        """
+        elapsed_ms = (time.monotonic() - started) * 1000
+        key = f"{path}:{strategy}"
+        with self._lock:
+            entry = self.stats.setdefault(key, {
+                'queries': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'total_results': 0,
+                'empty_results': 0
+            })
+            entry['queries'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['total_results'] += result_count
+            if not result_count:
+                entry['empty_results'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            per_strategy = {
+                key: {
+                    'queries': s['queries'],
+                    'avg_ms': round(s['total_ms'] / s['queries'], 3),
+                    'max_ms': round(s['max_ms'], 3),
+                    'avg_results': round(s['total_results'] / s['queries'], 2),
+                    'empty_percent': round(s['empty_results'] / s['queries'] * 100, 2)
+                }
+                for key, s in self.stats.items()
+            }
+        return {
+            'mode': self.mode,
+            'fts_percent': self.fts_percent,
+            'strategies': per_strategy
+        }
+
+
+# مثيل عام
+search_strategy = SearchStrategyManager(config.SEARCH_STRATEGY, config.SEARCH_AB_FTS_PERCENT)
+
+
+def start_search_backfill():
+    """
+    ملء النص المطبّع و search_vector للفيديوهات القديمة على دفعات في الخلفية
+    """
+    def backfill_worker():
+        from db_manager import backfill_normalized_text, backfill_search_vectors
+        try:
+            # تحديث النص المطبّع يعيد حساب search_vector عبر الـ trigger أيضاً
+            normalized = backfill_normalized_text(config.SEARCH_BACKFILL_BATCH_SIZE)
+            logger.info(f"Normalized text backfill finished ({normalized} videos)")
+            total = backfill_search_vectors(config.SEARCH_BACKFILL_BATCH_SIZE)
+            logger.info(f"Search vector backfill finished ({total} videos)")
+        except Exception as e:
+            logger.error(f"Search vector backfill failed: {e}", exc_info=True)
+
+    thread = threading.Thread(target=backfill_worker, name="search-backfill", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_search_stats():
+    return search_strategy.get_stats()
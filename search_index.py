@@ -0,0 +1,367 @@
+# ==============================================================================
+# ملف: search_index.py
+# الوصف: فهرس بحث معكوس (Inverted Index) في الذاكرة لاستعلامات الـ inline
+# ==============================================================================
+#
+# يُفعّل بـ INLINE_SEARCH_BACKEND=memory ويبدأ بناؤه عند التشغيل (start_inline_index في
+# init_bot)؛ حتى يكتمل البناء (أو عند الفشل) يُستخدم search_videos_for_inline في قاعدة البيانات.
+#
+# - الفهرس يُبنى من رقم الفيديو والنص المطبّع (normalize_arabic) للعنوان واسم الملف واسم التصنيف
+# - trigram -> أرقام الفيديوهات: للاستعلامات من 3 أحرف فأكثر (مطابقة "يحتوي" مثل ILIKE)
+# - كلمة -> أرقام الفيديوهات: للاستعلامات من حرف أو حرفين، الكلمات التي تحتوي الاستعلام
+#   (مثل ILIKE؛ الفرق الوحيد: لا يُطابق حرفان يفصل بينهما رمز غير حرفي)
+# - رقم الفيديو كاملاً يطابقه ويظهر أولاً (إضافة على بحث SQL الذي لا يبحث في الأرقام)
+# - القوائم array('I') مرتبة تصاعدياً: 4 بايت لكل فيديو بدلاً من كائن Python كامل
+# - الترتيب مطابق للبحث الذكي: تطابق تام، يبدأ بـ، كلمة كاملة، يحتوي؛ ثم المشاهدات والتقييم
+# - التحديث تدريجي عبر register_archive_listener (add_video، النقل، الحذف)، مع إعادة
+#   بناء دورية لتحديث أعداد المشاهدات والتقييمات
+
+import logging
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import config
+import db_manager as db
+from search_engine import normalize_arabic, search_strategy
+
+logger = logging.getLogger(__name__)
+
+_FIELDS = (
+    'id', 'file_id', 'caption', 'file_name', 'view_count',
+    'thumbnail_file_id', 'chat_id', 'message_id', 'content_type',
+    'category_name', 'avg_rating', 'rating_count'
+)
+_VIEWS = _FIELDS.index('view_count')
+_RATING = _FIELDS.index('avg_rating')
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _contains(postings, doc_id):
+    pos = bisect_left(postings, doc_id)
+    return pos < len(postings) and postings[pos] == doc_id
+
+
+def _add_posting(index, key, doc_id):
+    postings = index.get(key)
+    if postings is None:
+        index[key] = array('I', (doc_id,))
+    elif not postings or postings[-1] < doc_id:
+        postings.append(doc_id)
+    else:
+        pos = bisect_left(postings, doc_id)
+        if pos == len(postings) or postings[pos] != doc_id:
+            postings.insert(pos, doc_id)
+
+
+def _remove_posting(index, key, doc_id):
+    postings = index.get(key)
+    if postings is None:
+        return
+    pos = bisect_left(postings, doc_id)
+    if pos < len(postings) and postings[pos] == doc_id:
+        del postings[pos]
+        if not postings:
+            del index[key]
+
+
+def _make_doc(row):
+    """(قيم الحقول، العنوان المطبّع، اسم الملف المطبّع، اسم التصنيف المطبّع)"""
+    values = tuple(row[field] for field in _FIELDS)
+    caption = row['normalized_caption']
+    file_name = row['normalized_file_name']
+    category = row['normalized_category_name']
+    return (
+        values,
+        caption if caption is not None else normalize_arabic(row['caption']),
+        file_name if file_name is not None else normalize_arabic(row['file_name']),
+        category if category is not None else normalize_arabic(row['category_name'])
+    )
+
+
+def _doc_keys(doc):
+    tokens, grams = {str(doc[0][0])}, set()
+    for text in doc[1:]:
+        tokens.update(_WORD_RE.findall(text))
+        grams.update(_trigrams(text))
+    return tokens, grams
+
+
+def _rank(query, caption, file_name):
+    """نفس مستويات البحث الذكي في search_videos_for_inline"""
+    if caption == query or file_name == query:
+        return 0
+    if caption.startswith(query) or file_name.startswith(query):
+        return 1
+    word = f" {query} "
+    if word in caption or word in file_name:
+        return 2
+    return 3
+
+
+def make_docs(rows):
+    """صفوف load_inline_index_rows -> docs قابلة للبحث بـ rank_docs"""
+    return [_make_doc(row) for row in rows]
+
+
+def rank_docs(query, docs, offset=0, limit=50):
+    """
+    الـ docs التي تحتوي البحث (المطبّع) مرتبة كالبحث الذكي، كقائمة dicts
+    بنفس حقول search_videos_for_inline
+    """
+    scored = []
+    for doc in docs:
+        values, caption, file_name, category = doc
+        if query == str(values[0]):
+            rank = -1  # رقم الفيديو
+        elif query in caption or query in file_name or query in category:
+            rank = _rank(query, caption, file_name)
+        else:
+            continue
+        scored.append((rank, -values[_VIEWS], -values[_RATING], values[0], doc))
+
+    scored.sort(key=lambda item: item[:4])
+    return [dict(zip(_FIELDS, item[4][0])) for item in scored[offset:offset + limit]]
+
+
+class InlineSearchIndex:
+    """
+    فهرس بحث في ذاكرة الـ process الحالي
+    """
+
+    def __init__(self, loader, refresh_interval=900):
+        self._loader = loader
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._rebuild_requested = threading.Event()
+        self._docs = {}
+        self._tokens = {}
+        self._grams = {}
+        self._vocab = None
+        self._popular = None
+        self._pending = None
+        self._pid = None
+        self._thread = None
+        self._listener_registered = False
+        self.ready = False
+        self.stats = {
+            'builds': 0,
+            'build_failures': 0,
+            'last_build': None,
+            'last_build_ms': 0.0,
+            'incremental_updates': 0,
+            'queries': 0
+        }
+
+    # --- البناء والتحديث ---
+
+    def ensure_started(self):
+        """بدء البناء في الخلفية (مرة لكل process، آمن بعد fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if not self._listener_registered:
+                db.register_archive_listener(self._on_archive_change)
+                self._listener_registered = True
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="inline-index", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.rebuild()
+            self._rebuild_requested.wait(self.refresh_interval)
+            self._rebuild_requested.clear()
+
+    def rebuild(self):
+        """
+        بناء الفهرس كاملاً خارج القفل ثم استبداله دفعة واحدة.
+        التغييرات التي تصل أثناء البناء تُعاد بعد الاستبدال.
+        """
+        started = time.monotonic()
+        with self._lock:
+            self._pending = set()
+        try:
+            rows = self._loader()
+            docs, tokens, grams = {}, {}, {}
+            for row in rows:
+                doc = _make_doc(row)
+                doc_id = doc[0][0]
+                docs[doc_id] = doc
+                doc_tokens, doc_grams = _doc_keys(doc)
+                for token in doc_tokens:
+                    _add_posting(tokens, token, doc_id)
+                for gram in doc_grams:
+                    _add_posting(grams, gram, doc_id)
+        except Exception as e:
+            logger.error(f"Inline search index build failed: {e}", exc_info=True)
+            with self._lock:
+                self._pending = None
+                self.stats['build_failures'] += 1
+            return False
+
+        with self._lock:
+            self._docs, self._tokens, self._grams = docs, tokens, grams
+            self._vocab = None
+            self._popular = None
+            pending, self._pending = self._pending, None
+            self.ready = True
+            self.stats['builds'] += 1
+            self.stats['last_build'] = time.time()
+            self.stats['last_build_ms'] = round((time.monotonic() - started) * 1000, 3)
+
+        if pending:
+            self._refresh(pending)
+        logger.info(f"Inline search index built: {len(docs)} videos in {self.stats['last_build_ms']} ms")
+        return True
+
+    def _on_archive_change(self, op, video_ids):
+        if op == 'reload' or video_ids is None:
+            self._rebuild_requested.set()
+            return
+        self._refresh(video_ids)
+
+    def _refresh(self, video_ids):
+        """إعادة تحميل فيديوهات محددة؛ ما لم يعد موجوداً (أو لا يُرسل) يُحذف من الفهرس"""
+        video_ids = set(video_ids)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.update(video_ids)
+        try:
+            rows = self._loader(video_ids)
+        except Exception as e:
+            logger.error(f"Inline search index update failed, scheduling rebuild: {e}")
+            self._rebuild_requested.set()
+            return
+
+        with self._lock:
+            for doc_id in video_ids:
+                self._remove(doc_id)
+            for row in rows:
+                self._add(_make_doc(row))
+            self._popular = None
+            self.stats['incremental_updates'] += 1
+
+    def _add(self, doc):
+        doc_id = doc[0][0]
+        self._docs[doc_id] = doc
+        tokens, grams = _doc_keys(doc)
+        for token in tokens:
+            if token not in self._tokens:
+                self._vocab = None
+            _add_posting(self._tokens, token, doc_id)
+        for gram in grams:
+            _add_posting(self._grams, gram, doc_id)
+
+    def _remove(self, doc_id):
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        tokens, grams = _doc_keys(doc)
+        for token in tokens:
+            _remove_posting(self._tokens, token, doc_id)
+        self._vocab = None
+        for gram in grams:
+            _remove_posting(self._grams, gram, doc_id)
+
+    # --- البحث ---
+
+    def _candidates(self, query):
+        # المطابقة التامة لكلمة (ومنها رقم الفيديو، الذي لا تُفهرس trigrams له)
+        candidates = set(self._tokens.get(query, ()))
+        if len(query) >= 3:
+            postings = [self._grams.get(gram) for gram in _trigrams(query)]
+            if any(p is None for p in postings):
+                return candidates
+            postings.sort(key=len)
+            first, rest = postings[0], postings[1:]
+            candidates.update(doc_id for doc_id in first if all(_contains(p, doc_id) for p in rest))
+            return candidates
+
+        # استعلام من حرف أو حرفين: كل الكلمات التي تحتويه
+        if self._vocab is None:
+            self._vocab = list(self._tokens)
+        for token in self._vocab:
+            if query in token:
+                candidates.update(self._tokens[token])
+        return candidates
+
+    def _popular_ids(self):
+        if self._popular is None:
+            self._popular = sorted(
+                self._docs,
+                key=lambda doc_id: (-self._docs[doc_id][0][_VIEWS], -self._docs[doc_id][0][_RATING])
+            )
+        return self._popular
+
+    def search(self, query, offset=0, limit=50):
+        """
+        Returns:
+            قائمة dicts بنفس حقول search_videos_for_inline
+        """
+        query = normalize_arabic(query)
+        with self._lock:
+            self.stats['queries'] += 1
+            if not query:
+                ids = self._popular_ids()[offset:offset + limit]
+                return [dict(zip(_FIELDS, self._docs[doc_id][0])) for doc_id in ids]
+
+            docs = (self._docs.get(doc_id) for doc_id in self._candidates(query))
+            return rank_docs(query, [doc for doc in docs if doc is not None], offset, limit)
+
+    def get_stats(self):
+        with self._lock:
+            postings_bytes = sum(
+                p.itemsize * len(p)
+                for index in (self._tokens, self._grams)
+                for p in index.values()
+            )
+            return {
+                'ready': self.ready,
+                'videos': len(self._docs),
+                'tokens': len(self._tokens),
+                'trigrams': len(self._grams),
+                'postings_bytes': postings_bytes,
+                **self.stats
+            }
+
+
+# مثيل عام
+inline_index = InlineSearchIndex(db.load_inline_index_rows, config.INLINE_INDEX_REFRESH_SECONDS)
+
+
+def start_inline_index():
+    """بدء بناء الفهرس عند التشغيل بدل أول استعلام inline (مع INLINE_SEARCH_BACKEND=memory)"""
+    if config.INLINE_SEARCH_BACKEND == 'memory':
+        inline_index.ensure_started()
+
+
+def search_inline(query, offset=0, limit=50):
+    """
+    بحث الـ inline: من الفهرس في الذاكرة إذا كان مفعلاً وجاهزاً، وإلا من قاعدة البيانات
+    """
+    if config.INLINE_SEARCH_BACKEND == 'memory':
+        inline_index.ensure_started()
+        if inline_index.ready:
+            started = time.monotonic()
+            results = inline_index.search(query, offset, limit)
+            search_strategy.record('inline', 'memory', started, len(results))
+            return results
+    return db.search_videos_for_inline(query, offset=offset, limit=limit)
+
+
+def get_inline_index_stats():
+    if config.INLINE_SEARCH_BACKEND != 'memory':
+        return None
+    return inline_index.get_stats()
@@ -0,0 +1,273 @@
+# ==============================================================================
+# ملف: series_index.py
+# الوصف: فهرس بادئات لأسماء المسلسلات (اقتراحات أثناء الكتابة في الـ inline)
+# ==============================================================================
+#
+# - الأسماء من metadata.series_name (extract_video_metadata)، مطبّعة بـ normalize_arabic
+#   حتى تشترك التهجئات المختلفة في اقتراح واحد
+# - مصفوفة مرتبة من (بداية كل كلمة في الاسم حتى آخره، الاسم): البادئة تُطابق أول
+#   الاسم أو أول أي كلمة فيه، والبحث bisect ثم مسح النطاق المطابق فقط
+# - الترتيب بمجموع مشاهدات فيديوهات المسلسل؛ نتائج كل بادئة تُحفظ حتى التغيير التالي
+# - التحديث تدريجي: register_archive_listener عند الإضافة/التعديل/الحذف، وزيادات
+#   write_behind للمشاهدات، مع إعادة بناء كاملة كل SERIES_INDEX_REFRESH_SECONDS
+
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+import config
+import db_manager as db
+from search_engine import normalize_arabic
+from write_behind import write_behind
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'\S+')
+
+# أقصى عدد بادئات محفوظة النتائج
+_MEMO_MAX_SIZE = 1000
+
+
+def _word_suffixes(key):
+    """الاسم من بداية كل كلمة فيه: 'قيامه عثمان' -> ['قيامه عثمان', 'عثمان']"""
+    return sorted({key[match.start():] for match in _WORD_RE.finditer(key)})
+
+
+class _Series:
+    __slots__ = ('name', 'views', 'videos')
+
+    def __init__(self, name):
+        self.name = name
+        self.views = 0
+        self.videos = 0
+
+
+class SeriesTypeaheadIndex:
+    """
+    اقتراحات أسماء المسلسلات من ذاكرة الـ process الحالي
+    """
+
+    def __init__(self, loader, refresh_interval=1800):
+        self._loader = loader
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._rebuild_requested = threading.Event()
+        self._series = {}
+        self._entries = []
+        self._videos = {}
+        self._memo = {}
+        self._pending = None
+        self._pid = None
+        self._thread = None
+        self._listeners_registered = False
+        self.ready = False
+        self.stats = {
+            'builds': 0,
+            'build_failures': 0,
+            'last_build_ms': 0.0,
+            'incremental_updates': 0,
+            'queries': 0,
+            'memo_hits': 0
+        }
+
+    # --- البناء والتحديث ---
+
+    def ensure_started(self):
+        """بدء البناء في الخلفية (مرة لكل process، آمن بعد fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if not self._listeners_registered:
+                db.register_archive_listener(self._on_archive_change)
+                write_behind.add_flush_listener(self._on_views_flushed)
+                self._listeners_registered = True
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="series-index", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.rebuild()
+            self._rebuild_requested.wait(self.refresh_interval)
+            self._rebuild_requested.clear()
+
+    def rebuild(self):
+        """
+        بناء الفهرس كاملاً خارج القفل ثم استبداله؛ التغييرات التي تصل أثناء البناء
+        تُعاد بعد الاستبدال
+        """
+        started = time.monotonic()
+        with self._lock:
+            self._pending = set()
+        try:
+            rows = self._loader()
+        except Exception as e:
+            logger.error(f"Series index build failed: {e}", exc_info=True)
+            with self._lock:
+                self._pending = None
+                self.stats['build_failures'] += 1
+            return False
+
+        series, videos = {}, {}
+        for row in rows:
+            self._add_video(series, videos, row)
+        entries = sorted((suffix, key) for key in series for suffix in _word_suffixes(key))
+
+        with self._lock:
+            self._series, self._entries, self._videos = series, entries, videos
+            self._memo = {}
+            pending, self._pending = self._pending, None
+            self.ready = True
+            self.stats['builds'] += 1
+            self.stats['last_build_ms'] = round((time.monotonic() - started) * 1000, 3)
+
+        if pending:
+            self._refresh(pending)
+        logger.info(f"Series index built: {len(series)} series in {self.stats['last_build_ms']} ms")
+        return True
+
+    @staticmethod
+    def _add_video(series, videos, row):
+        """إضافة فيديو لمسلسله؛ Returns: مفتاح المسلسل إذا كان جديداً"""
+        name = (row['series_name'] or '').strip()
+        key = normalize_arabic(name)
+        if not key:
+            return None
+        entry = series.get(key)
+        created = entry is None
+        if created:
+            entry = series[key] = _Series(name)
+        views = row['view_count'] or 0
+        entry.views += views
+        entry.videos += 1
+        videos[row['id']] = [key, views]
+        return key if created else None
+
+    def _remove_video(self, video_id):
+        previous = self._videos.pop(video_id, None)
+        if previous is None:
+            return
+        key, views = previous
+        entry = self._series[key]
+        entry.views -= views
+        entry.videos -= 1
+        if entry.videos <= 0:
+            del self._series[key]
+            for suffix in _word_suffixes(key):
+                pos = bisect_left(self._entries, (suffix, key))
+                if pos < len(self._entries) and self._entries[pos] == (suffix, key):
+                    del self._entries[pos]
+
+    def _on_archive_change(self, op, video_ids):
+        if op == 'reload' or video_ids is None:
+            self._rebuild_requested.set()
+            return
+        self._refresh(video_ids)
+
+    def _refresh(self, video_ids):
+        """إعادة تحميل فيديوهات محددة (ما لم يعد له اسم مسلسل يُحذف من مسلسله)"""
+        video_ids = set(video_ids)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.update(video_ids)
+        try:
+            rows = self._loader(video_ids) if video_ids else []
+        except Exception as e:
+            logger.error(f"Series index update failed, scheduling rebuild: {e}")
+            self._rebuild_requested.set()
+            return
+
+        with self._lock:
+            for video_id in video_ids:
+                self._remove_video(video_id)
+            for row in rows:
+                key = self._add_video(self._series, self._videos, row)
+                if key is not None:
+                    for suffix in _word_suffixes(key):
+                        insort(self._entries, (suffix, key))
+            self._memo = {}
+            self.stats['incremental_updates'] += 1
+
+    def _on_views_flushed(self, views):
+        """زيادات المشاهدة المكتوبة للتو تُضاف لمجموع المسلسل (تغيّر الترتيب فقط)"""
+        with self._lock:
+            changed = False
+            for video_id, increment in views.items():
+                previous = self._videos.get(video_id)
+                if previous is None or not increment:
+                    continue
+                previous[1] += increment
+                self._series[previous[0]].views += increment
+                changed = True
+            if changed:
+                self._memo = {}
+
+    # --- الاقتراحات ---
+
+    def suggest(self, prefix, limit=10):
+        """
+        Returns:
+            قائمة dicts (name, views, videos) للمسلسلات التي يبدأ اسمها أو إحدى
+            كلماتها بالبادئة، الأكثر مشاهدة أولاً
+        """
+        prefix = normalize_arabic(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            self.stats['queries'] += 1
+            keys = self._memo.get((prefix, limit))
+            if keys is not None:
+                self.stats['memo_hits'] += 1
+            else:
+                matched = set()
+                i = bisect_left(self._entries, (prefix,))
+                while i < len(self._entries) and self._entries[i][0].startswith(prefix):
+                    matched.add(self._entries[i][1])
+                    i += 1
+                keys = heapq.nlargest(limit, matched, key=lambda key: (self._series[key].views, key))
+                if len(self._memo) >= _MEMO_MAX_SIZE:
+                    self._memo = {}
+                self._memo[(prefix, limit)] = keys
+            return [
+                {'name': self._series[key].name, 'views': self._series[key].views, 'videos': self._series[key].videos}
+                for key in keys
+            ]
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'series': len(self._series),
+                'entries': len(self._entries),
+                'videos': len(self._videos),
+                **self.stats
+            }
+
+
+# مثيل عام
+series_index = SeriesTypeaheadIndex(db.load_series_rows, config.SERIES_INDEX_REFRESH_SECONDS)
+
+
+def suggest_series(query, limit=None):
+    """
+    اقتراحات المسلسلات للبادئة؛ قائمة فارغة إذا كانت معطلة أو قبل اكتمال البناء الأول
+    """
+    if not config.SERIES_TYPEAHEAD_ENABLED:
+        return []
+    series_index.ensure_started()
+    if not series_index.ready:
+        return []
+    return series_index.suggest(query, limit or config.SERIES_TYPEAHEAD_LIMIT)
+
+
+def get_series_index_stats():
+    if not config.SERIES_TYPEAHEAD_ENABLED:
+        return None
+    return series_index.get_stats()
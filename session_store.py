@@ -0,0 +1,233 @@
+# ==============================================================================
+# ملف: session_store.py
+# الوصف: تخزين مؤقت لجلسات المحادثة (آخر بحث، خطوات الآدمن) مع TTL وحجم محدود
+# ==============================================================================
+#
+# الـ backends (SESSION_BACKEND):
+#     memory    LRU + TTL داخل الـ process (الافتراضي؛ يكفي مع worker واحد)
+#     postgres  جدول UNLOGGED ephemeral_sessions مشترك بين الـ workers
+#     redis     خادم Redis (أو متوافق معه) عبر SESSION_REDIS_URL
+#
+# SessionStore يتصرف كقاموس (get / [] / in / del / pop) فلا تتغير أماكن الاستخدام؛
+# القيم يجب أن تكون قابلة للتحويل إلى JSON حتى تعمل مع الـ backends المشتركة.
+# القيمة المقروءة نسخة: تعديلها لا يُحفظ بدون إعادة تعيينها.
+
+import json
+import logging
+import threading
+import time
+
+import config
+from cache_utils import TTLCache
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class MemorySessionBackend:
+    """
+    جلسات في ذاكرة الـ process الحالي. القيم تُحفظ كـ JSON مثل الـ backends المشتركة،
+    فيظهر أي خطأ في نوع القيمة مبكراً ولا يختلف السلوك عند تغيير SESSION_BACKEND.
+    """
+
+    name = 'memory'
+
+    def __init__(self, max_entries=10000):
+        self._cache = TTLCache(max_entries=max_entries)
+
+    def get(self, namespace, key):
+        raw = self._cache.get((namespace, key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, namespace, key, value, ttl):
+        self._cache.set((namespace, key), json.dumps(value), ttl=ttl)
+
+    def delete(self, namespace, key):
+        self._cache.delete((namespace, key))
+
+    def pop(self, namespace, key):
+        value = self.get(namespace, key)
+        if value is not None:
+            self._cache.delete((namespace, key))
+        return value
+
+    def get_stats(self):
+        return self._cache.get_stats()
+
+
+class PostgresSessionBackend:
+    """
+    جلسات في جدول UNLOGGED (لا يُكتب في WAL، ويُفرّغ بعد توقف مفاجئ لقاعدة البيانات)
+    """
+
+    name = 'postgres'
+
+    def __init__(self, cleanup_interval=300):
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = time.monotonic()
+        self.stats = {
+            'backend_errors': 0,
+            'cleaned': 0
+        }
+
+    def get(self, namespace, key):
+        import db_manager as db
+        return db.session_get(namespace, str(key))
+
+    def set(self, namespace, key, value, ttl):
+        import db_manager as db
+        if not db.session_set(namespace, str(key), json.dumps(value), ttl):
+            self.stats['backend_errors'] += 1
+        self._maybe_cleanup()
+
+    def delete(self, namespace, key):
+        import db_manager as db
+        db.session_delete(namespace, str(key))
+
+    def pop(self, namespace, key):
+        import db_manager as db
+        return db.session_pop(namespace, str(key))
+
+    def _maybe_cleanup(self):
+        if time.monotonic() - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = time.monotonic()
+        import db_manager as db
+        self.stats['cleaned'] += db.cleanup_expired_sessions() or 0
+
+    def get_stats(self):
+        return dict(self.stats)
+
+
+class RedisSessionBackend:
+    """جلسات في Redis مع انتهاء الصلاحية من Redis نفسه (SET EX)"""
+
+    name = 'redis'
+
+    def __init__(self, url):
+        self._client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        self.stats = {
+            'backend_errors': 0
+        }
+
+    @staticmethod
+    def _key(namespace, key):
+        return f"session:{namespace}:{key}"
+
+    def _call(self, func, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except redis.RedisError as e:
+            self.stats['backend_errors'] += 1
+            logger.error(f"Session store (redis) error: {e}")
+            return None
+
+    def get(self, namespace, key):
+        raw = self._call(self._client.get, self._key(namespace, key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, namespace, key, value, ttl):
+        self._call(self._client.set, self._key(namespace, key), json.dumps(value), ex=max(1, int(ttl)))
+
+    def delete(self, namespace, key):
+        self._call(self._client.delete, self._key(namespace, key))
+
+    def pop(self, namespace, key):
+        pipeline = self._client.pipeline()
+        pipeline.get(self._key(namespace, key))
+        pipeline.delete(self._key(namespace, key))
+        result = self._call(pipeline.execute)
+        return json.loads(result[0]) if result and result[0] is not None else None
+
+    def get_stats(self):
+        return dict(self.stats)
+
+
+def create_session_backend(name=None):
+    """
+    إنشاء الـ backend المحدد في SESSION_BACKEND؛ عند تعذره يُستخدم memory
+    """
+    name = (name or config.SESSION_BACKEND).lower()
+    if name == 'postgres':
+        return PostgresSessionBackend()
+    if name == 'redis':
+        if redis is None:
+            logger.warning("SESSION_BACKEND=redis but the redis package is not installed; using memory")
+        elif not config.SESSION_REDIS_URL:
+            logger.warning("SESSION_BACKEND=redis but SESSION_REDIS_URL is not set; using memory")
+        else:
+            return RedisSessionBackend(config.SESSION_REDIS_URL)
+    elif name != 'memory':
+        logger.warning(f"Unknown SESSION_BACKEND '{name}'; using memory")
+    return MemorySessionBackend(config.SESSION_MAX_SIZE)
+
+
+class SessionStore:
+    """
+    واجهة قاموس لنطاق (namespace) واحد من الجلسات، مثل admin_steps أو user_last_search
+    """
+
+    def __init__(self, namespace, backend, ttl=1800):
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        value = self.backend.get(self.namespace, key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.backend.get(self.namespace, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.backend.set(self.namespace, key, value, self.ttl)
+
+    def __contains__(self, key):
+        return self.backend.get(self.namespace, key) is not None
+
+    def __delitem__(self, key):
+        self.backend.delete(self.namespace, key)
+
+    def pop(self, key, default=_MISSING):
+        value = self.backend.pop(self.namespace, key)
+        if value is None:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        return value
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_session_backend():
+    """الـ backend المشترك لكل نطاقات الجلسات (يُنشأ عند أول استخدام)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_session_backend()
+                logger.info(f"Session store backend: {_backend.name}")
+    return _backend
+
+
+def session_namespace(namespace, ttl=None):
+    return SessionStore(namespace, get_session_backend(), ttl or config.SESSION_TTL)
+
+
+def get_session_stats():
+    backend = get_session_backend()
+    return {
+        'backend': backend.name,
+        **backend.get_stats()
+    }
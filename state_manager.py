@@ -1,10 +1,22 @@
+import copy
 import json
 import logging
+import threading
 from typing import Optional, Dict, Any, Callable
-from db_manager import set_user_state, get_user_state, clear_user_state
+
+import config
+from cache_utils import TTLCache
+from db_listener import db_listener
+from db_manager import set_user_state, load_user_state, clear_user_state
 
 logger = logging.getLogger(__name__)
 
+# Other workers drop their cached entry for the user id sent on this channel
+STATE_NOTIFY_CHANNEL = 'user_state_changed'
+
+# Cached marker for "user has no state" (TTLCache returns None on a miss)
+_NO_STATE = False
+
 # State constants
 class States:
     WAITING_CHANNEL_ID = "waiting_channel_id"
@@ -21,34 +33,88 @@ class States:
     WAITING_NEW_THUMB_FOR_VIDEO = "waiting_new_thumb_for_video"
 
 class StateManager:
-    """Manages user conversation states using database storage."""
+    """
+    Manages user conversation states using database storage.
+
+    Reads go through a write-through cache: users with a state are cached for
+    STATE_CACHE_TTL, users without one for STATE_CACHE_NEGATIVE_TTL, so the
+    common text-message path does not touch Postgres. Changes are published on
+    STATE_NOTIFY_CHANNEL and other workers drop their copy; without NOTIFY the
+    TTLs bound how stale another worker can be.
+    """
     
-    def __init__(self):
+    def __init__(self, cache_ttl: int = 300, negative_ttl: int = 30, max_entries: int = 50000):
         self.handlers: Dict[str, Callable] = {}
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(max_entries=max_entries, default_ttl=cache_ttl)
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'db_reads': 0,
+            'db_errors': 0,
+            'remote_invalidations': 0
+        }
+        db_listener.subscribe(STATE_NOTIFY_CHANNEL, self._on_remote_change)
     
     def register_handler(self, state: str, handler: Callable):
         """Register a handler for a specific state."""
         self.handlers[state] = handler
         logger.info(f"Registered handler for state: {state}")
     
+    def _on_remote_change(self, payload):
+        # payload=None after the listener reconnects: notifications may have been missed
+        if payload is None:
+            self._cache.clear()
+            return
+        try:
+            user_id = int(payload)
+        except ValueError:
+            return
+        self._cache.delete(user_id)
+        with self._stats_lock:
+            self.stats['remote_invalidations'] += 1
+    
+    def _publish(self, user_id: int):
+        db_listener.notify(STATE_NOTIFY_CHANNEL, str(user_id))
+    
     def set_state(self, user_id: int, state: str, context: Optional[Dict[str, Any]] = None):
         """Set user state with optional context."""
-        set_user_state(user_id, state, context)
+        if set_user_state(user_id, state, context):
+            self._cache.set(user_id, {'state': state, 'context': copy.deepcopy(context)})
+        else:
+            self._cache.delete(user_id)
+        self._publish(user_id)
         logger.info(f"Set state '{state}' for user {user_id} with context: {context}")
     
     def get_state(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get user state and context."""
-        result = get_user_state(user_id)
+        db_listener.ensure_started()
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            return copy.deepcopy(cached) if cached is not _NO_STATE else None
+
+        with self._stats_lock:
+            self.stats['db_reads'] += 1
+        try:
+            result = load_user_state(user_id)
+        except Exception as e:
+            # No negative caching on errors: the user may be mid-flow (waiting_comment, ...)
+            logger.error(f"Failed to load state for user {user_id}: {e}")
+            with self._stats_lock:
+                self.stats['db_errors'] += 1
+            return None
         if result:
             # PostgreSQL JSONB returns dict directly, but handle string for compatibility
             context = result['context']
             if context and isinstance(context, str):
                 context = json.loads(context)
             
-            return {
+            user_state = {
                 'state': result['state'],
                 'context': context
             }
+            self._cache.set(user_id, user_state)
+            return copy.deepcopy(user_state)
+        self._cache.set(user_id, _NO_STATE, ttl=self.negative_ttl)
         return None
     
     def get_user_state(self, user_id: int) -> Optional[Dict[str, Any]]:
@@ -57,9 +123,21 @@ class StateManager:
     
     def clear_state(self, user_id: int):
         """Clear user state."""
-        clear_user_state(user_id)
+        if clear_user_state(user_id):
+            self._cache.set(user_id, _NO_STATE, ttl=self.negative_ttl)
+        else:
+            self._cache.delete(user_id)
+        self._publish(user_id)
         logger.info(f"Cleared state for user {user_id}")
     
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {
+            'cache': self._cache.get_stats(),
+            **stats
+        }
+    
     def handle_message(self, message, bot):
         """Handle incoming message based on user state."""
         user_id = message.from_user.id
@@ -101,7 +179,11 @@ class StateManager:
         return True  # User is in some state
 
 # Global state manager instance
-state_manager = StateManager()
+state_manager = StateManager(
+    cache_ttl=config.STATE_CACHE_TTL,
+    negative_ttl=config.STATE_CACHE_NEGATIVE_TTL,
+    max_entries=config.STATE_CACHE_MAX_SIZE
+)
 
 # Decorator for state handlers
 def state_handler(state: str):
@@ -0,0 +1,117 @@
+# ==============================================================================
+# ملف: update_dedup.py
+# الوصف: منع معالجة نفس التحديث مرتين عند إعادة إرساله من Telegram
+# ==============================================================================
+
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """
+    نافذة زمنية محدودة لآخر update_id تمت رؤيتها (ring buffer + set).
+    مع backend=postgres يُسجَّل التحديث أيضاً في جدول processed_updates المشترك بين
+    الـ workers عبر claim() عند بدء المعالجة، لا في مسار الرد على الـ webhook.
+    """
+
+    def __init__(self, window_seconds=600, max_size=10000, backend='memory'):
+        self.window_seconds = window_seconds
+        self.max_size = max(1, max_size)
+        self.backend = backend
+        self._order = deque()
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._last_db_cleanup = time.monotonic()
+        self.stats = {
+            'checked': 0,
+            'duplicates': 0,
+            'backend_errors': 0
+        }
+
+    def _evict(self, now):
+        # حذف الأقدم: إما خارج النافذة الزمنية أو لتجاوز الحجم الأقصى
+        while self._order and (
+            len(self._order) > self.max_size or now - self._order[0][1] > self.window_seconds
+        ):
+            old_id, seen_at = self._order.popleft()
+            # قد يكون المعرف أُعيد تسجيله بعد forget - لا نحذف التسجيل الأحدث
+            if self._seen.get(old_id) == seen_at:
+                del self._seen[old_id]
+
+    def _check_memory(self, update_id):
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            self.stats['checked'] += 1
+            if update_id in self._seen:
+                self.stats['duplicates'] += 1
+                return True
+            self._seen[update_id] = now
+            self._order.append((update_id, now))
+            return False
+
+    def is_duplicate(self, update_id):
+        """
+        التحقق من التحديث وتسجيله كمُستلم (في الذاكرة فقط، قبل الرد على الـ webhook).
+
+        Returns:
+            True إذا سبقت رؤية هذا update_id داخل النافذة
+        """
+        if update_id is None:
+            return False
+
+        duplicate = self._check_memory(update_id)
+        if duplicate:
+            logger.info(f"Dropping duplicate update {update_id}")
+        return duplicate
+
+    def claim(self, update_id):
+        """
+        مع backend=postgres: تسجيل التحديث في processed_updates قبل معالجته (من عامل
+        الطابور، بعد الرد على الـ webhook)، حتى لا يعالجه worker آخر استلمه أيضاً.
+
+        Returns:
+            False إذا سبق تسجيله في worker آخر
+        """
+        if update_id is None or self.backend != 'postgres':
+            return True
+
+        import db_manager as db
+
+        is_new = db.mark_update_processed(update_id)
+        with self._lock:
+            if is_new is None:
+                # عند تعذر الوصول لقاعدة البيانات نكتفي بالنافذة المحلية
+                self.stats['backend_errors'] += 1
+            elif not is_new:
+                self.stats['duplicates'] += 1
+            cleanup_due = time.monotonic() - self._last_db_cleanup > self.window_seconds
+            if cleanup_due:
+                self._last_db_cleanup = time.monotonic()
+
+        if cleanup_due:
+            db.cleanup_processed_updates(self.window_seconds)
+        if is_new is False:
+            logger.info(f"Dropping update {update_id} already processed by another worker")
+        return is_new is not False
+
+    def forget(self, update_id):
+        """
+        إزالة update_id من النافذة (عندما يُرفض التحديث قبل معالجته، ليُقبل عند إعادة إرساله)
+        """
+        with self._lock:
+            self._seen.pop(update_id, None)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'backend': self.backend,
+                'window_seconds': self.window_seconds,
+                'size': len(self._seen),
+                'max_size': self.max_size,
+                **self.stats
+            }
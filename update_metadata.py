@@ -9,6 +9,8 @@ import json
 import time
 import telebot
 
+import db_manager
+
 # استيراد المحلل الذكي الجديد من utils
 from utils import extract_video_metadata 
 
@@ -86,6 +88,8 @@ def run_update_and_report_progress(bot, chat_id, message_id):
                             logger.error(f"Error editing progress message: {e}")
 
             conn.commit()
+            # كل الفيديوهات تغيّرت: إعادة تحميل الكاشات والفهارس (هنا وفي باقي الـ processes)
+            db_manager._on_archive_changed('reload')
             bot.edit_message_text(f"✅ اكتملت إعادة بناء البيانات بنجاح!\n\n- تم فحص وتحديث: {updated_count} فيديو.", chat_id, message_id)
 
     except Exception as e:
@@ -0,0 +1,209 @@
+# ==============================================================================
+# ملف: update_queue.py
+# الوصف: طابور محدود لتحديثات Telegram - الرد على الـ webhook فوراً والمعالجة في الخلفية
+# ==============================================================================
+
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def get_update_user_id(update):
+    """
+    استخراج معرف المستخدم صاحب التحديث (رسالة، callback، أو inline query)
+    """
+    for attr in ('message', 'callback_query', 'inline_query'):
+        obj = getattr(update, attr, None)
+        if obj is not None and getattr(obj, 'from_user', None):
+            return obj.from_user.id
+    return None
+
+
+class UpdateQueueManager:
+    """
+    مدير طابور التحديثات: يوزع التحديثات على مسارات (lanes) تسلسلية حسب المستخدم.
+    تحديثات المستخدم الواحد تُعالج بالترتيب، والمستخدمون المختلفون يُعالجون بالتوازي.
+    """
+
+    def __init__(self, handler, workers=8, max_size=1000):
+        self.handler = handler
+        self.lanes_count = max(1, workers)
+        self.max_size = max(1, max_size)
+        # السعة الكلية موزعة بالتساوي على المسارات
+        self.lane_size = max(1, -(-self.max_size // self.lanes_count))
+        self._lanes = []
+        self._workers = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stopping = False
+        self.stats = {
+            'enqueued': 0,
+            'processed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'high_watermark': 0,
+            'total_wait_ms': 0.0,
+            'total_processing_ms': 0.0
+        }
+
+    def start(self):
+        """
+        تشغيل العمال (مرة واحدة لكل process - الخيوط لا تنتقل عبر fork)
+        """
+        if self._pid == os.getpid() and self._workers:
+            return True
+
+        with self._lock:
+            if self._pid == os.getpid() and self._workers:
+                return True
+
+            self._stopping = False
+            self._lanes = [queue.Queue(maxsize=self.lane_size) for _ in range(self.lanes_count)]
+            self._workers = []
+            for index, lane in enumerate(self._lanes):
+                worker = threading.Thread(
+                    target=self._worker_loop,
+                    args=(lane,),
+                    name=f"update-lane-{index}",
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+            self._pid = os.getpid()
+
+        logger.info(
+            f"Update queue started: {self.lanes_count} lanes, "
+            f"{self.lane_size} slots per lane"
+        )
+        return True
+
+    def get_lane_index(self, update):
+        """
+        اختيار المسار: حسب معرف المستخدم، أو update_id للتحديثات بدون مستخدم
+        """
+        key = get_update_user_id(update)
+        if key is None:
+            key = getattr(update, 'update_id', 0) or 0
+        return hash(key) % self.lanes_count
+
+    def submit(self, update):
+        """
+        إضافة تحديث لمسار المستخدم بدون انتظار.
+
+        Returns:
+            True إذا تمت الإضافة، False إذا كان المسار ممتلئاً
+        """
+        if self._stopping:
+            with self._stats_lock:
+                self.stats['rejected'] += 1
+            return False
+
+        self.start()
+        lane_index = self.get_lane_index(update)
+        try:
+            self._lanes[lane_index].put_nowait((update, time.monotonic()))
+        except queue.Full:
+            with self._stats_lock:
+                self.stats['rejected'] += 1
+            logger.warning(f"Update lane {lane_index} full ({self.lane_size}), rejecting update")
+            return False
+
+        depth = self.get_depth()
+        with self._stats_lock:
+            self.stats['enqueued'] += 1
+            if depth > self.stats['high_watermark']:
+                self.stats['high_watermark'] = depth
+        return True
+
+    def _worker_loop(self, lane):
+        while True:
+            item = lane.get()
+            if item is None:
+                lane.task_done()
+                break
+
+            update, enqueued_at = item
+            started_at = time.monotonic()
+            failed = False
+            try:
+                self.handler(update)
+            except Exception as e:
+                failed = True
+                logger.error(f"Error processing queued update: {e}", exc_info=True)
+            finally:
+                finished_at = time.monotonic()
+                with self._stats_lock:
+                    self.stats['failed' if failed else 'processed'] += 1
+                    self.stats['total_wait_ms'] += (started_at - enqueued_at) * 1000
+                    self.stats['total_processing_ms'] += (finished_at - started_at) * 1000
+                lane.task_done()
+
+    def stop(self, timeout=10):
+        """
+        إيقاف العمال بعد تفريغ ما تبقى في المسارات (خلال المهلة المحددة)
+        """
+        if self._pid != os.getpid() or not self._workers:
+            return False
+
+        self._stopping = True
+        deadline = time.monotonic() + timeout
+        while self.get_depth() and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        remaining = self.get_depth()
+        if remaining:
+            logger.warning(f"Update queue stopped with {remaining} unprocessed updates")
+
+        for lane in self._lanes:
+            try:
+                lane.put_nowait(None)
+            except queue.Full:
+                pass
+        for worker in self._workers:
+            worker.join(timeout=max(0.1, deadline - time.monotonic()))
+
+        self._workers = []
+        self._pid = None
+        logger.info("Update queue stopped")
+        return True
+
+    def get_lane_backlogs(self):
+        if self._pid != os.getpid():
+            return [0] * self.lanes_count
+        return [lane.qsize() for lane in self._lanes]
+
+    def get_depth(self):
+        return sum(self.get_lane_backlogs())
+
+    def get_stats(self):
+        """
+        مقاييس الطابور: عدد المسارات، تراكم كل مسار، ومتوسط أزمنة الانتظار والمعالجة
+        """
+        backlogs = self.get_lane_backlogs()
+        depth = sum(backlogs)
+        capacity = self.lane_size * self.lanes_count
+        with self._stats_lock:
+            stats = dict(self.stats)
+        finished = stats['processed'] + stats['failed']
+        return {
+            'depth': depth,
+            'max_size': capacity,
+            'utilization_percent': round(depth / capacity * 100, 2),
+            'lanes': self.lanes_count,
+            'lane_size': self.lane_size,
+            'lane_backlogs': backlogs,
+            'busiest_lane_backlog': max(backlogs) if backlogs else 0,
+            'workers_alive': sum(1 for w in self._workers if w.is_alive()),
+            'enqueued': stats['enqueued'],
+            'processed': stats['processed'],
+            'failed': stats['failed'],
+            'rejected': stats['rejected'],
+            'high_watermark': stats['high_watermark'],
+            'avg_wait_ms': round(stats['total_wait_ms'] / finished, 2) if finished else 0,
+            'avg_processing_ms': round(stats['total_processing_ms'] / finished, 2) if finished else 0
+        }
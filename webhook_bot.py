@@ -9,15 +9,31 @@ import hmac  # للمقارنة الآمنة ضد timing attacks
 import json
 import logging
 import threading  # إضافة threading
+import atexit
 from flask import Flask, request, jsonify, abort
 import telebot
 from telebot.types import Update
 
 # استيراد الوحدات المخصصة
-from db_manager import verify_and_repair_schema
+from db_manager import verify_and_repair_schema, get_required_channels_stats, get_category_registry_stats, get_search_cache_stats
+from db_listener import db_listener
+from db_pool import get_pool_stats
+from count_service import get_count_stats
+from search_engine import get_search_stats, start_search_backfill
+from search_index import get_inline_index_stats, start_inline_index
+from write_behind import get_write_behind_stats
+from session_store import get_session_stats
+from leaderboards import get_leaderboard_stats
 from handlers import register_all_handlers
+from handlers.markup_cache import get_markup_cache_stats
+from handlers.inline_cache import get_inline_result_cache_stats
+from handlers.inline_coalescer import inline_coalescer, get_inline_coalescer_stats
+from series_index import get_series_index_stats
 from state_manager import state_manager
 from history_cleaner import start_history_cleanup
+from update_queue import UpdateQueueManager
+from update_dedup import UpdateDeduplicator
+import config
 
 # --- إعداد نظام التسجيل ---
 logging.basicConfig(
@@ -174,8 +190,29 @@ def webhook():
             logger.warning("Invalid update object")
             abort(400)
         
-        # معالجة التحديث
-        process_update(update)
+        # تجاهل التحديثات المكررة (Telegram يعيد الإرسال عند البطء أو أخطاء 5xx)
+        if update_dedup and update_dedup.is_duplicate(update.update_id):
+            return jsonify({"ok": True, "duplicate": True})
+        
+        # آخر استعلام inline لكل مستخدم (لإهمال ما يتجاوزه استعلام أحدث أثناء الكتابة)
+        if update.inline_query:
+            inline_coalescer.note(update.inline_query)
+        
+        # معالجة التحديث (مباشرة أو عبر الطابور حسب الإعدادات)
+        if update_queue:
+            if not update_queue.submit(update):
+                if update_dedup:
+                    update_dedup.forget(update.update_id)
+                # الطابور ممتلئ: نطلب من Telegram إعادة المحاولة لاحقاً
+                response = jsonify({"ok": False, "error": "queue_full"})
+                response.headers['Retry-After'] = str(config.UPDATE_QUEUE_RETRY_AFTER)
+                return response, 503
+        else:
+            try:
+                process_update(update)
+            except Exception as e:
+                # الرد 200 رغم الخطأ حتى لا يعيد Telegram إرسال نفس التحديث
+                logger.error(f"Process update error: {e}", exc_info=True)
         
         return jsonify({"ok": True})
         
@@ -184,22 +221,86 @@ def webhook():
         return jsonify({"error": "server_error"}), 500
 
 def process_update(update):
+    """
+    معالجة تحديث واحد. الاستثناءات لا تُلتقط هنا: عامل الطابور يسجلها ويحسبها في
+    stats['failed']، وفي وضع sync يلتقطها الـ webhook.
+    """
+    # تسجيل مشترك بين الـ workers (backend=postgres) خارج مسار الرد على الـ webhook
+    if update_dedup and not update_dedup.claim(update.update_id):
+        return
+
+    # معالجة حالة المستخدم أولاً
+    if update.message and update.message.from_user:
+        if state_manager.handle_message(update.message, bot):
+            return
+    
+    # معالجة أنواع التحديثات المختلفة
+    if update.message:
+        bot.process_new_messages([update.message])
+    elif update.callback_query:
+        bot.process_new_callback_query([update.callback_query])
+    elif update.inline_query:
+        bot.process_new_inline_query([update.inline_query])
+
+# --- منع تكرار التحديثات ---
+update_dedup = None
+if config.UPDATE_DEDUP_BACKEND != 'off':
+    update_dedup = UpdateDeduplicator(
+        window_seconds=config.UPDATE_DEDUP_WINDOW,
+        max_size=config.UPDATE_DEDUP_MAX_SIZE,
+        backend=config.UPDATE_DEDUP_BACKEND
+    )
+
+# --- طابور التحديثات (وضع async) ---
+update_queue = None
+if config.UPDATE_PROCESSING_MODE == 'async':
+    update_queue = UpdateQueueManager(
+        process_update,
+        workers=config.UPDATE_WORKERS,
+        max_size=config.UPDATE_QUEUE_SIZE
+    )
+    # تفريغ ما تبقى في الطابور عند إيقاف العملية
+    # (atexit ينفذ بالترتيب العكسي: الطابور أولاً ثم كتابة مخزن write_behind)
+    atexit.register(update_queue.stop)
+    logger.info(f"✅ Async update processing enabled ({config.UPDATE_WORKERS} per-user lanes)")
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    admin_id = request.args.get('admin_id')
+    if not admin_id:
+        return jsonify({"status": "error", "message": "Missing admin_id parameter"}), 400
     try:
-        # معالجة حالة المستخدم أولاً
-        if update.message and update.message.from_user:
-            if state_manager.handle_message(update.message, bot):
-                return
-        
-        # معالجة أنواع التحديثات المختلفة
-        if update.message:
-            bot.process_new_messages([update.message])
-        elif update.callback_query:
-            bot.process_new_callback_query([update.callback_query])
-        elif update.inline_query:
-            bot.process_new_inline_query([update.inline_query])
-            
-    except Exception as e:
-        logger.error(f"Process update error: {e}", exc_info=True)
+        admin_id = int(admin_id)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid admin_id"}), 400
+    if admin_id not in ADMIN_IDS:
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+
+    return jsonify({
+        "pid": os.getpid(),
+        "processing_mode": "async" if update_queue else "sync",
+        "db_pool": get_pool_stats(),
+        "update_queue": update_queue.get_stats() if update_queue else None,
+        "update_dedup": update_dedup.get_stats() if update_dedup else None,
+        "db_listener": db_listener.get_stats(),
+        "required_channels": get_required_channels_stats(),
+        "categories": get_category_registry_stats(),
+        "counts": get_count_stats(),
+        "search": get_search_stats(),
+        "search_cache": get_search_cache_stats(),
+        "inline_index": get_inline_index_stats(),
+        "inline_results": get_inline_result_cache_stats(),
+        "inline_coalescer": get_inline_coalescer_stats(),
+        "series_index": get_series_index_stats(),
+        "write_behind": get_write_behind_stats(),
+        "leaderboards": get_leaderboard_stats(),
+        "markup_cache": get_markup_cache_stats(),
+        "user_states": state_manager.get_stats(),
+        "sessions": get_session_stats()
+    })
+
+if limiter:
+    limiter.exempt(metrics)
 
 @app.route("/set_webhook", methods=["POST", "GET"])
 def set_webhook():
@@ -1744,6 +1845,12 @@ def init_bot():
     
     # بدء تنظيف السجل
     start_history_cleanup()
+
+    # فهرسة الفيديوهات القديمة للبحث النصي
+    start_search_backfill()
+
+    # فهرس الـ inline في الذاكرة (INLINE_SEARCH_BACKEND=memory)
+    start_inline_index()
     
     return True
 
@@ -0,0 +1,323 @@
+# ==============================================================================
+# ملف: write_behind.py
+# الوصف: تجميع عدادات المشاهدة وسجل المشاهدة في الذاكرة وكتابتها دفعة واحدة
+# ==============================================================================
+#
+# بدلاً من UPDATE + UPSERT مع كل فتح فيديو:
+# - زيادات المشاهدة تُجمع لكل فيديو (view_count + n)
+# - سجل المشاهدة يحتفظ بآخر وقت فقط لكل (مستخدم، فيديو)
+# - الكتابة كل WRITE_BEHIND_FLUSH_INTERVAL ثانية أو عند بلوغ WRITE_BEHIND_MAX_PENDING
+#   بعبارة واحدة لكل جدول (unnest)، وعند إيقاف العملية (atexit)
+#
+# نافذة الفقد: إذا توقف الـ process فجأة تضيع الزيادات منذ آخر كتابة ناجحة.
+# كل process يكتب ملف نبض (heartbeat) في WRITE_BEHIND_STATE_DIR ويحذفه عند الإيقاف
+# السليم؛ عند البدء تُسجل الملفات المتبقية من processes متوقفة كنوافذ فقد محتملة.
+
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+import config
+import db_manager as db
+from count_service import count_service
+
+logger = logging.getLogger(__name__)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WriteBehindBuffer:
+    """
+    مخزن مؤقت لكتابات المشاهدة (لكل process)
+    """
+
+    def __init__(self, flush_interval=5, max_pending=1000, state_dir=None):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.state_dir = state_dir
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._views = {}
+        self._history = {}
+        self._pid = None
+        self._thread = None
+        self._stopping = False
+        self._last_flush_at = None
+        self._flush_listeners = []
+        self.stats = {
+            'views_recorded': 0,
+            'history_recorded': 0,
+            'flushes': 0,
+            'flush_failures': 0,
+            'views_flushed': 0,
+            'history_flushed': 0,
+            'dropped_views': 0,
+            'dropped_history': 0,
+            'last_flush_ms': 0.0,
+            'previous_loss_windows': []
+        }
+
+    # --- التسجيل ---
+
+    def ensure_started(self):
+        """بدء خيط الكتابة (مرة لكل process؛ الـ process الابن لا يرث بيانات الأب)"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            with self._lock:
+                self._views = {}
+                self._history = {}
+            self._pid = os.getpid()
+            self._stopping = False
+            self._last_flush_at = time.time()
+            self._report_previous_losses()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def record_view(self, video_id, user_id=None):
+        """
+        تسجيل مشاهدة فيديو (وإضافته لسجل المستخدم إذا تم تمرير user_id)
+        """
+        self.ensure_started()
+        now = time.time()
+        with self._lock:
+            self._views[video_id] = self._views.get(video_id, 0) + 1
+            self.stats['views_recorded'] += 1
+            if user_id is not None:
+                self._history[(user_id, video_id)] = now
+                self.stats['history_recorded'] += 1
+            pending = len(self._views) + len(self._history)
+        if pending >= self.max_pending:
+            self._flush_requested.set()
+
+    def add_flush_listener(self, callback):
+        """callback(views) بعد كل كتابة ناجحة، حيث views = {video_id: زيادة}"""
+        self._flush_listeners.append(callback)
+
+    # --- الكتابة ---
+
+    def _run(self):
+        while not self._stopping:
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush error: {e}", exc_info=True)
+            self._write_heartbeat()
+
+    def flush(self):
+        """
+        كتابة كل ما في المخزن الآن
+
+        Returns:
+            True إذا نجحت الكتابة (أو لم يكن هناك شيء للكتابة)
+        """
+        with self._flush_lock:
+            with self._lock:
+                views, self._views = self._views, {}
+                history, self._history = self._history, {}
+            if not views and not history:
+                self._last_flush_at = time.time()
+                return True
+
+            started = time.monotonic()
+            views_ok = not views or self._flush_views(views)
+            history_ok = not history or self._flush_history(history)
+
+            if not views_ok:
+                self._requeue_views(views)
+            if not history_ok:
+                self._requeue_history(history)
+
+            with self._lock:
+                self.stats['last_flush_ms'] = round((time.monotonic() - started) * 1000, 3)
+                if views_ok and history_ok:
+                    self.stats['flushes'] += 1
+                    self._last_flush_at = time.time()
+                else:
+                    self.stats['flush_failures'] += 1
+                if views_ok:
+                    self.stats['views_flushed'] += sum(views.values())
+                if history_ok:
+                    self.stats['history_flushed'] += len(history)
+
+            if history_ok:
+                for user_id in {user_id for user_id, _ in history}:
+                    count_service.invalidate('history', user_id)
+            if views_ok and views:
+                for callback in list(self._flush_listeners):
+                    try:
+                        callback(views)
+                    except Exception as e:
+                        logger.error(f"Error in write-behind flush listener: {e}", exc_info=True)
+            return views_ok and history_ok
+
+    def _flush_views(self, views):
+        video_ids = sorted(views)
+        return bool(db.increment_video_view_counts_bulk(video_ids, [views[i] for i in video_ids]))
+
+    def _flush_history(self, history):
+        keys = sorted(history)
+        return bool(db.add_to_history_bulk(
+            [user_id for user_id, _ in keys],
+            [video_id for _, video_id in keys],
+            [history[key] for key in keys]
+        ))
+
+    def _requeue_views(self, views):
+        with self._lock:
+            if len(self._views) + len(views) > self.max_pending * 10:
+                self.stats['dropped_views'] += sum(views.values())
+                logger.error(f"Write-behind buffer full, dropping {sum(views.values())} view increments")
+                return
+            for video_id, count in views.items():
+                self._views[video_id] = self._views.get(video_id, 0) + count
+
+    def _requeue_history(self, history):
+        with self._lock:
+            if len(self._history) + len(history) > self.max_pending * 10:
+                self.stats['dropped_history'] += len(history)
+                logger.error(f"Write-behind buffer full, dropping {len(history)} history entries")
+                return
+            for key, watched_at in history.items():
+                self._history[key] = max(watched_at, self._history.get(key, 0))
+
+    def stop(self, timeout=10):
+        """إيقاف الخيط وكتابة المتبقي (يُستدعى عند الإيقاف عبر atexit)"""
+        if self._pid != os.getpid():
+            return
+        self._stopping = True
+        self._flush_requested.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+        if self.flush():
+            self._remove_heartbeat()
+        else:
+            self._write_heartbeat()
+
+    # --- نافذة الفقد ---
+
+    def _heartbeat_path(self, pid=None):
+        return os.path.join(self.state_dir, f"write_behind.{pid or os.getpid()}.json")
+
+    def _write_heartbeat(self):
+        if not self.state_dir:
+            return
+        with self._lock:
+            state = {
+                'pid': os.getpid(),
+                'last_flush_at': self._last_flush_at,
+                'heartbeat_at': time.time(),
+                'flush_interval': self.flush_interval,
+                'pending_views': sum(self._views.values()),
+                'pending_history': len(self._history)
+            }
+        path = self._heartbeat_path()
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.warning(f"Could not write write-behind heartbeat: {e}")
+
+    def _remove_heartbeat(self):
+        if not self.state_dir:
+            return
+        try:
+            os.remove(self._heartbeat_path())
+        except OSError:
+            pass
+
+    def _report_previous_losses(self):
+        """تسجيل نوافذ الفقد للـ processes التي توقفت بدون كتابة مخزنها"""
+        if not self.state_dir:
+            return
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"Write-behind state dir unavailable: {e}")
+            return
+
+        for path in glob.glob(os.path.join(self.state_dir, "write_behind.*.json")):
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+                pid = int(state['pid'])
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Ignoring unreadable write-behind heartbeat {path}: {e}")
+                continue
+            if pid == os.getpid() or _process_alive(pid):
+                continue
+
+            # الكتابات بين آخر كتابة ناجحة وآخر نبض (+ فترة واحدة) قد تكون ضاعت
+            window = {
+                'pid': pid,
+                'from': state.get('last_flush_at'),
+                'to': (state.get('heartbeat_at') or 0) + state.get('flush_interval', self.flush_interval),
+                'pending_views': state.get('pending_views', 0),
+                'pending_history': state.get('pending_history', 0)
+            }
+            logger.warning(
+                f"Write-behind buffer of process {pid} was not flushed on exit: views/history between "
+                f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(window['from'] or 0))} and "
+                f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(window['to']))} may be lost "
+                f"(~{window['pending_views']} views, {window['pending_history']} history entries pending at last heartbeat)"
+            )
+            self.stats['previous_loss_windows'].append(window)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'pending_views': sum(self._views.values()),
+                'pending_history': len(self._history),
+                'last_flush_at': self._last_flush_at,
+                'flush_interval': self.flush_interval,
+                **self.stats
+            }
+
+
+# مثيل عام
+write_behind = WriteBehindBuffer(
+    flush_interval=config.WRITE_BEHIND_FLUSH_INTERVAL,
+    max_pending=config.WRITE_BEHIND_MAX_PENDING,
+    state_dir=config.WRITE_BEHIND_STATE_DIR
+)
+atexit.register(write_behind.stop)
+
+
+def record_video_view(user_id, video_id):
+    """
+    تسجيل مشاهدة: عبر المخزن المؤقت إذا كان مفعلاً، وإلا كتابة مباشرة كما في السابق
+    """
+    if config.WRITE_BEHIND_ENABLED:
+        write_behind.record_view(video_id, user_id)
+        return True
+    db.increment_video_view_count(video_id)
+    return db.add_to_history(user_id, video_id)
+
+
+def get_write_behind_stats():
+    if not config.WRITE_BEHIND_ENABLED:
+        return None
+    return write_behind.get_stats()